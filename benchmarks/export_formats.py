@@ -0,0 +1,159 @@
+"""
+Compares export time and file size of export formats.
+
+Each format writes synthetic expenses chunk by chunk the same way ExportRouter does. Raw file size and size
+of the file in zip archive are reported, synthetic data generation time is excluded. Legacy GeoJSON export
+with GeoDataFrame.to_file (a separate file for each chunk) is measured for comparison.
+
+Usage:
+    python -m benchmarks.export_formats [--rows 1000000] [--chunk-size 1000]
+"""
+import argparse
+import datetime as dt
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_chunks(rows, chunk_size, seed=0, geojson=False):
+    """
+    Generates synthetic expenses chunks as Expense.stream_for_export yields them.
+
+    Args:
+        rows (int): Total number of rows.
+        chunk_size (int): Rows in one chunk.
+        seed (int): Random seed.
+        geojson (bool): Whether to add geojson column as ST_AsGeoJSON returns it.
+
+    Yields:
+        pd.DataFrame: Expenses chunk (event_time, amount, subcategory, category, lon, lat and optional geojson).
+    """
+    rng = np.random.default_rng(seed)
+    categories = np.array([f'Category {i}' for i in range(8)])
+    subcategories = np.array([f'Subcategory {i}' for i in range(30)])
+    now = dt.datetime.now()
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        lon = rng.normal(37.62, 0.05, size)
+        lat = rng.normal(55.75, 0.03, size)
+        # About a third of expenses have no location
+        no_location = rng.random(size) < 0.3
+        lon[no_location] = np.nan
+        lat[no_location] = np.nan
+        chunk = pd.DataFrame({
+            'event_time': [now - dt.timedelta(seconds=int(s)) for s in rng.integers(0, 365 * 86400, size)],
+            'amount': rng.gamma(2, 500, size).round(2),
+            'subcategory': rng.choice(subcategories, size),
+            'category': rng.choice(categories, size),
+            'lon': lon,
+            'lat': lat,
+        })
+        if geojson:
+            chunk['geojson'] = [None if np.isnan(x) else f'{{"type":"Point","coordinates":[{x:.7f},{y:.7f}]}}'
+                                for x, y in zip(lon, lat)]
+        yield chunk
+
+
+def zipped_size(paths, folder):
+    """
+    Packs files into zip archive the same way ExportArchive does.
+
+    Args:
+        paths (list[str]): Files to pack.
+        folder (str): Folder to create archive in.
+
+    Returns:
+        int: Archive size in bytes.
+    """
+    archive_path = os.path.join(folder, 'archive.zip')
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            archive.write(path, arcname=os.path.basename(path))
+    size = os.path.getsize(archive_path)
+    os.remove(archive_path)
+    return size
+
+
+def generation_time(rows, chunk_size, geojson=False):
+    """
+    Measures synthetic data generation time to exclude it from results.
+
+    Returns:
+        float: Elapsed time.
+    """
+    start = time.perf_counter()
+    for _ in synthetic_chunks(rows, chunk_size, geojson=geojson):
+        pass
+    return time.perf_counter() - start
+
+
+def run_writer(export_format, rows, chunk_size, folder, geojson=False):
+    """
+    Writes synthetic expenses with export format writer.
+
+    Returns:
+        tuple[float, list[str]]: Elapsed time and written files.
+    """
+    path = os.path.join(folder, f'expenses.{export_format.extension}')
+    start = time.perf_counter()
+    writer = export_format(path)
+    for chunk in synthetic_chunks(rows, chunk_size, geojson=geojson):
+        writer.write(chunk)
+    writer.close()
+    return time.perf_counter() - start - generation_time(rows, chunk_size, geojson=geojson), [path]
+
+
+def run_legacy_geojson(rows, chunk_size, folder):
+    """
+    Writes synthetic expenses with GeoDataFrame.to_file, one file per chunk.
+
+    Returns:
+        tuple[float, list[str]]: Elapsed time and written files.
+    """
+    import geopandas as gpd
+
+    paths = []
+    start = time.perf_counter()
+    for i, chunk in enumerate(synthetic_chunks(rows, chunk_size)):
+        path = os.path.join(folder, f'expenses_{i}.geojson')
+        geometry = gpd.points_from_xy(chunk['lon'], chunk['lat'], crs=4326)
+        geometry[chunk['lon'].isna().values] = None
+        data = gpd.GeoDataFrame(chunk.drop(columns=['lon', 'lat']), geometry=geometry)
+        data.to_file(path, encoding='utf-8', driver='GeoJSON')
+        paths.append(path)
+    return time.perf_counter() - start - generation_time(rows, chunk_size), paths
+
+
+def main():
+    from bot.internal.export import EXPORT_FORMATS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Number of exported rows')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows in one chunk')
+    parser.add_argument('--skip-legacy', action='store_true', help='Do not measure legacy GeoJSON export')
+    args = parser.parse_args()
+
+    runs = {name: (lambda f: lambda folder: run_writer(f, args.rows, args.chunk_size, folder))(export_format)
+            for name, export_format in EXPORT_FORMATS.items()}
+    # Geometries encoded by PostGIS, as ExportRouter requests them for GeoJSON
+    runs['geojson-postgis'] = lambda folder: run_writer(EXPORT_FORMATS['geojson'], args.rows, args.chunk_size,
+                                                        folder, geojson=True)
+    if not args.skip_legacy:
+        runs['legacy-geojson'] = lambda folder: run_legacy_geojson(args.rows, args.chunk_size, folder)
+
+    print(f'{"format":<15} {"rows":>9} {"time, s":>9} {"raw, MB":>9} {"zipped, MB":>11}')
+    for name, run in runs.items():
+        with tempfile.TemporaryDirectory() as folder:
+            elapsed, paths = run(folder)
+            raw = sum(os.path.getsize(path) for path in paths)
+            zipped = zipped_size(paths, folder)
+        print(f'{name:<15} {args.rows:>9} {elapsed:>9.2f} {raw / 2 ** 20:>9.1f} '
+              f'{zipped / 2 ** 20:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
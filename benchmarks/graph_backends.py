@@ -0,0 +1,133 @@
+"""
+Compares render latency and peak RSS of graph rendering backends.
+
+Each backend renders expense cards for synthetic 30-day and 365-day datasets. Every run is performed in a fresh
+process, so peak RSS of one run doesn't affect the others. Kaleido runs chromium in a subprocess, its memory
+is reported separately as children RSS.
+
+Usage:
+    python -m benchmarks.graph_backends [--runs 3] [--per-day 20]
+"""
+import argparse
+import datetime as dt
+import multiprocessing
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+
+def synthetic_expenses(days, per_day, seed=0):
+    """
+    Generates synthetic raw expenses dataset.
+
+    Args:
+        days (int): Number of days to cover.
+        per_day (int): Average number of expenses per day.
+        seed (int): Random seed.
+
+    Returns:
+        gpd.GeoDataFrame: Expenses data.
+    """
+    import geopandas as gpd
+
+    rng = np.random.default_rng(seed)
+    size = days * per_day
+    now = dt.datetime.now()
+    event_time = [now - dt.timedelta(seconds=int(s)) for s in rng.integers(0, days * 86400, size)]
+    categories = np.array([f'Category {i}' for i in range(8)])
+    subcategories = np.array([f'Subcategory {i}' for i in range(30)])
+    lon = rng.normal(37.62, 0.05, size)
+    lat = rng.normal(55.75, 0.03, size)
+    return gpd.GeoDataFrame({
+        'expense_id': np.arange(size),
+        'amount': rng.gamma(2, 500, size).round(2),
+        'event_time': event_time,
+        'category': rng.choice(categories, size),
+        'subcategory': rng.choice(subcategories, size),
+    }, geometry=gpd.points_from_xy(lon, lat), crs=4326).rename_geometry('location')
+
+
+def aggregate(data, cell_degrees=0.003):
+    """
+    Aggregates synthetic expenses the same way Expense.select_stats and Expense.select_location_clusters
+    do in DB. Location clusters are approximated with grid cells.
+
+    Args:
+        data (gpd.GeoDataFrame): Raw expenses.
+        cell_degrees (float): Grid cell size in degrees.
+
+    Returns:
+        tuple[pd.DataFrame, pd.Series, pd.Series, pd.DataFrame]: GraphCreator input.
+    """
+    day = data['event_time'].dt.date.rename('day')
+    daily = data.groupby([day, 'category'])['amount'].sum().reset_index()
+    categories = data.groupby('category')['amount'].sum().sort_values(ascending=False)
+    subcategories = data.groupby('subcategory')['amount'].sum().sort_values(ascending=False)
+
+    points = data.assign(lon=data.location.x, lat=data.location.y)
+    for column in ('lon', 'lat'):
+        low, high = points[column].quantile([0.01, 0.99])
+        points = points[points[column].between(low, high)]
+    points = points.assign(weighted_lon=points.lon * points.amount, weighted_lat=points.lat * points.amount)
+    cells = [(points.lon // cell_degrees).rename('cell_x'), (points.lat // cell_degrees).rename('cell_y')]
+    clusters = points.groupby(cells).agg(weighted_lon=('weighted_lon', 'sum'), weighted_lat=('weighted_lat', 'sum'),
+                                         amount=('amount', 'sum'), count=('amount', 'size'))
+    clusters['lon'] = clusters.weighted_lon / clusters.amount
+    clusters['lat'] = clusters.weighted_lat / clusters.amount
+    return daily, categories, subcategories, clusters[['lon', 'lat', 'amount', 'count']].reset_index(drop=True)
+
+
+def render(backend, days, per_day, queue):
+    """
+    Renders expense cards once and puts elapsed time and peak RSS into queue.
+    """
+    from bot.internal.graphs import GraphCreator
+
+    daily, categories, subcategories, clusters = aggregate(synthetic_expenses(days, per_day))
+    min_date = dt.date.today() - dt.timedelta(days=days)
+
+    # Images are removed with the folder
+    with tempfile.TemporaryDirectory() as temp_folder:
+        start = time.perf_counter()
+        graph_creator = GraphCreator(data=daily, user_lang='en', backend=backend, temp_folder=temp_folder)
+        graph_creator.create_expense_cards(user_id=0, min_date=min_date, categories=categories,
+                                           subcategories=subcategories, clusters=clusters)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    queue.put((elapsed, self_rss, children_rss))
+
+
+def run(backend, days, per_day):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=render, args=(backend, days, per_day, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    from bot.internal.graph_backends import GRAPH_BACKENDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Runs per backend and dataset')
+    parser.add_argument('--per-day', type=int, default=20, help='Average expenses per day')
+    args = parser.parse_args()
+
+    print(f'{"backend":<8} {"days":>5} {"rows":>7} {"median, s":>10} {"peak RSS, MB":>13} {"children, MB":>13}')
+    for backend in GRAPH_BACKENDS:
+        for days in (30, 365):
+            results = [run(backend, days, args.per_day) for _ in range(args.runs)]
+            elapsed, self_rss, children_rss = np.array(results).T
+            print(f'{backend:<8} {days:>5} {days * args.per_day:>7} {np.median(elapsed):>10.3f} '
+                  f'{self_rss.max():>13.1f} {children_rss.max():>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
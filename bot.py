@@ -3,27 +3,35 @@ Entry point for bot application to run.
 """
 
 import asyncio
+import datetime as dt
 import os
 
 from aiohttp import web
 from aiogram import Bot
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import SimpleEventIsolation
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from loguru import logger
 
-from bot.middleware import UserLanguageMiddleware
+from bot.export_queue import ExportQueue
+from bot.purge_queue import PurgeQueue
+from bot.lanes import Lane, LaneMiddleware
+from bot.outbound import ThrottledSession, EditCoalescingRequestMiddleware, EditCoalescingMiddleware
+from bot.middleware import UserLanguageMiddleware, BufferedStateMiddleware, EarlyCallbackAnswerMiddleware
+from bot.storage import PostgresStorage, PostgresEventIsolation
+from bot.metrics import metrics_handler
+from bot.webhook import WebhookFront
+from bot.update_queue import BoundedRequestHandler
 from bot.routers import DeleteRouter, ExportRouter, GeneralRouter, NewRecordRouter, StatsRouter
 from bot.static.commands import en_commands_list, ru_commands_list
 from db import insert_or_update_static
 
 from configs import (BOT_TOKEN, BOT_ADMIN, BASE_DIR,
-                     scheduler, sync_engine, async_sess_maker,
+                     scheduler, sync_engine, async_sess_maker, lock_engine,
                      WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_URL, WEBHOOK_PATH,
-                     DEBUG)
+                     DEBUG, EXPORT_WORKERS, PURGE_WORKERS, FSM_TTL_HOURS, WEBHOOK_WORKERS,
+                     LIGHT_LANE_CONCURRENCY, HEAVY_LANE_CONCURRENCY, UPDATE_CONCURRENCY, UPDATE_QUEUE_SIZE)
 
 
 os.makedirs(os.path.join(BASE_DIR, 'logs'), exist_ok=True)
@@ -36,11 +44,18 @@ logger.configure(handlers=[
 ])
 
 
-async def on_startup(bot):
+async def on_startup(bot, export_queue, purge_queue, setup):
     """
-    Send message to admin user on bot startup.
+    Send message to admin user on bot startup. In multi-process mode only the first start of primary process
+    sets up the bot.
     """
     logger.info('Bot startup')
+    # Start export and purge workers, they also restart jobs interrupted in any process
+    await export_queue.start()
+    await purge_queue.start()
+    if not setup:
+        return
+
     await bot.send_message(chat_id=BOT_ADMIN, text='Bot started')
 
     # Clear pending updates
@@ -58,27 +73,56 @@ async def on_startup(bot):
     await insert_or_update_static()
 
 
-async def on_shutdown(bot):
+async def on_shutdown(bot, export_queue, purge_queue, heavy_lane, primary):
     """
     Send message to admin user on bot shutdown.
     """
     logger.info('Bot shutdown')
-    await bot.send_message(chat_id=BOT_ADMIN, text='Bot stopped')
+    await export_queue.stop()
+    await purge_queue.stop()
+    heavy_lane.shutdown()
+    if primary:
+        await bot.send_message(chat_id=BOT_ADMIN, text='Bot stopped')
+
+
+def common_configs(primary=True, setup=None):
+    """
+    Creates bot and dispatcher.
 
+    Args:
+        primary (bool): Whether this process runs scheduled jobs. In multi-process mode other processes
+            only add jobs to the scheduler.
+        setup (bool): Whether this process sets webhook and commands on startup.
+            Defaults to ``primary``. Restarted primary process doesn't repeat it.
 
-def common_configs():
-    # Create bot object
+    Returns:
+        tuple[Bot, Dispatcher]: Bot and dispatcher.
+    """
+    # Create bot object, its requests are rate limited to stay within Telegram flood limits
     defaults = DefaultBotProperties(parse_mode=ParseMode.HTML)
-    bot = Bot(token=BOT_TOKEN, default=defaults)
+    bot = Bot(token=BOT_TOKEN, session=ThrottledSession(), default=defaults)
+    # Merge edits of one message made by handler
+    bot.session.middleware(EditCoalescingRequestMiddleware())
     logger.debug('Created bot instance')
 
-    # Create storage
-    storage = MemoryStorage()
+    # Create storage, states are kept in DB, so they survive restarts
+    storage = PostgresStorage(ttl=dt.timedelta(hours=FSM_TTL_HOURS))
+    storage.schedule_cleanup(scheduler)
     logger.debug(f'Created {storage}')
 
+    # Create lanes, heavy lane threads render graphs and serialize exports off the event loop
+    light_lane = Lane('light', concurrency=LIGHT_LANE_CONCURRENCY)
+    heavy_lane = Lane('heavy', concurrency=HEAVY_LANE_CONCURRENCY, threads=HEAVY_LANE_CONCURRENCY + EXPORT_WORKERS)
+
+    # Create export jobs queue, its workers are started on startup
+    export_queue = ExportQueue(bot=bot, lane=heavy_lane, workers=EXPORT_WORKERS)
+    # Create purge jobs queue, its workers are started on startup
+    purge_queue = PurgeQueue(bot=bot, workers=PURGE_WORKERS)
+
     # Create dispatcher object and assign database objects as extra parameters to pass to bot
-    dp = Dispatcher(async_session=async_sess_maker, sync_engine=sync_engine,
-                    storage=storage, events_isolation=SimpleEventIsolation())
+    dp = Dispatcher(async_session=async_sess_maker, sync_engine=sync_engine, export_queue=export_queue,
+                    purge_queue=purge_queue, heavy_lane=heavy_lane, primary=primary, setup=primary if setup is None else setup,
+                    storage=storage, events_isolation=PostgresEventIsolation(lock_engine))
     logger.debug(f'Created dispatcher instance: {dp}')
 
     # Add routers
@@ -91,6 +135,11 @@ def common_configs():
     dp.include_routers(*routers)
     logger.debug(f'Added {", ".join([r.name for r in routers])} to dispatcher')
 
+    # Answer callback queries first, so button spinner doesn't wait for handler
+    callback_answer_middleware = EarlyCallbackAnswerMiddleware()
+    dp.callback_query.middleware.register(callback_answer_middleware)
+    logger.debug(f'Registered {callback_answer_middleware} for callback queries')
+
     # Create user language middleware object assigned to same async_sessionmaker as bot
     user_lang_middleware = UserLanguageMiddleware()
     # Register user language middleware
@@ -98,11 +147,29 @@ def common_configs():
     dp.callback_query.middleware.register(user_lang_middleware)
     logger.debug(f'Registered {user_lang_middleware} for messages and callback queries')
 
+    # Buffer FSM state changes of each handler into one storage write
+    buffered_state_middleware = BufferedStateMiddleware()
+    dp.message.middleware.register(buffered_state_middleware)
+    dp.callback_query.middleware.register(buffered_state_middleware)
+    logger.debug(f'Registered {buffered_state_middleware} for messages and callback queries')
+
+    # Send markup removal and text edit of one message as one request
+    edit_coalescing_middleware = EditCoalescingMiddleware()
+    dp.message.middleware.register(edit_coalescing_middleware)
+    dp.callback_query.middleware.register(edit_coalescing_middleware)
+    logger.debug(f'Registered {edit_coalescing_middleware} for messages and callback queries')
+
+    # Run heavy handlers in their own lane, so they don't delay interactive ones
+    lane_middleware = LaneMiddleware(light_lane=light_lane, heavy_lane=heavy_lane)
+    dp.message.middleware.register(lane_middleware)
+    dp.callback_query.middleware.register(lane_middleware)
+    logger.debug(f'Registered {lane_middleware} for messages and callback queries')
+
     # Register startup and shutdown actions
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    scheduler.start()
+    scheduler.start(paused=not primary)
 
     return bot, dp
 
@@ -113,14 +180,21 @@ async def start_polling(bot, dp):
 
 if __name__ == '__main__':
 
-    bot, dispatcher = common_configs()
     if DEBUG:
+        bot, dispatcher = common_configs()
         asyncio.run(start_polling(bot, dispatcher))
 
+    elif WEBHOOK_WORKERS > 1:
+        # Workers create their own bot and dispatcher
+        WebhookFront(create_bot=common_configs, workers=WEBHOOK_WORKERS).run()
+
     else:
+        bot, dispatcher = common_configs()
         app = web.Application()
-        webhook_requests_handler = SimpleRequestHandler(dispatcher, bot, handle_in_background=True)
+        webhook_requests_handler = BoundedRequestHandler(dispatcher, bot, concurrency=UPDATE_CONCURRENCY,
+                                                         queue_size=UPDATE_QUEUE_SIZE)
         webhook_requests_handler.register(app, path=WEBHOOK_PATH)
+        app.router.add_get('/metrics', metrics_handler)
         setup_application(app, dispatcher, bot=bot)
         logger.info('Bot is configured via webhook and ready to start')
         web.run_app(app, host=WEBAPP_HOST, port=int(WEBAPP_PORT))
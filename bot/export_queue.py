@@ -0,0 +1,274 @@
+"""
+Background processing of user data export jobs.
+
+Export requests are saved as jobs in DB and processed by job queue workers, so exports don't block update handlers,
+their number is limited in all bot processes together and interrupted exports are restarted.
+"""
+import os
+import datetime as dt
+import time
+
+from loguru import logger
+from aiogram.types import FSInputFile
+from aiogram.types import InputMediaDocument
+
+from bot import outbound
+from bot.job_queue import JobQueue
+from bot.routers import MessageTexts as MT
+from bot.internal.export import ExportArchive, CsvWriter, GeoJsonWriter, get_export_format
+from db import Expense, Income, UserTotals, ExportJob, ExportWatermark, ExportCache
+from configs import BASE_DIR
+
+
+class ExportQueue(JobQueue):
+    job_table = ExportJob
+    name = 'export'
+    # Min interval between progress message edits in seconds
+    PROGRESS_INTERVAL = 3
+
+    def __init__(self, bot, lane, workers=2):
+        """
+        Creates instance.
+
+        Args:
+            bot (Bot): Bot instance.
+            lane (Lane): Lane whose threads serialize export chunks.
+            workers (int): Max number of exports running at once in all bot processes.
+        """
+        super().__init__(bot=bot, workers=workers)
+        self.lane = lane
+
+    async def run(self, job):
+        """
+        Exports user's data as bulk traffic, so export files wait for interactive replies.
+
+        Args:
+            job (sqlalchemy.Row): Export job.
+        """
+        with outbound.bulk():
+            await self.export(job)
+
+    async def export(self, job):
+        """
+        Exports user's data into archive and sends it. Full export of unchanged data is sent again
+        from cache by Telegram file ids.
+
+        Args:
+            job (sqlalchemy.Row): Export job.
+        """
+        archive = ExportArchive(user_id=job.user_id, temp_folder=os.path.join(BASE_DIR, 'temp'))
+        progress = dict(expenses=0, incomes=0, edited_at=time.monotonic())
+        # Last exported record ids, watermarks are moved to them after the archive is sent
+        last_ids = dict()
+        try:
+            if not job.incremental:
+                file_ids = await ExportCache.select_file_ids(job.user_id, job.export_format, job.user_lang)
+                if file_ids is not None:
+                    await self.edit_status(job, MT('Экспорт завершён', 'Export is finished').get(job.user_lang))
+                    await self.__send_media_groups(media=[InputMediaDocument(media=file_id) for file_id in file_ids],
+                                                   chat_id=job.chat_id)
+                    logger.info(f'Sent cached export to user {job.user_id}')
+                    return
+                # Version is read before export, so records added during export make cached entry outdated
+                ledger_version = await UserTotals.select_ledger_version(job.user_id)
+
+            expense_formats, income_formats = self.export_formats(job.export_format)
+            watermarks = await ExportWatermark.select_by_user_id(job.user_id) if job.incremental else dict()
+            await self.export_expenses(archive, job, expense_formats, progress, last_ids,
+                                       after_id=watermarks.get(ExportWatermark.EXPENSES))
+            await self.export_incomes(archive, job, income_formats, progress, last_ids,
+                                      after_id=watermarks.get(ExportWatermark.INCOMES))
+            paths = archive.close()
+
+            texts = [MT('Экспорт завершён', 'Export is finished').get(job.user_lang)]
+            if progress['expenses'] == 0:
+                m_texts = MT('Нет новых расходов с прошлого экспорта', 'There are no new expenses since last export') \
+                    if job.incremental else MT('Вы ещё не записали ни одного расхода',
+                                               'You have not logged any expense yet')
+                texts.append(m_texts.get(job.user_lang))
+            if progress['incomes'] == 0:
+                m_texts = MT('Нет новых доходов с прошлого экспорта', 'There are no new incomes since last export') \
+                    if job.incremental else MT('Вы ещё не записали ни одного дохода',
+                                               'You have not logged any income yet')
+                texts.append(m_texts.get(job.user_lang))
+            await self.edit_status(job, '\n'.join(texts))
+
+            if len(paths) > 0:
+                input_medias = []
+                for i, path in enumerate(paths, start=1):
+                    fs = FSInputFile(path=path, filename=self.archive_out_filename(part=i, parts_count=len(paths)))
+                    input_medias.append(InputMediaDocument(media=fs))
+                file_ids = await self.__send_media_groups(media=input_medias, chat_id=job.chat_id)
+                if not job.incremental:
+                    await ExportCache.save(job.user_id, job.export_format, job.user_lang, ledger_version, file_ids)
+            await ExportWatermark.advance(job.user_id, last_ids)
+
+        finally:
+            archive.cleanup()
+
+    async def export_expenses(self, archive, job, export_formats, progress, last_ids, after_id=None):
+        """
+        Streams user's expenses into archive members.
+
+        Args:
+            archive (ExportArchive): Archive to write expenses.
+            job (sqlalchemy.Row): Export job.
+            export_formats (list[type[ExportWriter]]): Formats to write.
+            progress (dict): Exported rows counters.
+            last_ids (dict): Last exported record ids by export type, updated with exported expenses.
+            after_id (int): If passed, only expenses created after the one with this id are exported.
+        """
+        columns = self.expense_data_columns(user_lang=job.user_lang)
+        # Geometries are encoded by PostGIS only if GeoJSON is requested
+        geojson = GeoJsonWriter in export_formats
+        async for expense_chunk in Expense.stream_for_export(user_id=job.user_id, user_lang=job.user_lang,
+                                                             geojson=geojson, after_id=after_id):
+            self.__update_last_id(last_ids, ExportWatermark.EXPENSES, expense_chunk.pop('id'))
+            # Rename columns
+            expense_chunk = expense_chunk.rename(columns=columns)
+            rows_count = progress['expenses']
+            expense_chunk['i'] = range(rows_count + 1, rows_count + expense_chunk.shape[0] + 1)
+            progress['expenses'] += expense_chunk.shape[0]
+
+            for export_format in export_formats:
+                await self.lane.run(archive.write, 'expenses', expense_chunk, export_format)
+            await self.__update_progress(job, progress)
+
+    async def export_incomes(self, archive, job, export_formats, progress, last_ids, after_id=None):
+        """
+        Streams user's incomes into archive members.
+
+        Args:
+            archive (ExportArchive): Archive to write incomes.
+            job (sqlalchemy.Row): Export job.
+            export_formats (list[type[ExportWriter]]): Formats to write.
+            progress (dict): Exported rows counters.
+            last_ids (dict): Last exported record ids by export type, updated with exported incomes.
+            after_id (int): If passed, only incomes created after the one with this id are exported.
+        """
+        columns = self.income_data_columns(user_lang=job.user_lang)
+        passive_map = {True: 'Пассивный', False: 'Активный'} \
+            if job.user_lang == 'ru' else {True: 'Passive', False: 'Active'}
+        async for income_chunk in Income.stream_for_export(user_id=job.user_id, after_id=after_id):
+            self.__update_last_id(last_ids, ExportWatermark.INCOMES, income_chunk.pop('id'))
+            # Update data for user
+            income_chunk['passive_status'] = income_chunk['passive_status'].map(passive_map)
+            income_chunk = income_chunk.rename(columns=columns)
+            rows_count = progress['incomes']
+            income_chunk['i'] = range(rows_count + 1, rows_count + income_chunk.shape[0] + 1)
+            progress['incomes'] += income_chunk.shape[0]
+
+            for export_format in export_formats:
+                await self.lane.run(archive.write, 'incomes', income_chunk, export_format)
+            await self.__update_progress(job, progress)
+
+    @staticmethod
+    def export_formats(name):
+        """
+        Selects export formats by name.
+
+        Args:
+            name (str | None): Format name. If None, default formats are used.
+
+        Returns:
+            tuple[list[type[ExportWriter]], list[type[ExportWriter]]]: Expenses formats and incomes formats.
+                Incomes have no location, so they are exported as CSV instead of GeoJSON.
+
+        Raises:
+            ValueError: Unknown format.
+        """
+        if name is None:
+            return [CsvWriter, GeoJsonWriter], [CsvWriter]
+        export_format = get_export_format(name)
+        return [export_format], [CsvWriter if export_format is GeoJsonWriter else export_format]
+
+    @staticmethod
+    def archive_out_filename(part, parts_count):
+        out_filename = f'{dt.datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}_export'
+        if parts_count > 1:
+            out_filename += f'_{part}'
+        return out_filename + '.zip'
+
+    @staticmethod
+    def expense_data_columns(user_lang):
+        return {
+            'event_time': 'Дата платежа',
+            'amount': 'Сумма',
+            'subcategory': 'Подкатегория расходов',
+            'category': 'Категория расходов'
+        } if user_lang == 'ru' else {
+            'event_time': 'Payment date',
+            'amount': 'Money amount',
+            'subcategory': 'Expense subcategory',
+            'category': 'Expense category'
+        }
+
+    @staticmethod
+    def income_data_columns(user_lang):
+        return {
+            'event_date': 'Дата получения дохода',
+            'amount': 'Сумма',
+            'passive_status': 'Тип дохода'
+        } if user_lang == 'ru' else {
+            'event_date': 'Income date',
+            'amount': 'Money amount',
+            'passive_status': 'Income type'
+        }
+
+    @staticmethod
+    def __update_last_id(last_ids, export_type, ids):
+        """
+        Keeps the max exported record id.
+
+        Args:
+            last_ids (dict): Last exported record ids by export type.
+            export_type (str): Exported records type.
+            ids (pd.Series): Exported records ids.
+        """
+        if ids.shape[0] > 0:
+            last_ids[export_type] = max(last_ids.get(export_type, 0), int(ids.max()))
+
+    async def __update_progress(self, job, progress):
+        """
+        Edits status message with exported rows counters, if PROGRESS_INTERVAL has passed since the last edit.
+
+        Args:
+            job (sqlalchemy.Row): Export job.
+            progress (dict): Exported rows counters.
+        """
+        if time.monotonic() - progress['edited_at'] < self.PROGRESS_INTERVAL:
+            return
+        m_texts = MT(f'Экспортирую... Расходов: {progress["expenses"]}, доходов: {progress["incomes"]}',
+                     f'Exporting... Expenses: {progress["expenses"]}, incomes: {progress["incomes"]}')
+        await self.edit_status(job, m_texts.get(job.user_lang))
+        progress['edited_at'] = time.monotonic()
+
+    @staticmethod
+    def error_text(user_lang):
+        m_texts = MT(
+            ru_text='К сожалению, что-то пошло не так. Попробуйте ещё раз позже',
+            en_text='Unfortunately, something went wrong. Please try again later'
+        )
+        return m_texts.get(user_lang)
+
+    async def __send_media_groups(self, media, chat_id):
+        """
+        Sends media groups with 10 files max in one group. Single file is sent as a document,
+        because media group must contain at least 2 files.
+
+        Args:
+            media (list[InputMediaDocument]): Media files.
+            chat_id (int): Chat ID.
+
+        Returns:
+            list[str]: Telegram file ids of sent documents.
+        """
+        file_ids = []
+        for i in range(0, len(media), 10):
+            group = media[i:i + 10]
+            if len(group) == 1:
+                messages = [await self.bot.send_document(chat_id=chat_id, document=group[0].media)]
+            else:
+                messages = await self.bot.send_media_group(chat_id=chat_id, media=group)
+            file_ids.extend(message.document.file_id for message in messages)
+        return file_ids
@@ -8,12 +8,11 @@ class DeleteExpenseLimitStates(StatesGroup):
     get_user_title = State()
 
 
-class ExportStates(StatesGroup):
+class NearbyExpensesStates(StatesGroup):
     """
-    States group for export user's data process.
+    States group for expenses nearby statistics.
     """
-    export_expenses = State()
-    export_incomes = State()
+    get_location = State()
 
 
 class NewChoice(StatesGroup):
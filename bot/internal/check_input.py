@@ -149,14 +149,29 @@ def event_datetime_from_user_message(user_message_text, user_lang, past=True):
             return None, m_texts.get(user_lang)
 
 
-def tg_location_to_geometry(tg_location):
+def tg_location_to_coordinates(tg_location):
     """
-    Converts telegram location to shapely.geometry.point.
+    Converts telegram location to plain coordinates, so it can be kept in FSM data.
 
     Args:
         tg_location (Location): Telegram location.
 
     Returns:
-        Point: Shapely point.
+        tuple[float, float]: Longitude and latitude.
     """
-    return Point(tg_location.longitude, tg_location.latitude)
+    return tg_location.longitude, tg_location.latitude
+
+
+def coordinates_to_geometry(coordinates):
+    """
+    Converts coordinates to shapely.geometry.point.
+
+    Args:
+        coordinates (tuple[float, float] | None): Longitude and latitude.
+
+    Returns:
+        Point | None: Shapely point, None if there are no coordinates.
+    """
+    if coordinates is None:
+        return None
+    return Point(*coordinates)
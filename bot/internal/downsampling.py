@@ -0,0 +1,46 @@
+"""
+Series downsampling for graphs, so that images stay the same size no matter how many points the data has.
+"""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Selects points with Largest-Triangle-Three-Buckets algorithm. First and last points are always kept,
+    the rest of points are split into equal buckets and the point forming the largest triangle with
+    previously selected point and next bucket average is selected from each bucket.
+
+    Args:
+        x (np.ndarray): Numeric x values sorted in ascending order.
+        y (np.ndarray): Numeric y values.
+        threshold (int): Max number of points to keep.
+
+    Returns:
+        np.ndarray: Indices of selected points in ascending order.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.shape[0]
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket bounds, first and last points are buckets on their own
+    bounds = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(int) + 1
+    bounds[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        # Next bucket average, the last point for the last bucket
+        next_end = bounds[i + 2] if i + 2 < bounds.shape[0] else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
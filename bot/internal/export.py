@@ -0,0 +1,312 @@
+"""
+User data export archives and formats.
+
+Export members are written chunk by chunk by format writers into temp files, so memory usage doesn't depend
+on user data size. When the members raw size reaches the limit, they are packed into a zip archive and the next
+part is started, so each archive fits into Telegram upload limit.
+
+Data chunks are expected to keep coordinates in ``lon`` and ``lat`` float columns. Spatial formats convert them
+into point geometries, missing coordinates are NaN and produce empty geometries. Chunks may also contain
+``geojson`` column with geometries already encoded by PostGIS, it is only used by GeoJSON writer.
+"""
+import os
+import json
+import zipfile
+import datetime as dt
+from abc import ABC, abstractmethod
+from random import randint
+
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+
+class ExportWriter(ABC):
+    """
+    Base class for streaming export format writers.
+    """
+    name = None
+    extension = None
+
+    def __init__(self, path):
+        """
+        Creates instance and opens file.
+
+        Args:
+            path (str): Path to file to write.
+        """
+        self.path = path
+        self.file = open(path, 'wb')
+
+    @abstractmethod
+    def write(self, data):
+        """
+        Appends data chunk to file.
+
+        Args:
+            data (pd.DataFrame): Data chunk.
+        """
+
+    def close(self):
+        """
+        Finishes file and closes it.
+        """
+        self.file.close()
+
+    def size(self):
+        """
+        Returns:
+            int: Number of bytes written.
+        """
+        return self.file.tell()
+
+    @staticmethod
+    def points(data):
+        """
+        Converts lon / lat columns into points array.
+
+        Args:
+            data (pd.DataFrame): Data chunk.
+
+        Returns:
+            gpd.array.GeometryArray: Points, None for missing coordinates.
+        """
+        geometry = gpd.points_from_xy(data['lon'], data['lat'], crs=4326)
+        geometry[data['lon'].isna().values] = None
+        return geometry
+
+
+class CsvWriter(ExportWriter):
+    """
+    Writes CSV file, header is written with the first chunk.
+    """
+    name = 'csv'
+    extension = 'csv'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.__header = True
+
+    def write(self, data):
+        data = data.drop(columns=['geojson'], errors='ignore')
+        data.to_csv(self.file, index=False, header=self.__header, encoding='utf-8')
+        self.__header = False
+
+
+class GeoJsonWriter(ExportWriter):
+    """
+    Writes GeoJSON FeatureCollection chunk by chunk. Properties are encoded with pandas JSON encoder and spliced
+    with geometries encoded by PostGIS (``geojson`` column) or formatted straight from coordinates, so no
+    geometry objects are created.
+    """
+    name = 'geojson'
+    extension = 'geojson'
+    POINT_TEMPLATE = '{"type": "Point", "coordinates": [%.7f, %.7f]}'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.file.write(b'{"type": "FeatureCollection", "features": [\n')
+        self.__empty = True
+
+    def write(self, data):
+        if data.shape[0] == 0:
+            return
+
+        if 'geojson' in data.columns:
+            geometries = ['null' if geometry is None else geometry for geometry in data['geojson'].tolist()]
+        elif 'lon' in data.columns:
+            # NaN is the only value not equal to itself
+            geometries = ['null' if lon != lon else self.POINT_TEMPLATE % (lon, lat)
+                          for lon, lat in zip(data['lon'].tolist(), data['lat'].tolist())]
+        else:
+            geometries = ['null'] * data.shape[0]
+        data = data.drop(columns=['lon', 'lat', 'geojson'], errors='ignore')
+        properties = data.to_json(orient='records', lines=True, date_format='iso', force_ascii=False).splitlines()
+
+        features = ',\n'.join(f'{{"type": "Feature", "properties": {feature_properties}, "geometry": {geometry}}}'
+                               for feature_properties, geometry in zip(properties, geometries))
+        if not self.__empty:
+            self.file.write(b',\n')
+        self.file.write(features.encode('utf-8'))
+        self.__empty = False
+
+    def close(self):
+        self.file.write(b'\n]}\n')
+        super().close()
+
+
+class ParquetWriter(ExportWriter):
+    """
+    Writes Parquet file, each chunk is a separate row group. Location is stored as WKB in GeoParquet
+    compatible column.
+    """
+    name = 'parquet'
+    extension = 'parquet'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.__writer = None
+
+    def write(self, data):
+        data = data.drop(columns=['geojson'], errors='ignore')
+        if 'lon' in data.columns:
+            data = data.drop(columns=['lon', 'lat']).assign(location=shapely.to_wkb(self.points(data)))
+
+        if self.__writer is None:
+            table = pa.Table.from_pandas(data, preserve_index=False)
+            schema = table.schema
+            if 'location' in data.columns:
+                # Column may be all nulls in the first chunk
+                schema = schema.set(schema.get_field_index('location'), pa.field('location', pa.binary()))
+                geo = {'version': '1.0.0', 'primary_column': 'location',
+                       'columns': {'location': {'encoding': 'WKB', 'geometry_types': ['Point']}}}
+                schema = schema.with_metadata({**(schema.metadata or {}), b'geo': json.dumps(geo).encode('utf-8')})
+            self.__writer = pq.ParquetWriter(self.file, schema=schema)
+
+        self.__writer.write_table(pa.Table.from_pandas(data, schema=self.__writer.schema, preserve_index=False))
+
+    def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+        super().close()
+
+
+EXPORT_FORMATS = {export_format.name: export_format for export_format in (CsvWriter, GeoJsonWriter, ParquetWriter)}
+
+
+def get_export_format(name):
+    """
+    Gets export format writer class by its name.
+
+    Args:
+        name (str): Format name.
+
+    Returns:
+        type[ExportWriter]: Writer class.
+    """
+    try:
+        return EXPORT_FORMATS[name]
+    except KeyError:
+        raise ValueError(f'Unknown export format {name}, available: {", ".join(EXPORT_FORMATS.keys())}')
+
+
+def parse_export_args(args):
+    """
+    Parses export command arguments.
+
+    Args:
+        args (str | None): Command arguments: optional format name and optional ``new`` keyword in any order.
+
+    Returns:
+        tuple[str | None, bool]: Format name (None for default formats) and incremental export flag.
+
+    Raises:
+        ValueError: Unknown format or more than one format.
+    """
+    words = [] if args is None else args.lower().split()
+    incremental = 'new' in words
+    formats = [word for word in words if word != 'new']
+    if len(formats) > 1:
+        raise ValueError('Only one export format can be chosen')
+    export_format = formats[0] if len(formats) == 1 else None
+    if export_format is not None:
+        get_export_format(export_format)
+    return export_format, incremental
+
+
+class ExportArchive:
+    # Telegram bots can upload files up to 50 MB, raw size is checked, so compressed part is always smaller
+    MAX_PART_SIZE = 45 * 1024 * 1024
+
+    def __init__(self, user_id, temp_folder, max_part_size=None):
+        """
+        Creates instance.
+
+        Args:
+            user_id (int): User's id for filenames.
+            temp_folder (str): Folder for members and archives, created if missing.
+            max_part_size (int): Max raw size of members in one archive in bytes. Defaults to MAX_PART_SIZE.
+        """
+        self.user_id = user_id
+        self.max_part_size = self.MAX_PART_SIZE if max_part_size is None else max_part_size
+
+        self.temp_folder = temp_folder
+        os.makedirs(self.temp_folder, exist_ok=True)
+
+        self.__members = dict()
+        self.__parts = []
+
+    def write(self, name, data, export_format):
+        """
+        Appends data chunk to archive member. Starts new part, if current one reached max size.
+
+        Args:
+            name (str): Member filename in archive without extension.
+            data (pd.DataFrame): Data chunk.
+            export_format (type[ExportWriter]): Member format writer class.
+        """
+        if sum(member.size() for member in self.__members.values()) >= self.max_part_size:
+            self.__pack_part()
+
+        arcname = f'{name}.{export_format.extension}'
+        if arcname not in self.__members:
+            self.__members[arcname] = export_format(self.__temp_filename(arcname))
+        self.__members[arcname].write(data)
+
+    def close(self):
+        """
+        Packs the last part and returns all archives.
+
+        Returns:
+            list[str]: Paths to archives.
+        """
+        self.__pack_part()
+        return list(self.__parts)
+
+    def cleanup(self):
+        """
+        Deletes archives and member temp files.
+        """
+        for member in self.__members.values():
+            member.file.close()
+        paths = [member.path for member in self.__members.values()] + self.__parts
+        self.__members = dict()
+        self.__parts = []
+        for path in paths:
+            if os.path.exists(path) and os.path.isfile(path):
+                os.remove(path)
+                logger.info(f'Deleted {path}')
+
+    def __pack_part(self):
+        """
+        Closes current part members and packs them into zip archive.
+        """
+        if len(self.__members) == 0:
+            return
+
+        part_path = self.__temp_filename(f'export_{len(self.__parts) + 1}.zip')
+        with zipfile.ZipFile(part_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for arcname, member in self.__members.items():
+                member.close()
+                archive.write(member.path, arcname=arcname)
+                os.remove(member.path)
+        self.__members = dict()
+        self.__parts.append(part_path)
+        logger.info(f'Created {part_path}')
+
+    def __temp_filename(self, name):
+        """
+        Generates unique temp filename.
+
+        Args:
+            name (str): Base filename.
+
+        Returns:
+            str: Filepath.
+        """
+        fn = f'{self.user_id}_{dt.datetime.now().strftime("%d%H%M%S")}_{name}'
+        while os.path.exists(os.path.join(self.temp_folder, fn)):
+            fn = f'{randint(1, 10)}{fn}'
+        return os.path.join(self.temp_folder, fn)
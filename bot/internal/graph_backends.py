@@ -0,0 +1,314 @@
+"""
+Rendering backends for GraphCreator.
+
+GraphCreator prepares data to draw, backend only draws it and saves image to file. Backend is selected
+per deployment with GRAPH_BACKEND config value.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from plotly.subplots import make_subplots
+from plotly import graph_objects as go
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import DateFormatter
+
+
+class GraphBackend(ABC):
+    """
+    Base class for graph rendering backends.
+    """
+    name = None
+
+    def __init__(self, main_color, light_color, font_size):
+        """
+        Creates instance.
+
+        Args:
+            main_color (str): Main color hex value.
+            light_color (str): Light color hex value.
+            font_size (int): Base font size.
+        """
+        self.MAIN_COLOR = main_color
+        self.LIGHT_COLOR = light_color
+        self.FONT_SIZE = font_size
+
+    @abstractmethod
+    def line_plot(self, fp, lines, date_list, max_y, title, y_title, x_title):
+        """
+        Draws line plot and saves it as png file.
+
+        Args:
+            fp (str): Path to save image.
+            lines (list[dict]): Lines to draw. Each line has label, x, y and color (rgb tuple) keys.
+            date_list (np.ndarray): Dates to put on x axis.
+            max_y (float): Y axis max value.
+            title (str): Graph title.
+            y_title (str): Y axis title.
+            x_title (str): X axis title.
+        """
+
+    @abstractmethod
+    def bar_charts(self, fp, bars, titles, title):
+        """
+        Draws horizontal bar charts in one row and saves them as png file.
+
+        Args:
+            fp (str): Path to save image.
+            bars (list[pd.Series]): Bars data, index is used as labels.
+            titles (list[str]): Subplot titles.
+            title (str): Graph title.
+        """
+
+    @abstractmethod
+    def map_plot(self, fp, lon, lat, sizes, title):
+        """
+        Draws points on map and saves it as png file.
+
+        Args:
+            fp (str): Path to save image.
+            lon (np.ndarray): Points longitudes.
+            lat (np.ndarray): Points latitudes.
+            sizes (np.ndarray): Points sizes in px.
+            title (str): Graph title.
+        """
+
+
+class PlotlyBackend(GraphBackend):
+    """
+    Renders graphs with plotly and kaleido. Map is drawn over online carto tiles.
+    """
+    name = 'plotly'
+
+    def line_plot(self, fp, lines, date_list, max_y, title, y_title, x_title):
+        figure = go.Figure()
+        for line_data in lines:
+            color = self.__rgb(line_data['color'])
+            line = go.Scatter(x=line_data['x'], y=line_data['y'], **self.__line_plot_static_kwargs(marker_color=color))
+            figure.add_trace(line)
+            annotation_data = dict(x=line.x[-1], y=line.y[-1], text=line_data['label'])
+            figure.add_annotation(**annotation_data, font=dict(color=color))
+
+        figure.update_xaxes(**self.__line_plot_xaxis_kwargs(date_list, x_title))
+        figure.update_yaxes(**self.__line_plot_yaxis_kwargs(max_y, y_title))
+        figure.update_layout(title=title, **self.__figure_layout_static_kwargs())
+        figure.write_image(fp, width=1000, height=500, format='png', scale=3)
+
+    def bar_charts(self, fp, bars, titles, title):
+        figure = make_subplots(rows=1, cols=len(bars), horizontal_spacing=0.15, subplot_titles=titles)
+        for i, data in enumerate(bars):
+            bar = go.Bar(x=data.values, y=data.index, text=data.values, **self.__bar_chart_static_kwargs())
+            figure.add_trace(bar, row=1, col=i + 1)
+        figure.update_xaxes(visible=False)
+        figure.update_yaxes(visible=True)
+        figure.update_layout(title=title, **self.__figure_layout_static_kwargs())
+        figure.write_image(fp, width=1000, height=500, format='png', scale=3)
+
+    def map_plot(self, fp, lon, lat, sizes, title):
+        figure = make_subplots(rows=1, cols=1, specs=[[{'type': 'mapbox'}]])
+
+        figure.add_trace(go.Scattermapbox(
+            lat=lat,
+            lon=lon,
+            mode='markers',
+            marker=dict(size=sizes, opacity=1, color=self.MAIN_COLOR, sizemin=2),
+        ), row=1, col=1)
+
+        map_center = {
+            "lat": lat.mean(),
+            "lon": lon.mean()
+        }
+
+        max_bound = max(abs(lon.max() - lon.min()), abs(lat.max() - lat.min())) * 111
+        if max_bound != 0:
+            zoom = 12 - np.log(max_bound)
+        else:
+            zoom = 10
+
+        figure.update_layout(
+            width=500, height=600,
+            title=title,
+            title_font=dict(size=self.FONT_SIZE, color=self.LIGHT_COLOR),
+            mapbox_style="carto-positron",
+            mapbox_zoom=zoom,
+            mapbox_center=map_center,
+            margin={"r": 0, "t": self.FONT_SIZE * 2.5, "l": 0, "b": 0},
+            paper_bgcolor=self.MAIN_COLOR,
+        )
+        figure.write_image(fp, width=500, height=600, format='png', scale=3)
+
+    @staticmethod
+    def __rgb(color):
+        return f'rgb({",".join(map(str, color))})'
+
+    def __line_plot_static_kwargs(self, marker_color=None):
+        return dict(
+            line=dict(color=self.LIGHT_COLOR, width=1, dash='dot'),
+            mode='lines+markers',
+            marker=dict(color=self.MAIN_COLOR if marker_color is None else marker_color),
+        )
+
+    def __line_plot_xaxis_kwargs(self, date_list, x_title):
+        general_kwargs = dict(
+            showgrid=True,
+            gridwidth=0.5,
+            linewidth=1,
+            gridcolor=self.LIGHT_COLOR,
+            tickformat='%d.%m.%Y'
+        )
+
+        general_kwargs['title'] = x_title
+        if len(date_list) / 3 < 2:
+            general_kwargs['tickvals'] = date_list
+            general_kwargs['ticktext'] = date_list
+        else:
+            general_kwargs['tickvals'] = date_list[::3]
+            general_kwargs['ticktext'] = date_list[::3]
+
+        return general_kwargs
+
+    def __line_plot_yaxis_kwargs(self, max_y, y_title):
+        y_step = np.floor(max_y / 15)
+        yticks = np.arange(0, max_y + y_step, y_step)
+
+        general_kwargs = dict(
+            showgrid=True,
+            gridwidth=0.5,
+            linewidth=1,
+            gridcolor=self.LIGHT_COLOR,
+            tickformat='{:.2f}',
+            title_font=dict(size=self.FONT_SIZE, color=self.MAIN_COLOR),
+            tickfont=dict(color=self.MAIN_COLOR),
+            tickvals=yticks,
+            ticktext=yticks
+        )
+        general_kwargs['title'] = y_title
+
+        return general_kwargs
+
+    def __bar_chart_static_kwargs(self):
+        return dict(
+            orientation='h',
+            textangle=0,
+            textposition='auto',
+            marker=dict(color=self.MAIN_COLOR)
+        )
+
+    def __figure_layout_static_kwargs(self):
+        return dict(
+            title_font=dict(size=self.FONT_SIZE * 1.618, color=self.MAIN_COLOR),
+            font=dict(family='Arial', size=self.FONT_SIZE, color=self.MAIN_COLOR),
+            plot_bgcolor='white',
+            paper_bgcolor='white',
+            width=1000, height=1000,
+            showlegend=False,
+            margin={'t': 100, 'b': 10, 'l': 150, 'r': 50},
+        )
+
+
+class AggBackend(GraphBackend):
+    """
+    Renders graphs with matplotlib Agg canvas in process. Map is drawn without tiles, so it doesn't require
+    network access.
+
+    Figures are created without pyplot, so there is no global state shared between renders.
+    """
+    name = 'agg'
+    DPI = 300
+
+    def line_plot(self, fp, lines, date_list, max_y, title, y_title, x_title):
+        figure, ax = self.__figure(width=10, height=5)
+        for line_data in lines:
+            color = self.__rgb(line_data['color'])
+            ax.plot(line_data['x'], line_data['y'], linestyle=':', linewidth=1, color=self.LIGHT_COLOR,
+                    marker='o', markersize=4, markerfacecolor=color, markeredgecolor=color)
+            ax.annotate(line_data['label'], xy=(line_data['x'][-1], line_data['y'][-1]), color=color,
+                        fontsize=self.FONT_SIZE * 0.75, xytext=(0, 6), textcoords='offset points', ha='center')
+
+        # Same 3-day step as plotly backend, but not more than 20 ticks on long periods
+        ticks = date_list if len(date_list) / 3 < 2 else date_list[::max(3, int(np.ceil(len(date_list) / 20)))]
+        ax.set_xticks(ticks)
+        ax.xaxis.set_major_formatter(DateFormatter('%d.%m.%Y'))
+        ax.tick_params(axis='x', labelrotation=45, labelsize=self.FONT_SIZE * 0.6)
+        ax.set_xlim(date_list[0], date_list[-1])
+        ax.set_ylim(0, max_y * 1.05 if max_y > 0 else 1)
+        ax.set_xlabel(x_title)
+        ax.set_ylabel(y_title)
+        ax.grid(True, color=self.LIGHT_COLOR, linewidth=0.5)
+        figure.suptitle(title, fontsize=self.FONT_SIZE * 1.618, color=self.MAIN_COLOR, x=0.02, ha='left')
+        self.__save(figure, fp)
+
+    def bar_charts(self, fp, bars, titles, title):
+        figure = Figure(figsize=(10, 5), facecolor='white')
+        FigureCanvasAgg(figure)
+        axes = figure.subplots(nrows=1, ncols=len(bars))
+        for ax, data, subplot_title in zip(np.atleast_1d(axes), bars, titles):
+            self.__style_axes(ax)
+            labels = [str(label) for label in data.index]
+            bar_container = ax.barh(labels, data.values, color=self.MAIN_COLOR)
+            ax.bar_label(bar_container, labels=[f'{float(v):.2f}' for v in data.values], color=self.MAIN_COLOR,
+                         fontsize=self.FONT_SIZE * 0.6, padding=2)
+            ax.set_title(subplot_title, fontsize=self.FONT_SIZE, color=self.MAIN_COLOR)
+            ax.xaxis.set_visible(False)
+            ax.spines[['top', 'right', 'bottom']].set_visible(False)
+            ax.set_xlim(0, float(data.max()) * 1.25 if data.shape[0] > 0 else 1)
+        figure.suptitle(title, fontsize=self.FONT_SIZE * 1.618, color=self.MAIN_COLOR, x=0.02, ha='left')
+        figure.tight_layout()
+        self.__save(figure, fp)
+
+    def map_plot(self, fp, lon, lat, sizes, title):
+        figure, ax = self.__figure(width=5, height=6, facecolor=self.MAIN_COLOR)
+        # Plotly marker size is diameter in px, matplotlib one is area in pt^2
+        ax.scatter(lon, lat, s=np.square(np.maximum(sizes, 2) / 2), color=self.MAIN_COLOR, alpha=0.8,
+                   edgecolors='white', linewidths=0.3)
+
+        # Keep distances proportional on small areas
+        mean_lat = float(np.mean(lat))
+        ax.set_aspect(1 / max(np.cos(np.radians(mean_lat)), 0.01), adjustable='datalim')
+        ax.grid(True, color=self.LIGHT_COLOR, linewidth=0.5)
+        ax.tick_params(labelbottom=False, labelleft=False, length=0)
+        ax.set_title(title, fontsize=self.FONT_SIZE, color=self.LIGHT_COLOR)
+        self.__save(figure, fp)
+
+    def __figure(self, width, height, facecolor='white'):
+        figure = Figure(figsize=(width, height), facecolor=facecolor)
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        self.__style_axes(ax)
+        return figure, ax
+
+    def __style_axes(self, ax):
+        ax.set_facecolor('white')
+        ax.tick_params(colors=self.MAIN_COLOR)
+        ax.xaxis.label.set_color(self.MAIN_COLOR)
+        ax.yaxis.label.set_color(self.MAIN_COLOR)
+        for spine in ax.spines.values():
+            spine.set_color(self.LIGHT_COLOR)
+
+    def __save(self, figure, fp):
+        figure.savefig(fp, format='png', dpi=self.DPI, facecolor=figure.get_facecolor())
+
+    @staticmethod
+    def __rgb(color):
+        return tuple(c / 255 for c in color)
+
+
+GRAPH_BACKENDS = {backend.name: backend for backend in (PlotlyBackend, AggBackend)}
+
+
+def get_backend(name):
+    """
+    Gets backend class by its name.
+
+    Args:
+        name (str): Backend name.
+
+    Returns:
+        type[GraphBackend]: Backend class.
+    """
+    try:
+        return GRAPH_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f'Unknown graph backend {name}, available: {", ".join(GRAPH_BACKENDS.keys())}')
@@ -6,16 +6,24 @@ from loguru import logger
 import pandas as pd
 import numpy as np
 
-from plotly.subplots import make_subplots
-from plotly import graph_objects as go
 from PIL import Image, ImageOps
 
-from configs import BASE_DIR
-from bot.routers.common_router import MessageTexts as MT
+from bot.static.messages import MessageTexts as MT
+from bot.internal.graph_backends import get_backend
+from bot.internal.downsampling import lttb
 
 
 class GraphCreator:
-    def __init__(self, data, user_lang):
+    def __init__(self, data, user_lang, backend, temp_folder):
+        """
+        Creates instance.
+
+        Args:
+            data (pd.DataFrame): Data to visualize.
+            user_lang (str): User language.
+            backend (str): Rendering backend name.
+            temp_folder (str): Folder to save images to, created if missing.
+        """
         self.data = data
         self.user_lang = user_lang
 
@@ -24,17 +32,29 @@ class GraphCreator:
         self.COMPLEMENT_RGB = (151, 149, 255)
         self.LIGHT_COLOR = '#cbcaff'
         self.FONT_SIZE = 12
+        self.LINE_MAX_POINTS = 200
+
+        backend_class = get_backend(backend)
+        self.backend = backend_class(main_color=self.MAIN_COLOR, light_color=self.LIGHT_COLOR,
+                                     font_size=self.FONT_SIZE)
 
-        self.temp_folder = os.path.join(BASE_DIR, 'temp')
+        self.temp_folder = temp_folder
         os.makedirs(self.temp_folder, exist_ok=True)
 
-    def create_expense_cards(self, user_id, min_date, max_bars=5, user_nickname=None):
+    def create_expense_cards(self, user_id, min_date, categories, subcategories, clusters=None, max_bars=5,
+                             user_nickname=None):
         """
         Creates expense report graphs: line plot, bar chart and map.
 
+        Instance data is expected to contain daily totals by category (day, category, amount).
+
         Args:
             user_id (int): User's id for filenames.
             min_date (dt.date): Axes min date.
+            categories (pd.Series): Totals by category sorted in descending order.
+            subcategories (pd.Series): Totals by subcategory sorted in descending order.
+            clusters (pd.DataFrame): Expense location clusters (lon, lat, amount, count). Map is not created
+                if None or empty.
             max_bars (int): Axes max bars.
             user_nickname (str): User's nickname.
 
@@ -44,50 +64,24 @@ class GraphCreator:
         graph_paths = []
 
         # Create line bar
-        line = self.__line_plot(user_nickname=user_nickname, min_date=min_date, type_='expense')
-        line_fp = self.__img_filename(user_id)
-        line.write_image(line_fp, width=1000, height=500, format='png', scale=3)
-        self.__add_border(line_fp)
-        logger.info(f'Created {line_fp}')
+        line_fp = self.__line_plot(user_id=user_id, user_nickname=user_nickname, min_date=min_date, type_='expense')
         graph_paths.append(line_fp)
 
-        # Categories bar chart
-        categories_data = self.data.groupby('category')['amount'].sum().sort_values(ascending=False)
-        categories_bar = self.__bar_chart(data=categories_data, max_bars=max_bars)
-        # Subcategories bar chart
-        subcategories_data = self.data.groupby('subcategory')['amount'].sum().sort_values(ascending=False)
-        subcategories_bar = self.__bar_chart(data=subcategories_data, max_bars=max_bars)
-
         # Create bars graph
         titles = ['Наиболее затратные категории' if self.user_lang == 'ru' else 'Most expensive categories',
                   'Наиболее затратные подкатегории' if self.user_lang == 'ru' else 'Most expensive subcategories']
-        bars = make_subplots(rows=1, cols=2, horizontal_spacing=0.15, subplot_titles=titles)
-        bars.add_trace(categories_bar, row=1, col=1)
-        bars.update_xaxes(visible=False)
-        bars.update_yaxes(visible=True)
-        bars.add_trace(subcategories_bar, row=1, col=2)
-        bars.update_layout(title=self.__title(user_nickname, type_='expense'), **self.__figure_layout_static_kwargs())
-
         bars_fp = self.__img_filename(user_id)
-        bars.write_image(bars_fp, width=1000, height=500, format='png', scale=3)
+        self.backend.bar_charts(bars_fp,
+                                bars=[self.__bar_data(categories, max_bars=max_bars),
+                                      self.__bar_data(subcategories, max_bars=max_bars)],
+                                titles=titles, title=self.__title(user_nickname, type_='expense'))
         self.__add_border(bars_fp)
         logger.info(f'Created {bars_fp}')
         graph_paths.append(bars_fp)
 
         # Create map
-        data_2 = self.data.to_crs(4326)
-        data_2 = data_2[~data_2.location.isna()]
-        location_x_min = (data_2.location.x >= (data_2.location.x.median() - data_2.location.x.quantile(0.99)))
-        location_x_max = (data_2.location.x <= (data_2.location.x.median() + data_2.location.x.quantile(0.99)))
-        location_y_min = (data_2.location.y >= (data_2.location.y.median() - data_2.location.y.quantile(0.99)))
-        location_y_max = (data_2.location.y <= (data_2.location.y.median() + data_2.location.y.quantile(0.99)))
-        data_2 = data_2[location_x_min & location_x_max & location_y_min & location_y_max]
-        if data_2.shape[0] > 0:
-            map_graph = self.__map_plot(data=data_2)
-            map_graph_fp = self.__img_filename(user_id)
-            map_graph.write_image(map_graph_fp, width=500, height=600, format='png', scale=3)
-            self.__add_border(map_graph_fp)
-            logger.info(f'Created {map_graph_fp}')
+        if clusters is not None and clusters.shape[0] > 0:
+            map_graph_fp = self.__map_plot(user_id=user_id, data=clusters)
             graph_paths.append(map_graph_fp)
 
         return graph_paths
@@ -104,13 +98,7 @@ class GraphCreator:
         Returns:
             str: Path to file.
         """
-        line = self.__line_plot(user_nickname=user_nickname, min_date=min_date, type_='income')
-        line_fp = self.__img_filename(user_id)
-        line.write_image(line_fp, width=1000, height=500, format='png', scale=3)
-        self.__add_border(line_fp)
-        logger.info(f'Created {line_fp}')
-
-        return line_fp
+        return self.__line_plot(user_id=user_id, user_nickname=user_nickname, min_date=min_date, type_='income')
 
     def __title(self, user_nickname, type_='expense'):
         """
@@ -118,17 +106,15 @@ class GraphCreator:
 
         Args:
             user_nickname (str): Nickname of the user.
+            type_ (str): Type of report: income / expense.
 
         Returns:
             str: Title.
         """
         # Generate daterange
-        try:
-            min_date = MT.format_date(self.data.event_time.min().date())
-            max_date = MT.format_date(self.data.event_time.max().date())
-        except AttributeError:
-            min_date = MT.format_date(self.data.event_date.min())
-            max_date = MT.format_date(self.data.event_date.max())
+        dates = pd.to_datetime(self.data['day' if type_ == 'expense' else 'event_date'])
+        min_date = MT.format_date(dates.min().date())
+        max_date = MT.format_date(dates.max().date())
         title_daterange = '-'.join([min_date, max_date])
 
         # Create language-specific title
@@ -170,176 +156,101 @@ class GraphCreator:
         fp = os.path.join(self.temp_folder, fn + ext)
         return fp
 
-    def __line_plot(self, min_date, user_nickname, type_):
+    def __line_plot(self, user_id, min_date, user_nickname, type_):
         """
-        Creates line plot.
+        Creates line plot and saves it into temp file.
 
         Args:
+            user_id (int): User's id for filename.
             min_date (dt.date): Axes min date
             user_nickname (str): User's nickname.
             type_ (str): Type of line plot: income / expense.
 
         Returns:
-            go.Figure: Line plot.
+            str: Path to file.
         """
         date_list = pd.date_range(start=min_date, end=dt.date.today()).date
 
-        figure = go.Figure()
-        max_y = 0
-
         group_column = 'category' if type_ == 'expense' else 'passive_status'
-        sort_column = 'event_time' if type_ == 'expense' else 'event_date'
+        date_column = 'day' if type_ == 'expense' else 'event_date'
+
+        # One pass to get daily totals for each category
+        days = pd.to_datetime(self.data[date_column]).dt.normalize().rename('day')
+        daily = self.data.groupby([self.data[group_column], days])['amount'].sum().astype(float)
+
+        categories_total_amount = daily.groupby(level=0).sum().sort_values(ascending=False)
+        categories_colors = dict(zip(categories_total_amount.index, self.__gradient(len(categories_total_amount))))
 
         if type_ == 'income':
-            self.data[group_column] = self.data[group_column].map({
+            labels = {
                 True: 'Пассивный' if self.user_lang == 'ru' else 'Passive',
                 False: 'Активный' if self.user_lang == 'ru' else 'Active',
-            })
-
-        self.data = self.data.sort_values(by=[sort_column], ascending=True)
-
-        categories_list = self.data[group_column].unique()
-        gradient = self.__gradient(len(categories_list))
-        categories_total_amount = self.data.groupby(group_column)['amount'].sum().sort_values(ascending=False)
-        categories_colors = dict(zip(categories_total_amount.index, gradient))
-        del categories_total_amount
-
-        for category in categories_list:
-            data_slice = self.data[self.data[group_column] == category]
-            current_max = data_slice['amount'].max()
-            current_color = categories_colors[category]
-            max_y = max(max_y, current_max)
-
-            line = go.Scatter(x=data_slice[sort_column], y=data_slice['amount'],
-                              **self.__line_plot_static_kwargs(marker_color=current_color))
-            figure.add_trace(line)
-            annotation_data = dict(x=line.x[-1], y=line.y[-1], text=category)
-            figure.add_annotation(**annotation_data, font=dict(color=current_color))
-
-        figure.update_xaxes(**self.__line_plot_xaxis_kwargs(date_list))
-        figure.update_yaxes(**self.__line_plot_yaxis_kwargs(max_y))
-        figure.update_layout(title=self.__title(user_nickname=user_nickname, type_=type_),
-                             **self.__figure_layout_static_kwargs())
-
-        return figure
-
-    def __line_plot_static_kwargs(self, marker_color=None):
-        return dict(
-            line=dict(color=self.LIGHT_COLOR, width=1, dash='dot'),
-            mode='lines+markers',
-            marker=dict(color=self.MAIN_COLOR if marker_color is None else marker_color),
-        )
-
-    def __line_plot_xaxis_kwargs(self, date_list):
-        general_kwargs = dict(
-            showgrid=True,
-            gridwidth=0.5,
-            linewidth=1,
-            gridcolor=self.LIGHT_COLOR,
-            tickformat='%d.%m.%Y'
-        )
-
-        general_kwargs['title'] = MT('Дата', 'Date').get(self.user_lang)
-        if len(date_list) / 3 < 2:
-            general_kwargs['tickvals'] = date_list
-            general_kwargs['ticktext'] = date_list
+            }
         else:
-            general_kwargs['tickvals'] = date_list[::3]
-            general_kwargs['ticktext'] = date_list[::3]
-
-        return general_kwargs
-
-    def __line_plot_yaxis_kwargs(self, max_y):
-        y_step = np.floor(max_y / 15)
-        yticks = np.arange(0, max_y + y_step, y_step)
-
-        general_kwargs = dict(
-            showgrid=True,
-            gridwidth=0.5,
-            linewidth=1,
-            gridcolor=self.LIGHT_COLOR,
-            tickformat='{:.2f}',
-            title_font=dict(size=self.FONT_SIZE, color=self.MAIN_COLOR),
-            tickfont=dict(color=self.MAIN_COLOR),
-            tickvals=yticks,
-            ticktext=yticks
-        )
-        general_kwargs['title'] = MT('Сумма покупки', 'Expense amount').get(self.user_lang)
-
-        return general_kwargs
-
-    def __bar_chart(self, data, max_bars=5):
+            labels = dict()
+
+        max_y = daily.max() if daily.shape[0] > 0 else 0
+        lines = []
+        for category, category_daily in daily.groupby(level=0, sort=False):
+            x = category_daily.index.get_level_values('day').values
+            y = category_daily.values
+            # Keep line shape but limit number of points to draw
+            if y.shape[0] > self.LINE_MAX_POINTS:
+                selected = lttb(x.astype('datetime64[s]').astype(np.int64), y, self.LINE_MAX_POINTS)
+                x, y = x[selected], y[selected]
+            lines.append(dict(label=labels.get(category, category), x=x, y=y, color=categories_colors[category]))
+
+        line_fp = self.__img_filename(user_id)
+        self.backend.line_plot(line_fp, lines=lines, date_list=date_list, max_y=max_y,
+                               title=self.__title(user_nickname=user_nickname, type_=type_),
+                               y_title=MT('Сумма покупки', 'Expense amount').get(self.user_lang),
+                               x_title=MT('Дата', 'Date').get(self.user_lang))
+        self.__add_border(line_fp)
+        logger.info(f'Created {line_fp}')
+        return line_fp
+
+    def __bar_data(self, data, max_bars=5):
+        """
+        Cuts bars data to max_bars values, the rest of values is summed into 'other' bar.
+
+        Args:
+            data (pd.Series): Values sorted in descending order.
+            max_bars (int): Max bars count, except 'other' bar.
+
+        Returns:
+            pd.Series: Values sorted in ascending order.
+        """
         other_name = MT('Иное', 'Other').get(self.user_lang)
 
         # Cut bars
         if data.shape[0] > max_bars:
             other = data.iloc[max_bars:].sum()
-            categorical_data = data.iloc[:max_bars]
-            categorical_data[other_name] = other
+            data = data.iloc[:max_bars].copy()
+            data[other_name] = other
 
         # Sort bars
-        data = data.sort_values(ascending=True)
-
-        # Create bar
-        bar = go.Bar(x=data.values, y=data.index, text=data.values, **self.__bar_chart_static_kwargs())
-        return bar
-
-    def __bar_chart_static_kwargs(self):
-        return dict(
-            orientation='h',
-            textangle=0,
-            textposition='auto',
-            marker=dict(color=self.MAIN_COLOR)
-        )
-
-    def __map_plot(self, data):
-        figure = make_subplots(rows=1, cols=1, specs=[[{'type': 'mapbox'}]])
-
-        figure.add_trace(go.Scattermapbox(
-            lat=data.location.y,
-            lon=data.location.x,
-            mode='markers',
-            marker=dict(size=np.log2(data.amount), opacity=1, color=self.MAIN_COLOR, sizemin=2),
-        ), row=1, col=1)
-
-        map_center = {
-            "lat": data['location'].y.mean(),
-            "lon": data['location'].x.mean()
-        }
-
-        max_bound = max(abs(data.location.x.max() - data.location.x.min()),
-                        abs(data.location.y.max() - data.location.y.min())) * 111
-        if max_bound != 0:
-            zoom = 12 - np.log(max_bound)
-        else:
-            zoom = 10
+        return data.sort_values(ascending=True)
+
+    def __map_plot(self, user_id, data):
+        """
+        Creates map with expense location clusters and saves it into temp file.
 
+        Args:
+            user_id (int): User's id for filename.
+            data (pd.DataFrame): Clusters centroids and totals (lon, lat, amount, count).
+
+        Returns:
+            str: Path to file.
+        """
         title = 'Наиболее популярные места совершения покупок' \
             if self.user_lang == 'ru' else 'Most popular expense locations'
 
-        figure.update_layout(
-            width=500, height=600,
-            title=title,
-            title_font=dict(size=self.FONT_SIZE, color=self.LIGHT_COLOR),
-            mapbox_style="carto-positron",
-            mapbox_zoom=zoom,
-            mapbox_center=map_center,
-            margin={"r": 0, "t": self.FONT_SIZE * 2.5, "l": 0, "b": 0},
-            paper_bgcolor=self.MAIN_COLOR,
-        )
-
-        return figure
-
-    def __figure_layout_static_kwargs(self):
-        return dict(
-            title_font=dict(size=self.FONT_SIZE * 1.618, color=self.MAIN_COLOR),
-            font=dict(family='Arial', size=self.FONT_SIZE, color=self.MAIN_COLOR),
-            plot_bgcolor='white',
-            paper_bgcolor='white',
-            width=1000, height=1000,
-            showlegend=False,
-            margin={'t': 100, 'b': 10, 'l': 150, 'r': 50},
-        )
+        map_graph_fp = self.__img_filename(user_id)
+        self.backend.map_plot(map_graph_fp, lon=data.lon.values, lat=data.lat.values,
+                              sizes=np.log2(data.amount.values + 1), title=title)
+        self.__add_border(map_graph_fp)
+        logger.info(f'Created {map_graph_fp}')
+        return map_graph_fp
 
     def __add_border(self, img_path, border_width=None):
         """
@@ -365,7 +276,7 @@ class GraphCreator:
             steps (int): number of steps
 
         Returns:
-            np.ndarray: Gradient values.
+            list[tuple[int, int, int]]: Gradient RGB values.
         """
         color1 = np.array(self.MAIN_COLOR_RGB)
         color2 = np.array(self.COMPLEMENT_RGB)
@@ -373,11 +284,6 @@ class GraphCreator:
         steps_array = np.linspace(0, 1, steps)
 
         gradient = np.outer(steps_array, color2 - color1) + color1
-        gradient_rbg = []
-        for gr in gradient:
-            gr_int = list(map(int, gr))
-            gr_rgb = f'rgb({",".join(map(str, gr_int))})'
-            gradient_rbg.append(gr_rgb)
-        return gradient_rbg
+        return [tuple(map(int, gr)) for gr in gradient]
 
 
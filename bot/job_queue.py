@@ -0,0 +1,168 @@
+"""
+Background processing of jobs saved in DB.
+
+Jobs are processed by a fixed number of workers, so they don't block update handlers and their number is limited
+in all bot processes together. Workers send heartbeats for running jobs, jobs without heartbeat are claimed again
+by any bot process, so jobs interrupted by crash or restart are restarted.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+
+from loguru import logger
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+
+class JobQueue(ABC):
+    # Jobs table, subclass of BackgroundJob
+    job_table = None
+    # Jobs kind for logs
+    name = 'job'
+    # Workers check for jobs with this interval in seconds even if they are not notified
+    POLL_INTERVAL = 60
+    # Interval between heartbeats of running job in seconds, must be well below BackgroundJob.HEARTBEAT_TIMEOUT
+    HEARTBEAT_INTERVAL = 60
+
+    def __init__(self, bot, workers):
+        """
+        Creates instance.
+
+        Args:
+            bot (Bot): Bot instance.
+            workers (int): Max number of jobs running at once in all bot processes.
+        """
+        self.bot = bot
+        self.workers = workers
+
+        self.__event = asyncio.Event()
+        self.__tasks = []
+
+    async def start(self):
+        """
+        Starts workers.
+        """
+        self.__tasks = [asyncio.create_task(self.__worker(i)) for i in range(self.workers)]
+        logger.info(f'Started {self.workers} {self.name} workers')
+
+    async def stop(self):
+        """
+        Stops workers. Running jobs stay running in DB and are claimed again once their heartbeat is stale.
+        """
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        logger.info(f'Stopped {self.name} workers')
+
+    def notify(self):
+        """
+        Wakes workers up to check for new jobs.
+        """
+        self.__event.set()
+
+    @abstractmethod
+    async def run(self, job):
+        """
+        Processes job and notifies user about the result.
+
+        Args:
+            job (sqlalchemy.Row): Job columns.
+
+        Raises:
+            Exception: Job failed, user is notified with ``error_text`` by the worker.
+        """
+
+    @staticmethod
+    @abstractmethod
+    def error_text(user_lang):
+        """
+        Text of status message of failed job.
+
+        Args:
+            user_lang (str): User language.
+
+        Returns:
+            str: Message text.
+        """
+
+    async def edit_status(self, job, text):
+        """
+        Edits job status message.
+
+        Args:
+            job (sqlalchemy.Row): Job columns.
+            text (str): New message text.
+        """
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=job.chat_id, message_id=job.status_message_id)
+        except TelegramBadRequest as e:
+            logger.warning(e)
+
+    async def __worker(self, worker_id):
+        """
+        Claims and runs jobs one by one. Stale jobs that used all attempts are failed before claiming.
+
+        Args:
+            worker_id (int): Worker number for logs.
+        """
+        while True:
+            self.__event.clear()
+            try:
+                for stale_job in await self.job_table.fail_stale():
+                    await self.edit_status(stale_job, self.error_text(stale_job.user_lang))
+                job = await self.job_table.claim(max_running=self.workers)
+            except Exception as e:
+                logger.error(e)
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.__event.wait(), timeout=self.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f'{self.name.capitalize()} worker {worker_id} started job {job.id}')
+            await self.__run(job)
+
+    async def __run(self, job):
+        """
+        Runs job with heartbeats and marks it as done or failed. Job is left running if worker is cancelled,
+        so it is claimed again when heartbeat is stale.
+
+        Args:
+            job (sqlalchemy.Row): Job columns.
+        """
+        heartbeat = asyncio.create_task(self.__heartbeat(job))
+        try:
+            await self.run(job)
+            success = True
+        # Something went wrong
+        except Exception as e:
+            logger.error(e)
+            await self.edit_status(job, self.error_text(job.user_lang))
+            success = False
+        finally:
+            heartbeat.cancel()
+
+        try:
+            await self.job_table.finish(job.id, attempt=job.attempts, success=success)
+            logger.info(f'Finished {self.name} job {job.id}, success: {success}')
+        except Exception as e:
+            logger.error(e)
+
+    async def __heartbeat(self, job):
+        """
+        Reports running job alive every HEARTBEAT_INTERVAL seconds until cancelled.
+
+        Args:
+            job (sqlalchemy.Row): Job columns.
+        """
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                if not await self.job_table.heartbeat(job.id, attempt=job.attempts):
+                    logger.warning(f'{self.name.capitalize()} job {job.id} attempt {job.attempts} is no longer running')
+                    return
+            except Exception as e:
+                logger.error(e)
@@ -0,0 +1,135 @@
+"""
+Executor lanes separating heavy handlers from interactive ones.
+
+Handlers registered with ``flags={'heavy': True}`` run in heavy lane, all others in light lane. Each lane limits
+the number of its handlers running at once, so heavy handlers never occupy all update processing tasks.
+Heavy handler is rejected with "busy" reply when its lane is full, light handler waits for a free slot.
+
+Heavy lane also has a thread pool for blocking work (graph rendering, pandas, sync DB queries), so it doesn't
+block the event loop serving light handlers.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+from bot.metrics import Counter, Gauge, Histogram
+from bot.routers import MessageTexts as MT
+
+
+class Lane:
+    def __init__(self, name, concurrency, threads=None):
+        """
+        Creates instance.
+
+        Args:
+            name (str): Lane name for metrics.
+            concurrency (int): Max number of handlers running in lane at once.
+            threads (int): Number of threads for blocking work. If None, blocking work runs in default executor.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.executor = None if threads is None \
+            else ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'{name}-lane')
+
+        self.in_progress = Gauge(f'{name}_lane_in_progress', f'Number of handlers running in {name} lane')
+        self.rejected = Counter(f'{name}_lane_rejected_total', f'Number of handlers rejected by full {name} lane')
+        self.handler_seconds = Histogram(f'{name}_lane_handler_seconds', f'Time of handlers in {name} lane')
+        self.__semaphore = asyncio.Semaphore(concurrency)
+
+    def full(self):
+        """
+        Returns:
+            bool: Whether all lane slots are taken.
+        """
+        return self.__semaphore.locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Waits for free lane slot and holds it.
+        """
+        async with self.__semaphore:
+            self.in_progress.inc()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.handler_seconds.observe(time.perf_counter() - start)
+                self.in_progress.dec()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs blocking function in lane thread pool.
+
+        Args:
+            func (Callable): Blocking function.
+            *args: Function arguments.
+            **kwargs: Function keyword arguments.
+
+        Returns:
+            Any: Function result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LaneMiddleware(BaseMiddleware):
+    """
+    Runs handler in its lane and adds the lane to handler data as ``lane`` argument.
+    """
+    def __init__(self, light_lane, heavy_lane):
+        """
+        Creates instance.
+
+        Args:
+            light_lane (Lane): Lane for interactive handlers.
+            heavy_lane (Lane): Lane for handlers flagged as heavy.
+        """
+        super().__init__()
+        self.light_lane = light_lane
+        self.heavy_lane = heavy_lane
+
+    async def __call__(self, handler, event, data):
+        """
+        Run handler in lane or reject it, if heavy lane is full.
+
+        Args:
+            handler (Callable[[Message, Dict[str, Any]], Awaitable[Any]]): Handler to perform bot action.
+            event (Message | CallbackQuery): Event.
+            data (Dict[str, Any]): Handler data to perform action.
+        """
+        if get_flag(data, 'heavy', default=False):
+            lane = self.heavy_lane
+            if lane.full():
+                lane.rejected.inc()
+                m_texts = MT(
+                    ru_text='Сейчас бот загружен, пожалуйста, попробуйте ещё раз через минуту',
+                    en_text='The bot is busy right now, please try again in a minute'
+                )
+                if isinstance(event, CallbackQuery):
+                    # Callback query may be already answered before handler
+                    callback_answer = data.get('callback_answer')
+                    if callback_answer is None:
+                        return await event.answer(m_texts.get(data['user_lang']), show_alert=True)
+                    if not callback_answer.answered:
+                        callback_answer.text = m_texts.get(data['user_lang'])
+                        callback_answer.show_alert = True
+                        return
+                    return await event.message.answer(m_texts.get(data['user_lang']))
+                return await event.answer(m_texts.get(data['user_lang']))
+        else:
+            lane = self.light_lane
+
+        data['lane'] = lane
+        async with lane.slot():
+            return await handler(event, data)
@@ -0,0 +1,113 @@
+"""
+In-process bot metrics exposed in Prometheus text format.
+
+Metrics are created once on module import of the code that updates them and are rendered by ``metrics_handler``
+registered on ``/metrics`` path of webhook application.
+"""
+import math
+
+from aiohttp import web
+
+
+METRICS = dict()
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, description):
+        """
+        Creates metric and registers it.
+
+        Args:
+            name (str): Metric name.
+            description (str): Metric help text.
+        """
+        self.name = name
+        self.description = description
+        self.value = 0
+        METRICS[name] = self
+
+    def inc(self, value=1):
+        self.value += value
+
+    def render(self):
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type_name}',
+                f'{self.name} {self.value}']
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def dec(self, value=1):
+        self.value -= value
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        """
+        Creates histogram and registers it.
+
+        Args:
+            name (str): Metric name.
+            description (str): Metric help text.
+            buckets (tuple[float]): Upper bounds of buckets in ascending order.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0
+        self.count = 0
+        METRICS[name] = self
+
+    def observe(self, value):
+        """
+        Adds observed value.
+
+        Args:
+            value (float): Observed value.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = '+Inf' if bound == math.inf else f'{bound:g}'
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+def render():
+    """
+    Returns:
+        str: All registered metrics in Prometheus text format.
+    """
+    return '\n'.join(line for metric in METRICS.values() for line in metric.render()) + '\n'
+
+
+async def metrics_handler(request):
+    """
+    Returns metrics of this bot process.
+
+    Args:
+        request (web.Request): Request.
+
+    Returns:
+        web.Response: Metrics in Prometheus text format.
+    """
+    return web.Response(text=render(), content_type='text/plain')
@@ -1,8 +1,20 @@
+import asyncio
+import time
+
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery
+from aiogram.utils.callback_answer import CallbackAnswerMiddleware
+from loguru import logger
 
 from db.shared_schema import BotUser
 from bot.static.user_languages import USER_LANGUAGE_PREFERENCES
+from bot.storage import BufferedFSMContext
+from bot.metrics import Histogram
+
+
+callback_ack_seconds = Histogram('callback_ack_seconds', 'Time from callback query handling start to its answer')
 
 
 class UserLanguageMiddleware(BaseMiddleware):
@@ -40,3 +52,85 @@ class UserLanguageMiddleware(BaseMiddleware):
             data['user_lang'] = USER_LANGUAGE_PREFERENCES[user_id]
 
         await handler(event, data)
+
+
+class BufferedStateMiddleware(BaseMiddleware):
+    """
+    Replaces handler FSM context with buffered one, so all state changes made by handler are written
+    with one storage call after it returns. Changes are dropped, if handler raises an exception.
+    """
+    async def __call__(self, handler, event, data):
+        """
+        Wrap FSM context and flush it after handler.
+
+        Args:
+            handler (Callable[[Message, Dict[str, Any]], Awaitable[Any]]): Handler to perform bot action.
+            event (Message | CallbackQuery): Event.
+            data (Dict[str, Any]): Handler data to perform action.
+        """
+        context = data.get('state')
+        if context is None:
+            return await handler(event, data)
+
+        buffered = BufferedFSMContext(storage=context.storage, key=context.key, state=data.get('raw_state'))
+        data['state'] = buffered
+        result = await handler(event, data)
+        await buffered.flush()
+        return result
+
+
+class EarlyCallbackAnswerMiddleware(CallbackAnswerMiddleware):
+    """
+    Answers callback query as soon as its handler is found, in parallel with the handler, so Telegram hides
+    button spinner without waiting for DB queries and rendering.
+
+    Handlers showing answer text are registered with ``flags={'callback_answer': {'pre': False}}`` and set
+    the text to ``callback_answer`` argument, the answer is sent after them.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(pre=True, **kwargs)
+        self.__tasks = set()
+
+    async def __call__(self, handler, event, data):
+        """
+        Answer callback query before or after handler.
+
+        Args:
+            handler (Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]]): Handler to perform bot action.
+            event (CallbackQuery): Event.
+            data (Dict[str, Any]): Handler data to perform action.
+        """
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        start = time.perf_counter()
+        callback_answer = data['callback_answer'] = self.construct_callback_answer(
+            properties=get_flag(data, 'callback_answer')
+        )
+        if not callback_answer.disabled and callback_answer.answered:
+            task = asyncio.create_task(self.__answer(event, callback_answer, start))
+            # Keep reference until the answer is sent
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+        try:
+            return await handler(event, data)
+        finally:
+            if not callback_answer.disabled and not callback_answer.answered:
+                await self.__answer(event, callback_answer, start)
+
+    async def __answer(self, event, callback_answer, start):
+        """
+        Answers callback query and records time to answer.
+
+        Args:
+            event (CallbackQuery): Callback query.
+            callback_answer (CallbackAnswer): Answer properties.
+            start (float): Handling start time.
+        """
+        try:
+            await self.answer(event, callback_answer)
+        except TelegramBadRequest as e:
+            # Query is too old or already answered
+            logger.debug(f'Callback query {event.id} is not answered: {e}')
+        else:
+            callback_ack_seconds.observe(time.perf_counter() - start)
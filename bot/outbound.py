@@ -0,0 +1,360 @@
+"""
+Outbound Telegram API requests scheduling.
+
+All bot requests addressed to a chat pass token buckets: global one for the whole bot and one per chat, so bot
+stays within Telegram flood limits instead of getting RetryAfter errors. Interactive replies are sent before bulk
+requests (export files and progress messages) waiting for global bucket. Requests rejected by Telegram with
+RetryAfter are repeated after the requested time, the chat is paused for this time. Flood limit may be bot-wide,
+so all bulk requests are paused for this time as well, interactive replies to other chats are not.
+
+Inline markup removals made while an update is handled are delayed until the end of the update. If the handler
+edits text of the same message, removal is dropped, because text edit without markup removes it anyway. Edits
+that don't change the message are not sent.
+"""
+import asyncio
+import ssl
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import BaseMiddleware
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText
+from aiogram.types import CallbackQuery
+from loguru import logger
+
+from bot.metrics import Counter, Histogram
+
+
+INTERACTIVE = 0
+BULK = 1
+
+priority = ContextVar('outbound_priority', default=INTERACTIVE)
+edit_buffer = ContextVar('edit_buffer', default=None)
+
+requests_sent = Counter('telegram_requests_total', 'Number of requests sent to Telegram API')
+requests_throttled = Counter('telegram_requests_throttled_total', 'Number of requests delayed by rate limits')
+requests_retried = Counter('telegram_retry_after_total', 'Number of requests repeated after RetryAfter error')
+throttle_seconds = Histogram('telegram_throttle_seconds', 'Time requests wait for rate limits')
+edits_coalesced = Counter('telegram_edits_coalesced_total', 'Number of message edits merged or dropped')
+
+
+@contextmanager
+def bulk():
+    """
+    Marks requests sent inside the block and tasks created in it as bulk.
+    """
+    token = priority.set(BULK)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Creates full bucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Max number of tokens, allowed burst size.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Monotonic time until which tokens are not taken
+        self.paused_until = 0
+
+    def delay(self):
+        """
+        Returns:
+            float: Seconds until a token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(self.paused_until - now, (1 - self.tokens) / self.rate, 0)
+
+    def reserve(self):
+        """
+        Takes a token in advance, so concurrent requests are sent in the order they reserved tokens.
+
+        Returns:
+            float: Seconds to wait before the token may be used.
+        """
+        delay = self.delay()
+        self.tokens -= 1
+        return max(delay, self.paused_until - time.monotonic(), 0)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self):
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+
+class ThrottledSession(AiohttpSession):
+    """
+    Aiohttp session sending requests through global and per chat token buckets with keep-alive connection pool.
+    """
+    # Telegram allows about 30 messages per second for the bot and about 1 message per second for a chat
+    GLOBAL_RATE = 30
+    CHAT_RATE = 1
+    CHAT_BURST = 3
+    # Max number of RetryAfter errors before request fails
+    MAX_RETRIES = 3
+    # Chat buckets are cleaned up when there are more of them
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, connections=100, keepalive_timeout=60, **kwargs):
+        """
+        Creates instance.
+
+        Args:
+            connections (int): Max number of open connections to Telegram API.
+            keepalive_timeout (int): Seconds idle connection is kept open for reuse.
+        """
+        super().__init__(**kwargs)
+        self.connections = connections
+        self.keepalive_timeout = keepalive_timeout
+        self.__session = None
+
+        self.global_bucket = TokenBucket(rate=self.GLOBAL_RATE, capacity=self.GLOBAL_RATE)
+        # Monotonic time until which bulk requests are not sent after RetryAfter
+        self.bulk_paused_until = 0
+        self.__chat_buckets = dict()
+        # Number of requests waiting for global bucket by priority
+        self.__waiting = {INTERACTIVE: 0, BULK: 0}
+
+    async def create_session(self):
+        """
+        Creates client session with own connection pool on first request.
+
+        Returns:
+            ClientSession: Client session.
+        """
+        if self.__session is None or self.__session.closed:
+            connector = TCPConnector(limit=self.connections, keepalive_timeout=self.keepalive_timeout,
+                                     ttl_dns_cache=300, ssl=ssl.create_default_context(cafile=certifi.where()))
+            self.__session = ClientSession(connector=connector,
+                                           headers={USER_AGENT: f'{SERVER_SOFTWARE} aiogram/{aiogram_version}'})
+        return self.__session
+
+    async def close(self):
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+            # Wait for the underlying SSL connections to close
+            await asyncio.sleep(0.25)
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, 'chat_id', None)
+        # Methods not addressed to a chat (callback answers, webhook and commands setup) are not limited
+        if chat_id is None:
+            requests_sent.inc()
+            return await super().make_request(bot, method, timeout=timeout)
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            await self.__acquire(chat_id, priority.get())
+            requests_sent.inc()
+            try:
+                return await super().make_request(bot, method, timeout=timeout)
+            except TelegramRetryAfter as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                requests_retried.inc()
+                logger.warning(f'{method.__api_method__} to chat {chat_id} is retried after {e.retry_after} s')
+                self.__chat_bucket(chat_id).pause(e.retry_after)
+                self.bulk_paused_until = max(self.bulk_paused_until, time.monotonic() + e.retry_after)
+
+    async def __acquire(self, chat_id, request_priority):
+        """
+        Waits until request to the chat may be sent.
+
+        Args:
+            chat_id (int | str): Chat id.
+            request_priority (int): INTERACTIVE or BULK.
+        """
+        start = time.monotonic()
+        # Requests to one chat are ordered by their reservations and don't delay other chats
+        delay = self.__chat_bucket(chat_id).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        self.__waiting[request_priority] += 1
+        try:
+            while True:
+                # Bulk requests wait while there are interactive ones
+                preceding = any(count > 0 for p, count in self.__waiting.items() if p < request_priority)
+                delay = self.global_bucket.delay()
+                if request_priority == BULK:
+                    delay = max(delay, self.bulk_paused_until - time.monotonic())
+                if not preceding and delay == 0:
+                    self.global_bucket.tokens -= 1
+                    break
+                await asyncio.sleep(delay or 1 / self.global_bucket.rate)
+        finally:
+            self.__waiting[request_priority] -= 1
+
+        waited = time.monotonic() - start
+        throttle_seconds.observe(waited)
+        if waited > 0.001:
+            requests_throttled.inc()
+
+    def __chat_bucket(self, chat_id):
+        """
+        Gets chat bucket, creates it if needed.
+
+        Args:
+            chat_id (int | str): Chat id.
+
+        Returns:
+            TokenBucket: Chat bucket.
+        """
+        bucket = self.__chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.__chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                # Full buckets are the same as new ones
+                self.__chat_buckets = {key: value for key, value in self.__chat_buckets.items() if not value.idle()}
+            bucket = self.__chat_buckets[chat_id] = TokenBucket(rate=self.CHAT_RATE, capacity=self.CHAT_BURST)
+        return bucket
+
+
+class EditBuffer:
+    """
+    Inline markup removals and known message states of one update.
+    """
+    def __init__(self):
+        # (chat id, message id) -> delayed markup removal
+        self.pending = dict()
+        # (chat id, message id) -> (text, whether message has markup), text is None if unknown
+        self.known = dict()
+        self.active = True
+
+    def remember(self, chat_id, message_id, text=None, has_markup=True):
+        self.known[(chat_id, message_id)] = (text, has_markup)
+
+    def pop_pending(self, chat_id=None):
+        """
+        Takes delayed removals.
+
+        Args:
+            chat_id (int | str): If passed, only removals in this chat are taken.
+
+        Returns:
+            list[EditMessageReplyMarkup]: Removals.
+        """
+        keys = [key for key in self.pending if chat_id is None or key[0] == chat_id]
+        return [self.pending.pop(key) for key in keys]
+
+
+@contextmanager
+def coalesce_edits():
+    """
+    Collects markup removals of requests sent inside the block into buffer.
+
+    Yields:
+        EditBuffer: Buffer, its removals must be sent with ``flush_edits`` after the block.
+    """
+    buffer = EditBuffer()
+    token = edit_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        # Tasks created in the block have the buffer in their context, they send requests directly
+        buffer.active = False
+        edit_buffer.reset(token)
+
+
+async def flush_edits(bot, buffer):
+    """
+    Sends delayed markup removals. Removals of messages without markup or deleted ones are ignored.
+
+    Args:
+        bot (Bot): Bot instance.
+        buffer (EditBuffer): Buffer.
+    """
+    for method in buffer.pop_pending():
+        try:
+            await bot(method)
+        except TelegramBadRequest as e:
+            logger.debug(f'Inline markup was not removed: {e}')
+
+
+class EditCoalescingRequestMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware delaying markup removals and dropping edits that don't change message,
+    while update is handled inside ``coalesce_edits`` block.
+    """
+    async def __call__(self, make_request, bot, method):
+        buffer = edit_buffer.get()
+        if buffer is None or not buffer.active:
+            return await make_request(bot, method)
+
+        chat_id, message_id = getattr(method, 'chat_id', None), getattr(method, 'message_id', None)
+        key = (chat_id, message_id)
+        # Inline messages are edited directly
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        if isinstance(method, EditMessageReplyMarkup) and method.reply_markup is None:
+            # Message has no markup already or its removal is already delayed
+            if not buffer.known.get(key, (None, True))[1] or key in buffer.pending:
+                edits_coalesced.inc()
+                return True
+            buffer.pending[key] = method
+            return True
+
+        if isinstance(method, EditMessageText):
+            # Text edit replaces markup, without markup it removes markup too
+            if buffer.pending.pop(key, None) is not None:
+                edits_coalesced.inc()
+            text, has_markup = buffer.known.get(key, (None, True))
+            if text == method.text and not has_markup and method.reply_markup is None:
+                edits_coalesced.inc()
+                return True
+            result = await make_request(bot, method)
+            buffer.remember(chat_id, message_id, text=method.text, has_markup=method.reply_markup is not None)
+            return result
+
+        # Keep order of removals and other requests in the chat
+        for removal in buffer.pop_pending(chat_id):
+            try:
+                await make_request(bot, removal)
+            except TelegramBadRequest as e:
+                logger.debug(f'Inline markup was not removed: {e}')
+        return await make_request(bot, method)
+
+
+class EditCoalescingMiddleware(BaseMiddleware):
+    """
+    Collects message edits made by handler, so inline markup removal and text edit of one message are sent
+    as one request. Delayed markup removals are sent after handler, even if it raises an exception.
+    """
+    async def __call__(self, handler, event, data):
+        """
+        Handle event inside edits buffer and send delayed edits.
+
+        Args:
+            handler (Callable[[Message, Dict[str, Any]], Awaitable[Any]]): Handler to perform bot action.
+            event (Message | CallbackQuery): Event.
+            data (Dict[str, Any]): Handler data to perform action.
+        """
+        try:
+            with coalesce_edits() as buffer:
+                # Pressed button message markup is known, so removal of absent markup is not sent
+                if isinstance(event, CallbackQuery) and event.message is not None:
+                    buffer.remember(event.message.chat.id, event.message.message_id,
+                                    has_markup=event.message.reply_markup is not None)
+                return await handler(event, data)
+        finally:
+            # Buffer is closed after the block, so removals are sent instead of being buffered again
+            await flush_edits(data['bot'], buffer)
@@ -0,0 +1,41 @@
+"""
+Background processing of user data purge jobs.
+
+Large accounts take a while to purge, so purge requests are saved as jobs in DB and processed by job queue workers
+off the request path. Interrupted purges are restarted, purge deletes whatever is left of the user's data.
+"""
+from bot.job_queue import JobQueue
+from bot.routers import MessageTexts as MT
+from bot.static.user_languages import USER_LANGUAGE_PREFERENCES
+from db import PurgeJob, purge_user
+
+
+class PurgeQueue(JobQueue):
+    job_table = PurgeJob
+    name = 'purge'
+
+    async def run(self, job):
+        """
+        Deletes all user's data, scheduled jobs and in-process caches, then notifies user by editing the message.
+
+        Args:
+            job (sqlalchemy.Row): Purge job.
+        """
+        await purge_user(user_id=job.user_id)
+        # Delete user specified language from languages dict
+        USER_LANGUAGE_PREFERENCES.pop(job.user_id, None)
+
+        m_texts = MT(
+            ru_text='Все данные, связанные с вами, удалены. Всего хорошего!',
+            en_text='All data associated with you is deleted. Thank you!'
+        )
+        await self.edit_status(job, m_texts.get(job.user_lang))
+
+    @staticmethod
+    def error_text(user_lang):
+        m_texts = MT(
+            ru_text='К сожалению, произошла внутренняя ошибка, данные удалены не полностью. '
+                    'Пожалуйста, попробуйте позже',
+            en_text='Unfortunately, internal error occurred, data is not deleted completely. Please try again.'
+        )
+        return m_texts.get(user_lang)
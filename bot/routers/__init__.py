@@ -1,4 +1,5 @@
-from .common_router import CommonRouter, MessageTexts
+from bot.static.messages import MessageTexts
+from .common_router import CommonRouter
 from .delete_router import DeleteRouter
 from .stats_router import StatsRouter
 from .export_router import ExportRouter
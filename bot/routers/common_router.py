@@ -1,78 +1,65 @@
-import datetime
-from decimal import Decimal
-
 from aiogram.types import Message, CallbackQuery
 from aiogram.exceptions import TelegramBadRequest
 
 
 class CommonRouter:
+    # State data key of the last bot message asking user to send something
+    PROMPT_KEY = 'prompt_message_id'
+
     @staticmethod
-    async def clear_inline_markup(source, bot):
+    async def clear_inline_markup(source, bot, state=None):
         """
         Removes inline markup from bot message, if possible.
 
         Args:
              source (Message | CallbackQuery): Message or callback query to define inline markup source.
              bot (Bot): Bot instance.
+             state (FSMContext): Current state. Required for user message source, markup is removed
+                from the prompt message remembered in state data.
         """
         if isinstance(source, CallbackQuery):
             return await bot.edit_message_reply_markup(chat_id=source.message.chat.id,
                                                        message_id=source.message.message_id,
                                                        reply_markup=None)
-        elif isinstance(source, Message):
+        elif isinstance(source, Message) and state is not None:
+            prompt_id = (await state.get_data()).get(CommonRouter.PROMPT_KEY)
+            if prompt_id is None:
+                return
             try:
-                await bot.edit_message_reply_markup(chat_id=source.chat.id, message_id=source.message_id - 1,
-                                                    reply_markup=None)
+                await bot.edit_message_reply_markup(chat_id=source.chat.id, message_id=prompt_id, reply_markup=None)
             except TelegramBadRequest:
                 pass
 
-
-class MessageTexts:
-    def __init__(self, ru_text, en_text):
-        """
-        Creates instance.
-
-        Args:
-            ru_text (str): Text to be sent to russian-speaking users.
-            en_text (str): Text to be sent to english-speaking users.
-        """
-        self.ru = ru_text
-        self.en = en_text
-
-    def get(self, user_lang):
-        if user_lang == 'ru':
-            return self.ru
-        else:
-            return self.en
-
     @staticmethod
-    def format_float(value):
+    async def remember_prompt(state, prompt):
         """
-        Formats float value.
+        Saves id of bot message asking user to send something, so it is edited after user replies.
 
         Args:
-            value (float): Value to be formatted.
+            state (FSMContext): Current state.
+            prompt (Message): Bot message.
 
         Returns:
-            str: Formatted value.
+            Message: Prompt message.
         """
-        if isinstance(value, float) or isinstance(value, Decimal):
-            return f'{value:.2f}'
-        else:
-            return float
+        await state.update_data({CommonRouter.PROMPT_KEY: prompt.message_id})
+        return prompt
 
     @staticmethod
-    def format_date(value):
+    async def edit_prompt(message, state, bot, text):
         """
-        Formats date or datetime value.
+        Replaces text of the prompt message user replied to. Nothing is sent, if prompt is unknown.
 
         Args:
-            value (datetime.datetime | datetime.date): Value to be formatted.
-
-        Returns:
-            str: Formatted value.
+            message (Message): User message.
+            state (FSMContext): Current state.
+            bot (Bot): Bot instance.
+            text (str): New text.
         """
-        if isinstance(value, datetime.datetime):
-            return value.strftime('%d.%m.%Y %H:%M')
-        if isinstance(value, datetime.date):
-            return value.strftime('%d.%m.%Y')
+        prompt_id = (await state.get_data()).get(CommonRouter.PROMPT_KEY)
+        if prompt_id is None:
+            return
+        try:
+            await bot.edit_message_text(text=text, chat_id=message.chat.id, message_id=prompt_id, reply_markup=None)
+        except TelegramBadRequest:
+            pass
@@ -13,9 +13,8 @@ from bot.fsm_states import DeleteExpenseLimitStates
 from bot.filters import UserExists
 from bot.keyboards import binary_keyboard
 from bot.keyboards import expense_limits_keyboard
-from bot.static.user_languages import USER_LANGUAGE_PREFERENCES
 
-from db import ExpenseLimit, BotUser
+from db import ExpenseLimit, PurgeJob
 from bot.routers import MessageTexts as MT
 
 
@@ -102,18 +101,18 @@ class DeleteRouter(Router):
         return await message.answer(m_texts.get(user_lang), reply_markup=decision_keyboard, parse_mode=ParseMode.HTML)
 
     @staticmethod
-    async def delete_user_data(callback, state, user_lang):
+    async def delete_user_data(callback, state, user_lang, purge_queue):
         """
         Delete all user's data - step 2 / 2
 
-        Catches callback from user deletion decision. If user confirms their decision, all data
-        in database, including tables and records, is deleted, user preferred languages is dropped
-        from local data dictionary. Otherwise, data is kept.
+        Catches callback from user deletion decision. If user confirms their decision, purge job is created
+        and user is notified by purge queue worker when it's finished. Otherwise, data is kept.
 
         Args:
             callback (CallbackQuery): Callback query.
             state (FSMContext): FSMContext instance.
             user_lang (str): User language.
+            purge_queue (PurgeQueue): Purge jobs queue.
 
         Returns:
             Message: Answer message.
@@ -123,32 +122,26 @@ class DeleteRouter(Router):
 
         # User confirmed the decision.
         if callback.data == 'delete':
-            user_id = callback.from_user.id
-
-            # Successful deletion.
-            try:
-                # Drop user's data queries
-                await BotUser.delete(tg_id=user_id)
-                # Delete user specified language from languages dict
-                del USER_LANGUAGE_PREFERENCES[user_id]
-                await state.clear()
+            await state.clear()
+            # Message is edited before the job is created, so it doesn't overwrite the result
+            m_texts = MT(
+                ru_text='Удаляю ваши данные...',
+                en_text='Deleting your data...'
+            )
+            message = await callback.message.edit_text(m_texts.get(user_lang))
 
+            # Large accounts take a while to purge, so it's done by background workers off the request path
+            job_id = await PurgeJob.create(user_id=callback.from_user.id, chat_id=callback.message.chat.id,
+                                           status_message_id=callback.message.message_id, user_lang=user_lang)
+            if job_id is None:
                 m_texts = MT(
-                    ru_text='Все данные, связанные с вами, удалены. Всего хорошего!',
-                    en_text='All data associated with you is deleted. Thank you!'
+                    ru_text='Ваши данные уже удаляются, пожалуйста, подождите',
+                    en_text='Your data is already being deleted, please wait'
                 )
                 return await callback.message.edit_text(m_texts.get(user_lang))
 
-            # Internal error.
-            except Exception as e:
-                logger.error(e)
-                await state.clear()
-
-                m_texts = MT(
-                    ru_text='К сожалению, произошла внутренняя ошибка, данные сохранены. Пожалуйста, попробуйте позже',
-                    en_text='Unfortunately, internal error occurred, data is still saved. Please try again.'
-                )
-                return await callback.message.edit_text(m_texts.get(user_lang))
+            purge_queue.notify()
+            return message
 
         # User canceled the decision.
         else:
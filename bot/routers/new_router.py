@@ -13,7 +13,7 @@ from aiogram.exceptions import TelegramBadRequest
 from db import BotUser, Expense, ExpenseLimit, Income
 from bot.filters import UserExists
 from bot.fsm_states import (
-    RegistrationStates, NewIncomeStates, NewExpenseStates, NewExpenseLimitStates, ExportStates, NewChoice
+    RegistrationStates, NewIncomeStates, NewExpenseStates, NewExpenseLimitStates, NewChoice
 )
 from bot.internal import check_input
 import bot.keyboards as keyboards
@@ -77,10 +77,6 @@ class NewRecordRouter(Router, CommonRouter):
             Message: Reply message.
         """
         m_texts = {
-            'impossible': MT(
-                ru_text='Невозможно прервать этот процесс',
-                en_text='Impossible to abort the process'
-            ),
             'nothing': MT(
                 ru_text='Нет процессов для прерывания',
                 en_text='There is nothing to abort'
@@ -93,15 +89,9 @@ class NewRecordRouter(Router, CommonRouter):
 
         current_state = await state.get_state()
         if current_state is not None:
-            # Export process cannot be aborted
-            if current_state in [st for st in ExportStates.__state_names__]:
-                message_text = m_texts['impossible'].__getattribute__(user_lang)
-                return await message.answer(message_text)
-            # Other processes can
-            else:
-                await state.clear()
-                message_text = m_texts['aborted'].__getattribute__(user_lang)
-                return await message.answer(message_text)
+            await state.clear()
+            message_text = m_texts['aborted'].__getattribute__(user_lang)
+            return await message.answer(message_text)
         # There is no state set
         else:
             message_text = m_texts['nothing'].__getattribute__(user_lang)
@@ -120,7 +110,8 @@ class RegistrationRouter(Router, CommonRouter):
     def register_handlers(self):
         self.message.register(self.start, Command(commands=['add']), ~UserExists(), StateFilter(None))
         self.callback_query.register(self.save_language_preference, RegistrationStates.preferred_language)
-        self.callback_query.register(self.finish, RegistrationStates.decision)
+        # Answer text depends on registration result
+        self.callback_query.register(self.finish, RegistrationStates.decision, flags={'callback_answer': {'pre': False}})
 
     @staticmethod
     async def start(message: Message, state: FSMContext, user_lang: str):
@@ -193,7 +184,7 @@ class RegistrationRouter(Router, CommonRouter):
         message_text = m_texts.__getattribute__(user_lang)
         return await message.answer(message_text, reply_markup=keyboard)
 
-    async def finish(self, callback, state, user_lang, bot):
+    async def finish(self, callback, state, user_lang, bot, callback_answer):
         """
         Gets user decision in terms of registration. If user want to register, adds their data to db
         and continues initial command process. Otherwise, doesn't register the user and notifies
@@ -204,6 +195,7 @@ class RegistrationRouter(Router, CommonRouter):
             state (FSMContext): Current state.
             user_lang (str): User language.
             bot (Bot): Bot instance.
+            callback_answer (CallbackAnswer): Callback query answer sent after handler.
 
         Returns:
             Message:
@@ -235,8 +227,7 @@ class RegistrationRouter(Router, CommonRouter):
                 await BotUser.create(tg_id=callback.from_user.id, tg_username=callback.from_user.username,
                                      tg_first_name=callback.from_user.first_name, lang=state_data['lang'])
 
-                notification_text = m_texts['success'].__getattribute__(state_data['lang'])
-                await callback.answer(notification_text)
+                callback_answer.text = m_texts['success'].__getattribute__(state_data['lang'])
                 message_text = m_texts['after'].__getattribute__(state_data['lang'])
                 message_text = message_text.format(state_data['command'])
                 return await callback.message.edit_text(message_text)
@@ -266,9 +257,9 @@ class NewExpenseRouter(Router, CommonRouter):
 
         self.message.register(self.save_amount, NewExpenseStates.get_money_amount)
 
-        self.callback_query.register(self.save_category, NewExpenseStates.get_category)
+        self.callback_query.register(self.save_category, NewExpenseStates.get_category, flags={'callback_answer': {'pre': False}})
 
-        self.callback_query.register(self.save_subcategory, NewExpenseStates.get_subcategory)
+        self.callback_query.register(self.save_subcategory, NewExpenseStates.get_subcategory, flags={'callback_answer': {'pre': False}})
 
         self.callback_query.register(self.save_datetime, NewExpenseStates.get_datetime)
         self.message.register(self.save_datetime, NewExpenseStates.get_datetime)
@@ -301,6 +292,7 @@ class NewExpenseRouter(Router, CommonRouter):
                      en_text=f'1/{self.total_steps}. Please, send money amount (format: 123.45 or 123)')
 
         message_text = m_texts.__getattribute__(user_lang)
+        await self.remember_prompt(state, callback.message)
         return await callback.message.edit_text(text=message_text)
 
     async def save_amount(self, message, state, user_lang, bot):
@@ -321,12 +313,8 @@ class NewExpenseRouter(Router, CommonRouter):
         if money_amount is not None:
             # Save user data to state data to get it later
             await state.update_data(amount=money_amount)
-            # Display user data in last bot message
-            try:
-                await bot.edit_message_text(text=f'1/{self.total_steps}. {MT.format_float(money_amount)}',
-                                            message_id=message.message_id - 1, chat_id=message.chat.id)
-            except TelegramBadRequest:
-                pass
+            # Display user data in prompt message
+            await self.edit_prompt(message, state, bot, text=f'1/{self.total_steps}. {MT.format_float(money_amount)}')
 
             # Ask for category
             return await self.get_category(message, state, user_lang)
@@ -356,7 +344,7 @@ class NewExpenseRouter(Router, CommonRouter):
         elif isinstance(event, CallbackQuery):
             return await event.message.edit_text(text=message_text, reply_markup=keyboard)
 
-    async def save_category(self, callback, state, user_lang, bot):
+    async def save_category(self, callback, state, user_lang, bot, callback_answer):
         """
         Saves chosen category and redirects to get_expense_subcategory.
 
@@ -365,6 +353,7 @@ class NewExpenseRouter(Router, CommonRouter):
             state (FSMContext): Current state.
             user_lang (str): User language.
             bot (Bot): Bot.
+            callback_answer (CallbackAnswer): Callback query answer sent after handler.
 
         Returns:
             Message: Reply message.
@@ -380,8 +369,7 @@ class NewExpenseRouter(Router, CommonRouter):
             return await self.get_subcategory(callback, state, user_lang)
         else:
             m_texts = MT(ru_text='Пожалуйста, выберите категорию', en_text='Please, choose category')
-            message_text = m_texts.__getattribute__(user_lang)
-            return await callback.answer(message_text)
+            callback_answer.text = m_texts.__getattribute__(user_lang)
 
     async def get_subcategory(self, event, state, user_lang):
         """
@@ -409,7 +397,7 @@ class NewExpenseRouter(Router, CommonRouter):
         elif isinstance(event, CallbackQuery):
             return await event.message.edit_text(text=message_text, reply_markup=keyboard)
 
-    async def save_subcategory(self, callback, state, user_lang, bot):
+    async def save_subcategory(self, callback, state, user_lang, bot, callback_answer):
         """
         Gets callback data from subcategory keyboard. If 'back' button is pushed,
         sets state to NewExpenseStates.get_category and redirects back to get_expense_category.
@@ -420,6 +408,7 @@ class NewExpenseRouter(Router, CommonRouter):
             state (FSMContext): Current state.
             user_lang (str): User language.
             bot (Bot): Bot.
+            callback_answer (CallbackAnswer): Callback query answer sent after handler.
 
         Returns:
             Message: Reply message.
@@ -449,8 +438,7 @@ class NewExpenseRouter(Router, CommonRouter):
             return await self.get_datetime(callback, state, user_lang)
         else:
             m_texts = MT(ru_text='Пожалуйста, выберите подкатегорию', en_text='Please, choose subcategory')
-            message_text = m_texts.__getattribute__(user_lang)
-            return await callback.answer(message_text)
+            callback_answer.text = m_texts.__getattribute__(user_lang)
 
     async def get_datetime(self, event, state, user_lang):
         """
@@ -473,9 +461,9 @@ class NewExpenseRouter(Router, CommonRouter):
         message_text = m_texts.__getattribute__(user_lang)
 
         if isinstance(event, Message):
-            return await event.answer(message_text, reply_markup=keyboard)
+            return await self.remember_prompt(state, await event.answer(message_text, reply_markup=keyboard))
         elif isinstance(event, CallbackQuery):
-            return await event.message.answer(text=message_text, reply_markup=keyboard)
+            return await self.remember_prompt(state, await event.message.answer(text=message_text, reply_markup=keyboard))
 
     async def save_datetime(self, event, state, user_lang, bot):
         """
@@ -490,7 +478,7 @@ class NewExpenseRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        await self.clear_inline_markup(source=event, bot=bot)
+        await self.clear_inline_markup(source=event, bot=bot, state=state)
 
         if isinstance(event, CallbackQuery):
             if event.data == 'now':
@@ -531,9 +519,9 @@ class NewExpenseRouter(Router, CommonRouter):
         message_text = m_texts.__getattribute__(user_lang)
 
         if isinstance(event, Message):
-            return await event.answer(message_text, reply_markup=keyboard)
+            return await self.remember_prompt(state, await event.answer(message_text, reply_markup=keyboard))
         elif isinstance(event, CallbackQuery):
-            return await event.message.answer(text=message_text, reply_markup=keyboard)
+            return await self.remember_prompt(state, await event.message.answer(text=message_text, reply_markup=keyboard))
 
     async def save_location(self, event, state, bot, user_lang):
         """
@@ -548,18 +536,15 @@ class NewExpenseRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        await self.clear_inline_markup(source=event, bot=bot)
+        await self.clear_inline_markup(source=event, bot=bot, state=state)
 
         if isinstance(event, Message):
             if event.location is not None:
-                # Convert geometry from telegram data to shapely point
-                geometry_point = check_input.tg_location_to_geometry(event.location)
-                await state.update_data(location=geometry_point)
-                # Display user data in message
-                try:
-                    await bot.edit_message_text(text=f'5/{self.total_steps}. {geometry_point.x} {geometry_point.y}', message_id=event.message_id - 1, chat_id=event.chat.id)
-                except TelegramBadRequest:
-                    pass
+                # Keep plain coordinates in state data, point is created on saving
+                lon, lat = check_input.tg_location_to_coordinates(event.location)
+                await state.update_data(location=(lon, lat))
+                # Display user data in prompt message
+                await self.edit_prompt(event, state, bot, text=f'5/{self.total_steps}. {lon} {lat}')
 
                 return await self.get_confirmation(event, state, user_lang)
 
@@ -605,7 +590,7 @@ class NewExpenseRouter(Router, CommonRouter):
         if total_data['location'] is not None:
             message_data.append(
                 ('Координаты' if user_lang == 'ru' else 'Location',
-                 f"{total_data['location'].x} {total_data['location'].y}")
+                 f"{total_data['location'][0]} {total_data['location'][1]}")
             )
         # Collect final message text
         message_text = '\n'.join([': '.join(x) for x in message_data])
@@ -650,7 +635,7 @@ class NewExpenseRouter(Router, CommonRouter):
             try:
                 await Expense.create(user_id=total_data['user_id'], amount=total_data['amount'],
                                      subcategory_id=total_data['subcategory'], event_time=total_data['event_datetime'],
-                                     location=total_data['location'])
+                                     location=check_input.coordinates_to_geometry(total_data['location']))
                 message_text = '\n\n'.join([message_text_base, '<b>' + m_texts['success'].__getattribute__(user_lang) + '</b>'])
                 return await callback.message.edit_text(message_text, reply_markup=None)
 
@@ -705,6 +690,7 @@ class NewIncomeRouter(Router, CommonRouter):
 
         m_texts = MT(ru_text=f'1/{self.total_steps}. Пожалуйста, пришлите сумму (формат: 123.45 или 123)',
                      en_text=f'1/{self.total_steps}. Please, send money amount (format: 123.45 or 123)')
+        await self.remember_prompt(state, callback.message)
         return await callback.message.edit_text(text=m_texts.__getattribute__(user_lang))
 
     async def save_amount(self, message, state, user_lang, bot):
@@ -726,12 +712,8 @@ class NewIncomeRouter(Router, CommonRouter):
         money_amount, error_text = check_input.money_amount_from_user_message(raw_money_amount, user_lang)
         if money_amount is not None:
             await state.update_data({'amount': money_amount})
-            # Display user data in last bot message
-            try:
-                await bot.edit_message_text(text=f'1/{self.total_steps}. {MT.format_float(money_amount)}',
-                                            message_id=message.message_id - 1, chat_id=message.chat.id)
-            except TelegramBadRequest:
-                pass
+            # Display user data in prompt message
+            await self.edit_prompt(message, state, bot, text=f'1/{self.total_steps}. {MT.format_float(money_amount)}')
 
             return await self.get_active_status(message, state, user_lang)
         else:
@@ -802,7 +784,8 @@ class NewIncomeRouter(Router, CommonRouter):
         date_ex = MT.format_date(dt.date.today())
         m_texts = MT(ru_text=f'3/{self.total_steps}. Пришлите дату получения дохода (формат: {date_ex})',
                      en_text=f'3/{self.total_steps}. Send date of income (format: {date_ex})')
-        return await message.answer(m_texts.__getattribute__(user_lang), reply_markup=today_markup)
+        return await self.remember_prompt(state, await message.answer(m_texts.__getattribute__(user_lang),
+                                                                      reply_markup=today_markup))
 
     async def save_date(self, event, state, user_lang, bot):
         """
@@ -819,7 +802,7 @@ class NewIncomeRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        await self.clear_inline_markup(event, bot)
+        await self.clear_inline_markup(event, bot, state)
 
         if isinstance(event, CallbackQuery):
             if event.data == 'today':
@@ -833,12 +816,7 @@ class NewIncomeRouter(Router, CommonRouter):
             event_date, error_text = check_input.event_date_from_user_message(raw_event_date, user_lang)
             if event_date is not None:
                 await state.update_data({'event_date': event_date})
-                # Save collected data to db
-                try:
-                    await bot.edit_message_text(text=f'3/{self.total_steps}. {MT.format_date(event_date)}',
-                                                message_id=event.message_id - 1, chat_id=event.chat.id)
-                except TelegramBadRequest:
-                    pass
+                await self.edit_prompt(event, state, bot, text=f'3/{self.total_steps}. {MT.format_date(event_date)}')
 
                 return await self.get_confirmation(event, state, user_lang)
             else:
@@ -986,6 +964,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
                          en_text='\n\nYou already have limits named {}')
             message_text += m_texts.get(user_lang).format(exist_titles_string)
 
+        await self.remember_prompt(state, callback.message)
         return await callback.message.edit_text(text=message_text, parse_mode=ParseMode.HTML)
 
     async def save_title(self, message, state, bot, user_lang):
@@ -1015,11 +994,8 @@ class NewExpenseLimitRouter(Router, CommonRouter):
 
             # Save title
             await state.update_data(title=message.text.strip())
-            # Display user title in message
-            try:
-                await bot.edit_message_text(text=f'1/{self.total_steps}. {user_title}', message_id=message.message_id - 1, chat_id=message.chat.id, reply_markup=None)
-            except TelegramBadRequest:
-                pass
+            # Display user title in prompt message
+            await self.edit_prompt(message, state, bot, text=f'1/{self.total_steps}. {user_title}')
             return await self.get_category(message, state, user_lang)
 
         else:
@@ -1233,6 +1209,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
                      en_text=f'4/{self.total_steps}. When to start applying expense limit? You can choose by buttons '
                              f'or send a date manually (format: {date_ex}).')
 
+        await self.remember_prompt(state, callback.message)
         return await callback.message.edit_text(m_texts.get(user_lang), reply_markup=keyboard)
 
     async def save_start_date(self, event, state, user_lang, bot):
@@ -1248,7 +1225,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        await self.clear_inline_markup(event, bot)
+        await self.clear_inline_markup(event, bot, state)
 
         if isinstance(event, CallbackQuery):
             try:
@@ -1274,11 +1251,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
                     return await event.reply(text=m_texts.get(user_lang))
 
                 await state.update_data(period_start=period_start_date)
-                try:
-                    await bot.edit_message_text(text=f'4/{self.total_steps}. {MT.format_date(period_start_date)}',
-                                                message_id=event.message_id - 1, chat_id=event.chat.id)
-                except TelegramBadRequest:
-                    pass
+                await self.edit_prompt(event, state, bot, text=f'4/{self.total_steps}. {MT.format_date(period_start_date)}')
 
                 return await self.get_limit_value(event, state, user_lang)
             else:
@@ -1302,7 +1275,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
                              f'в один период? (формат: 123.45 или 123)',
                      en_text=f'5/{self.total_steps}. What is the maximum amount of money you would like to spend '
                              f'for the subcategory in one period? (format: 123.45 or 123)')
-        return await message.answer(m_texts.get(user_lang))
+        return await self.remember_prompt(state, await message.answer(m_texts.get(user_lang)))
 
     async def save_limit_value(self, message, state, user_lang, bot):
         """
@@ -1320,11 +1293,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
         amount, error_text = check_input.money_amount_from_user_message(message.text.strip(), user_lang)
         if amount is not None:
             await state.update_data(limit_amount=amount)
-            try:
-                await bot.edit_message_text(text=f'5/{self.total_steps}. {MT.format_float(amount)}',
-                                            chat_id=message.chat.id, message_id=message.message_id - 1)
-            except TelegramBadRequest:
-                pass
+            await self.edit_prompt(message, state, bot, text=f'5/{self.total_steps}. {MT.format_float(amount)}')
 
             return await self.get_end_date(message, state, user_lang)
         else:
@@ -1351,7 +1320,7 @@ class NewExpenseLimitRouter(Router, CommonRouter):
                              f'Нажмите кнопку, чтобы пропустить',
                      en_text=f'6/{self.total_steps}. If you wish, set the end date of expense limit. After this date '
                              f'expense limit will be deleted automatically (format: 01.12.2023). Press button to skip')
-        return await message.answer(m_texts.get(user_lang), reply_markup=keyboard)
+        return await self.remember_prompt(state, await message.answer(m_texts.get(user_lang), reply_markup=keyboard))
 
     async def save_end_date(self, event, state, bot, user_lang):
         """
@@ -1366,17 +1335,13 @@ class NewExpenseLimitRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        await self.clear_inline_markup(event, bot)
+        await self.clear_inline_markup(event, bot, state)
 
         if isinstance(event, Message):
             end_date, error_text = check_input.event_date_from_user_message(event.text, past=False, user_lang=user_lang)
             if end_date is not None:
                 await state.update_data(end_date=end_date)
-                try:
-                    await bot.edit_message_text(text=f'6/{self.total_steps}. {MT.format_float(end_date)}',
-                                                chat_id=event.chat.id, message_id=event.message_id - 1)
-                except TelegramBadRequest:
-                    pass
+                await self.edit_prompt(event, state, bot, text=f'6/{self.total_steps}. {MT.format_float(end_date)}')
 
                 return await self.get_cumulative_status(event, state, user_lang)
             else:
@@ -8,17 +8,16 @@ from aiogram.types.input_file import FSInputFile
 from aiogram.types import InputMediaPhoto
 from aiogram.filters import Command, StateFilter
 from sqlalchemy import select
-from sqlalchemy.sql import functions
 
-import geopandas as gpd
 import pandas as pd
 
 from bot.filters import UserExists
+from bot.fsm_states import NearbyExpensesStates
 import bot.keyboards as keyboards
 from bot.routers import CommonRouter, MessageTexts as MT
-from db import BotUser, Expense, ExpenseLimit, Income, ExpenseSubcategory, ExpenseCategory
+from db import Expense, ExpenseLimit, Income, ExpenseSubcategory, UserTotals
 from bot.internal.graphs import GraphCreator
-from configs import async_sess_maker
+from configs import BASE_DIR, GRAPH_BACKEND
 
 
 class StatsRouter(Router, CommonRouter):
@@ -31,6 +30,8 @@ class StatsRouter(Router, CommonRouter):
         self.MAIN_COLOR_RGB = (75, 10, 255)
         self.LIGHT_COLOR = '#cbcaff'
         self.FONT_SIZE = 12
+        self.NEARBY_RADIUS = 1000
+        self.NEARBY_PAGE_SIZE = 10
 
     def register_handlers(self):
         self.message.register(self.no_stats, Command(commands=['stats']), ~UserExists(), StateFilter(None))
@@ -38,8 +39,14 @@ class StatsRouter(Router, CommonRouter):
 
         self.callback_query.register(self.profile_stats, F.data == 'statistics_profile', UserExists(), StateFilter(None))
         self.callback_query.register(self.expense_limits_stats, F.data == 'statistics_expense_limits', UserExists(), StateFilter(None))
-        self.callback_query.register(self.last_month_expenses_stats, F.data == 'statistics_last_month_expense', UserExists(), StateFilter(None))
-        self.callback_query.register(self.last_year_income_stats, F.data == 'statistics_last_year_income', UserExists(), StateFilter(None))
+        # Graph rendering runs in heavy lane
+        self.callback_query.register(self.last_month_expenses_stats, F.data == 'statistics_last_month_expense', UserExists(), StateFilter(None), flags={'heavy': True})
+        self.callback_query.register(self.last_year_income_stats, F.data == 'statistics_last_year_income', UserExists(), StateFilter(None), flags={'heavy': True})
+        self.callback_query.register(self.nearby_expenses_location, F.data == 'statistics_nearby', UserExists(), StateFilter(None))
+        self.callback_query.register(self.nearby_expenses_next_page, F.data.startswith('nearby:'), UserExists(), StateFilter(None),
+                                     flags={'callback_answer': {'pre': False}})
+        self.callback_query.register(self.nearby_expenses_cancel, F.data == 'nearby_cancel', NearbyExpensesStates.get_location)
+        self.message.register(self.nearby_expenses_stats, NearbyExpensesStates.get_location)
 
 
     @staticmethod
@@ -74,7 +81,8 @@ class StatsRouter(Router, CommonRouter):
             ('Профиль', 'Profile', 'statistics_profile'),
             ('Пределы расходов', 'Expense limits', 'statistics_expense_limits'),
             ('Расходы за последний месяц', 'Last month expenses', 'statistics_last_month_expense'),
-            ('Доходы за последний год', 'Last year incomes', 'statistics_last_year_income')
+            ('Доходы за последний год', 'Last year incomes', 'statistics_last_year_income'),
+            ('Расходы рядом', 'Expenses nearby', 'statistics_nearby')
         )
         keyboard = keyboards.multi_button_keyboard(user_lang, buttons_data=buttons, one_row_count=1)
 
@@ -93,54 +101,34 @@ class StatsRouter(Router, CommonRouter):
         Returns:
             Message: Reply message.
         """
-        user = await BotUser.get_by_id(user_id=callback.from_user.id)
-        days_of_usage = (dt.date.today() - user.registration_date).days + 1
+        profile = await UserTotals.select_profile(user_id=callback.from_user.id)
+        days_of_usage = (dt.date.today() - profile.registration_date).days + 1
 
         # Basic user info
         message_texts = [
             [
-                f'{"Дата регистрации" if user_lang == "ru" else "Registration date"}: {MT.format_date(user.registration_date)}',
+                f'{"Дата регистрации" if user_lang == "ru" else "Registration date"}: {MT.format_date(profile.registration_date)}',
                 f'{"Дней использования" if user_lang == "ru" else "Days of usage"}: {days_of_usage}'
             ]
         ]
 
         # General expenses stats
-        expenses_query = select(functions.sum(Expense.amount), functions.count(Expense.expense_id)).where(user.tg_id == Expense.user_id)
-        async with async_sess_maker() as session:
-            data = await session.execute(expenses_query)
-        no_expenses = [f'{"Пока не учтено ни одного расхода" if user_lang == "ru" else "No expenses logged yet"}']
-        try:
-            expenses_sum, expenses_count = list(data.all())[0]
-        except (TypeError, IndexError) as e:
-            logger.warning(e)
-            message_texts.append(no_expenses)
+        if profile.expense_count == 0:
+            message_texts.append([f'{"Пока не учтено ни одного расхода" if user_lang == "ru" else "No expenses logged yet"}'])
         else:
-            if expenses_count == 0:
-                message_texts.append(no_expenses)
-            else:
-                message_texts.append([
-                    f'{"Расходов учтено" if user_lang == "ru" else "Expenses logged"}: {expenses_count}',
-                    f'{"Общая сумма" if user_lang == "ru" else "Total amount"}: {MT.format_float(expenses_sum)}'
-                ])
+            message_texts.append([
+                f'{"Расходов учтено" if user_lang == "ru" else "Expenses logged"}: {profile.expense_count}',
+                f'{"Общая сумма" if user_lang == "ru" else "Total amount"}: {MT.format_float(profile.expense_sum)}'
+            ])
 
         # General incomes stats
-        incomes_query = select(functions.sum(Income.amount), functions.count(Income.id)).where(user.tg_id == Income.user_id)
-        async with async_sess_maker() as session:
-            data = await session.execute(incomes_query)
-        no_incomes = [f'{"Пока не учтено ни одного дохода" if user_lang == "ru" else "No incomes logged yet"}']
-        try:
-            incomes_sum, incomes_count = list(data.all())[0]
-        except (TypeError, IndexError) as e:
-            logger.warning(e)
-            message_texts.append(no_incomes)
+        if profile.income_count == 0:
+            message_texts.append([f'{"Пока не учтено ни одного дохода" if user_lang == "ru" else "No incomes logged yet"}'])
         else:
-            if incomes_count == 0:
-                message_texts.append(no_incomes)
-            else:
-                message_texts.append([
-                    f'{"Доходов учтено" if user_lang == "ru" else "Incomes logged"}: {incomes_count}',
-                    f'{"Общая сумма" if user_lang == "ru" else "Total amount"}: {MT.format_float(incomes_sum)}'
-                ])
+            message_texts.append([
+                f'{"Доходов учтено" if user_lang == "ru" else "Incomes logged"}: {profile.income_count}',
+                f'{"Общая сумма" if user_lang == "ru" else "Total amount"}: {MT.format_float(profile.income_sum)}'
+            ])
 
         return await callback.message.answer('\n\n'.join(['\n'.join(mt) for mt in message_texts]))
 
@@ -202,45 +190,42 @@ class StatsRouter(Router, CommonRouter):
 
             return await callback.message.answer('\n\n'.join(reports))
 
-    async def last_month_expenses_stats(self, callback, user_lang, sync_engine, bot):
+    async def last_month_expenses_stats(self, callback, user_lang, bot, lane):
         """
         Sends user's last month expense statistics.
 
         Args:
             callback (CallbackQuery): Callback button.
             user_lang (str): User language.
-            sync_engine (SyncEngine): Async engine.
             bot (Bot): Bot instance.
+            lane (Lane): Heavy lane to render graphs in.
 
         Returns:
             Message: Reply message.
         """
-        # Get date limit and query
-        min_date, expenses_query = self.__expense_query_30(user_lang)
-        # Query data
-        data = gpd.read_postgis(sql=expenses_query, con=sync_engine, geom_col='location')
-        # User has no data
-        if data.shape[0] == 0:
+        min_date = dt.date.today() - dt.timedelta(days=30)
+        # Query aggregated data
+        daily, categories, subcategories = await Expense.select_stats(user_id=callback.from_user.id,
+                                                                      min_date=min_date, user_lang=user_lang)
+        # User has no data, callback query is already answered, so the notice is a message
+        if daily.shape[0] == 0:
             m_text = MT('За последние 30 дней у вас нет расходов', 'You have no expenses in last 30 days')
-            return await callback.answer(m_text.get(user_lang))
-
-        # User has data. Rename columns to unify scenario
-        data = data.rename(columns={
-            'title_ru': 'subcategory', 'title_ru_1': 'category',
-            'title_en': 'subcategory', 'title_en_1': 'category',
-        })
+            return await callback.message.answer(m_text.get(user_lang))
+        clusters = await Expense.select_location_clusters(user_id=callback.from_user.id, min_date=min_date)
 
         # Get graphs
-        graph_creator = GraphCreator(data=data, user_lang=user_lang)
-        paths = graph_creator.create_expense_cards(user_id=callback.from_user.id, min_date=min_date,
-                                                   user_nickname=callback.from_user.username)
+        graph_creator = GraphCreator(data=daily, user_lang=user_lang, backend=GRAPH_BACKEND,
+                                     temp_folder=os.path.join(BASE_DIR, 'temp'))
+        paths = await lane.run(graph_creator.create_expense_cards, user_id=callback.from_user.id, min_date=min_date,
+                               categories=categories, subcategories=subcategories,
+                               clusters=clusters, user_nickname=callback.from_user.username)
 
         message = await self.send_media_group(paths=paths, bot=bot, chat_id=callback.message.chat.id,
                                               message_id=callback.message.message_id)
-        await self.send_total_caption(message, user_lang, data.amount.sum())
+        await self.send_total_caption(message, user_lang, categories.sum())
         self.__clear_files(paths)
 
-    async def last_year_income_stats(self, callback, user_lang, sync_engine, bot):
+    async def last_year_income_stats(self, callback, user_lang, sync_engine, bot, lane):
         """
         Sends user's last year income statistics
 
@@ -249,20 +234,22 @@ class StatsRouter(Router, CommonRouter):
             user_lang (str): User language.
             sync_engine (SyncEngine): Async engine.
             bot (Bot): Bot instance.
+            lane (Lane): Heavy lane to query data and render graphs in.
 
         Returns:
             Message: Reply message.
         """
         min_date = dt.date.today() - dt.timedelta(days=365)
         query = select(Income).where(callback.from_user.id == Income.user_id).where(Income.event_date >= min_date)
-        data = pd.read_sql(query, con=sync_engine)
+        data = await lane.run(pd.read_sql, query, con=sync_engine)
         if data.shape[0] == 0:
             m_text = MT('За последние 365 дней у вас нет доходов', 'You have no incomes in last 365 days')
             return await callback.message.answer(m_text.get(user_lang))
 
-        graphs_creator = GraphCreator(data=data, user_lang=user_lang)
-        paths = graphs_creator.create_income_cards(user_id=callback.from_user.id, min_date=min_date,
-                                                   user_nickname=callback.from_user.username)
+        graphs_creator = GraphCreator(data=data, user_lang=user_lang, backend=GRAPH_BACKEND,
+                                      temp_folder=os.path.join(BASE_DIR, 'temp'))
+        paths = await lane.run(graphs_creator.create_income_cards, user_id=callback.from_user.id, min_date=min_date,
+                               user_nickname=callback.from_user.username)
         if isinstance(paths, str):
             paths = tuple([paths])
 
@@ -271,32 +258,139 @@ class StatsRouter(Router, CommonRouter):
         await self.send_total_caption(message, user_lang, data.amount.sum())
         self.__clear_files(paths)
 
-    @staticmethod
-    def __expense_query_30(user_lang):
+    async def nearby_expenses_location(self, callback, state, user_lang):
         """
-        Calculates min date (current date - 30 days) and generates expenses data query according to user language.
+        Sets NearbyExpensesStates.get_location state and asks for location.
 
         Args:
+            callback (CallbackQuery): Callback button.
+            state (FSMContext): Current state.
             user_lang (str): User language.
 
         Returns:
-            tuple[datetime.date, sqlalchemy.Select]: Min date value and query object.
+            Message: Reply message.
         """
-        min_date = dt.date.today() - dt.timedelta(days=30)
-        # Columns list depends on user language
-        columns = (
-            Expense.expense_id, Expense.amount, Expense.event_time, Expense.location,
-            ExpenseSubcategory.title_ru if user_lang == 'ru' else ExpenseSubcategory.title_en,
-            ExpenseCategory.title_ru if user_lang == 'ru' else ExpenseCategory.title_en
-        )
-        # Query is the same for all languages
-        expenses_query = (select(*columns).where(Expense.event_time >= min_date)
-                          .join_from(Expense, ExpenseSubcategory,
-                                     onclause=Expense.subcategory == ExpenseSubcategory.id)
-                          .join_from(ExpenseSubcategory, ExpenseCategory,
-                                     onclause=ExpenseCategory.id == ExpenseSubcategory.category))
-
-        return min_date, expenses_query
+        keyboard = keyboards.one_button_keyboard(labels=('Отмена', 'Cancel'), callback_data='nearby_cancel',
+                                                 user_language=user_lang)
+        await state.set_state(NearbyExpensesStates.get_location)
+
+        m_texts = MT('Пришлите локацию, чтобы посмотреть расходы рядом с ней',
+                     'Send location to see your expenses nearby')
+        return await self.remember_prompt(state, await callback.message.answer(m_texts.get(user_lang),
+                                                                               reply_markup=keyboard))
+
+    async def nearby_expenses_cancel(self, callback, state, user_lang, bot):
+        """
+        Cancels expenses nearby statistics.
+
+        Args:
+            callback (CallbackQuery): Callback button.
+            state (FSMContext): Current state.
+            user_lang (str): User language.
+            bot (Bot): Bot instance.
+
+        Returns:
+            Message: Reply message.
+        """
+        await self.clear_inline_markup(source=callback, bot=bot)
+        await state.clear()
+        return await callback.message.answer(MT('Отменено', 'Cancelled').get(user_lang))
+
+    async def nearby_expenses_stats(self, message, state, user_lang, bot):
+        """
+        Sends the first page of user's expenses nearby the sent location. If message contains no location,
+        asks again.
+
+        Args:
+            message (Message): User message.
+            state (FSMContext): Current state.
+            user_lang (str): User language.
+            bot (Bot): Bot instance.
+
+        Returns:
+            Message: Reply message.
+        """
+        if message.location is None:
+            m_texts = MT('Пришлите локацию или нажмите "Отмена"', 'Send location or press "Cancel"')
+            return await message.answer(m_texts.get(user_lang))
+
+        await self.clear_inline_markup(source=message, bot=bot, state=state)
+        await state.clear()
+        text, keyboard = await self.__nearby_page(user_id=message.from_user.id, user_lang=user_lang, state=state,
+                                                  lon=round(message.location.longitude, 5),
+                                                  lat=round(message.location.latitude, 5))
+        return await message.answer(text, reply_markup=keyboard)
+
+    async def nearby_expenses_next_page(self, callback, state, user_lang, bot, callback_answer):
+        """
+        Sends the next page of user's expenses nearby. Callback data is built according to template
+        ``nearby:page``, the point and the last row of the previous page are kept in state data.
+
+        Args:
+            callback (CallbackQuery): Callback button.
+            state (FSMContext): Current state.
+            user_lang (str): User language.
+            bot (Bot): Bot instance.
+            callback_answer (CallbackAnswer): Callback query answer sent after handler.
+
+        Returns:
+            Message: Reply message.
+        """
+        await self.clear_inline_markup(source=callback, bot=bot)
+        cursor = (await state.get_data()).get('nearby')
+        # Button of an older page or of a finished search
+        if cursor is None or cursor['page'] != int(callback.data.split(':')[1]):
+            callback_answer.text = MT('Эта страница устарела, пришлите локацию ещё раз',
+                                      'This page is outdated, send location again').get(user_lang)
+            return
+        text, keyboard = await self.__nearby_page(user_id=callback.from_user.id, user_lang=user_lang, state=state,
+                                                  lon=cursor['lon'], lat=cursor['lat'], after=cursor['after'],
+                                                  page=cursor['page'])
+        return await callback.message.answer(text, reply_markup=keyboard)
+
+    async def __nearby_page(self, user_id, user_lang, state, lon, lat, after=None, page=1):
+        """
+        Generates expenses nearby page text and next page keyboard. Next page cursor is saved to state data,
+        because sums don't fit into 64 bytes of callback data.
+
+        Args:
+            user_id (int): User's id.
+            user_lang (str): User language.
+            state (FSMContext): Current state.
+            lon (float): Point longitude.
+            lat (float): Point latitude.
+            after (tuple[Decimal, int]): Total and subcategory id of the last row of the previous page.
+            page (int): Page number.
+
+        Returns:
+            tuple[str, InlineKeyboardMarkup | None]: Message text and keyboard, if there are more pages.
+        """
+        rows, has_next = await Expense.select_nearby(user_id=user_id, lon=lon, lat=lat,
+                                                     radius_meters=self.NEARBY_RADIUS,
+                                                     limit=self.NEARBY_PAGE_SIZE, after=after)
+        radius_km = f'{self.NEARBY_RADIUS / 1000:g}'
+        if len(rows) == 0 and after is None:
+            m_texts = MT(f'В радиусе {radius_km} км у вас нет расходов', f'You have no expenses within {radius_km} km')
+            return m_texts.get(user_lang), None
+
+        m_texts = MT(f'Расходы в радиусе {radius_km} км', f'Expenses within {radius_km} km')
+        lines = [f'<b>{m_texts.get(user_lang)}</b>']
+        for row in rows:
+            title = row.title_ru if user_lang == 'ru' else row.title_en
+            lines.append(f'{title}: {MT.format_float(row.amount)} ({row.count})')
+
+        keyboard = None
+        if has_next:
+            last = rows[-1]
+            await state.update_data(nearby={'lon': lon, 'lat': lat, 'after': (last.amount, last.subcategory_id),
+                                            'page': page + 1})
+            keyboard = keyboards.one_button_keyboard(labels=('Далее', 'Next'), callback_data=f'nearby:{page + 1}',
+                                                     user_language=user_lang)
+        else:
+            data = await state.get_data()
+            data.pop('nearby', None)
+            await state.set_data(data)
+        return '\n'.join(lines), keyboard
 
     @staticmethod
     async def send_media_group(paths, bot, chat_id, message_id):
@@ -0,0 +1,53 @@
+import datetime
+from decimal import Decimal
+
+
+class MessageTexts:
+    def __init__(self, ru_text, en_text):
+        """
+        Creates instance.
+
+        Args:
+            ru_text (str): Text to be sent to russian-speaking users.
+            en_text (str): Text to be sent to english-speaking users.
+        """
+        self.ru = ru_text
+        self.en = en_text
+
+    def get(self, user_lang):
+        if user_lang == 'ru':
+            return self.ru
+        else:
+            return self.en
+
+    @staticmethod
+    def format_float(value):
+        """
+        Formats float value.
+
+        Args:
+            value (float): Value to be formatted.
+
+        Returns:
+            str: Formatted value.
+        """
+        if isinstance(value, float) or isinstance(value, Decimal):
+            return f'{value:.2f}'
+        else:
+            return float
+
+    @staticmethod
+    def format_date(value):
+        """
+        Formats date or datetime value.
+
+        Args:
+            value (datetime.datetime | datetime.date): Value to be formatted.
+
+        Returns:
+            str: Formatted value.
+        """
+        if isinstance(value, datetime.datetime):
+            return value.strftime('%d.%m.%Y %H:%M')
+        if isinstance(value, datetime.date):
+            return value.strftime('%d.%m.%Y')
@@ -0,0 +1,237 @@
+"""
+Persistent FSM storage.
+
+States survive bot restarts and are shared between bot processes. State and data of one key are kept in one
+row, data is pickled, so it must contain only plain values (numbers, strings, dates, tuples), not geometries
+or DB objects.
+"""
+import asyncio
+import datetime as dt
+import pickle
+import time
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, BaseEventIsolation, DefaultKeyBuilder
+from sqlalchemy import select, func
+
+from bot.metrics import Gauge, Histogram
+from db import FsmState
+
+
+lock_wait_seconds = Histogram('event_lock_wait_seconds', 'Time spent waiting for per-user event lock')
+locks_held = Gauge('event_locks_held', 'Number of per-user event locks held by this process')
+
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, ttl=dt.timedelta(hours=24), key_builder=None):
+        """
+        Creates instance.
+
+        Args:
+            ttl (datetime.timedelta): Flows not updated for this time are expired.
+            key_builder (KeyBuilder): Storage key builder. Defaults to key with bot id and destiny.
+        """
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True) if key_builder is None \
+            else key_builder
+
+    async def get_record(self, key):
+        """
+        Reads state and data in one query.
+
+        Args:
+            key (StorageKey): Storage key.
+
+        Returns:
+            tuple[str | None, dict]: State and data.
+        """
+        record = await FsmState.select_record(key=self.key_builder.build(key), ttl=self.ttl)
+        if record is None:
+            return None, dict()
+        return record.state, self.__loads(record.data)
+
+    async def set_record(self, key, state, data):
+        """
+        Writes state and data in one statement. Empty record is deleted.
+
+        Args:
+            key (StorageKey): Storage key.
+            state (str | State | None): New state.
+            data (dict): New data.
+        """
+        state = self.__state_name(state)
+        if state is None and not data:
+            return await FsmState.delete_by_key(key=self.key_builder.build(key))
+        await FsmState.upsert(key=self.key_builder.build(key), user_id=key.user_id, ttl=self.ttl, state=state,
+                              data=self.__dumps(data))
+
+    async def set_state(self, key, state=None):
+        await FsmState.upsert(key=self.key_builder.build(key), user_id=key.user_id, ttl=self.ttl,
+                              state=self.__state_name(state))
+
+    async def get_state(self, key):
+        # State is read for every update, data is neither selected nor unpickled for it
+        return await FsmState.select_state(key=self.key_builder.build(key), ttl=self.ttl)
+
+    async def set_data(self, key, data):
+        await FsmState.upsert(key=self.key_builder.build(key), user_id=key.user_id, ttl=self.ttl,
+                              data=self.__dumps(data))
+
+    async def get_data(self, key):
+        _, data = await self.get_record(key)
+        return data
+
+    async def close(self):
+        # Engine is shared with the rest of the bot and is disposed with it
+        pass
+
+    def schedule_cleanup(self, scheduler):
+        """
+        Adds hourly job deleting expired states.
+
+        Args:
+            scheduler (AsyncIOScheduler): Scheduler.
+        """
+        scheduler.add_job(FsmState.delete_expired, trigger='interval', hours=1, replace_existing=True,
+                          args=[int(self.ttl.total_seconds())], id='fsm_state_cleanup',
+                          name='Delete expired FSM states', jobstore='default')
+
+    @staticmethod
+    def __state_name(state):
+        return state.state if isinstance(state, State) else state
+
+    @staticmethod
+    def __dumps(data):
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL) if data else None
+
+    @staticmethod
+    def __loads(data):
+        return dict() if data is None else pickle.loads(data)
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSM context that reads data once and keeps all changes in memory until ``flush`` is called.
+    Handlers use it the same way as FSMContext, so several ``update_data`` and ``set_state`` calls
+    in one handler cost one storage write.
+    """
+    def __init__(self, storage, key, state=None):
+        """
+        Creates instance.
+
+        Args:
+            storage (PostgresStorage): Storage.
+            key (StorageKey): Storage key.
+            state (str | None): Current state already read from storage.
+        """
+        super().__init__(storage=storage, key=key)
+        self.__state = state
+        self.__data = None
+        self.__changed = False
+
+    async def set_state(self, state=None):
+        self.__state = state.state if isinstance(state, State) else state
+        self.__changed = True
+
+    async def get_state(self):
+        return self.__state
+
+    async def set_data(self, data):
+        self.__data = dict(data)
+        self.__changed = True
+
+    async def get_data(self):
+        await self.__load()
+        return self.__data.copy()
+
+    async def update_data(self, data=None, **kwargs):
+        if data:
+            kwargs.update(data)
+        await self.__load()
+        self.__data.update(kwargs)
+        self.__changed = True
+        return self.__data.copy()
+
+    async def clear(self):
+        self.__state = None
+        self.__data = dict()
+        self.__changed = True
+
+    async def flush(self):
+        """
+        Writes buffered changes to storage with one statement.
+        """
+        if not self.__changed:
+            return
+        # Data was neither read nor changed, so only state is written
+        if self.__data is None:
+            await self.storage.set_state(key=self.key, state=self.__state)
+        else:
+            await self.storage.set_record(key=self.key, state=self.__state, data=self.__data)
+        self.__changed = False
+
+    async def __load(self):
+        """
+        Reads data from storage on first access.
+        """
+        if self.__data is None:
+            self.__data = await self.storage.get_data(key=self.key)
+
+
+class PostgresEventIsolation(BaseEventIsolation):
+    """
+    Processes updates of one user one by one across all bot processes with Postgres advisory lock keyed
+    by user id. Updates of different users are processed in parallel.
+
+    Updates of one user in one process wait for each other in memory first, so each user takes one lock
+    connection per process. Updates of other users wait in memory for a free pool connection too, so polling
+    with unbounded number of updates doesn't fail with pool timeout.
+    """
+    def __init__(self, engine):
+        """
+        Creates instance.
+
+        Args:
+            engine (AsyncEngine): Engine with autocommit isolation level and pool reserved for locks.
+        """
+        self.engine = engine
+        # User id -> [local lock, number of updates holding or waiting for it]
+        self.__locks = dict()
+        self.__connections = asyncio.Semaphore(engine.pool.size())
+
+    @asynccontextmanager
+    async def lock(self, key):
+        start = time.perf_counter()
+        async with self.__local_lock(key.user_id), self.__connections:
+            async with self.engine.connect() as connection:
+                await connection.execute(select(func.pg_advisory_lock(key.user_id)))
+                lock_wait_seconds.observe(time.perf_counter() - start)
+                locks_held.inc()
+                try:
+                    yield
+                finally:
+                    locks_held.dec()
+                    await connection.execute(select(func.pg_advisory_unlock(key.user_id)))
+
+    async def close(self):
+        await self.engine.dispose()
+
+    @asynccontextmanager
+    async def __local_lock(self, user_id):
+        """
+        Acquires in-process lock of user. Lock is deleted when no update holds or waits for it.
+
+        Args:
+            user_id (int): User's id.
+        """
+        entry = self.__locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.__locks[user_id]
@@ -0,0 +1,144 @@
+"""
+Bounded processing of webhook updates.
+
+Updates are processed by a fixed number of tasks from a bounded queue in both single and multi-process modes.
+When the queue is full, Telegram gets 429 response and delivers the update later. Updates of one user wait
+in their own queue, so a burst from one user doesn't occupy the tasks waiting for that user's lock.
+"""
+import asyncio
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from loguru import logger
+
+from bot.metrics import Counter, Gauge, Histogram
+
+
+queue_depth = Gauge('update_queue_depth', 'Number of updates waiting for processing')
+queue_wait_seconds = Histogram('update_queue_wait_seconds', 'Time updates spend in queue before processing')
+updates_in_progress = Gauge('updates_in_progress', 'Number of updates being processed')
+updates_rejected = Counter('updates_rejected_total', 'Number of updates rejected because queue is full')
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook request handler that puts updates into bounded queue processed by a fixed number of tasks,
+    instead of creating a task for every update.
+
+    Only the oldest update of each user is in the processing queue. Later updates of the user wait in the user's
+    queue and are moved to the processing queue when the previous one is processed.
+    """
+    # Seconds Telegram is asked to wait before delivering rejected update again
+    RETRY_AFTER = 5
+    # Seconds to process queued updates on shutdown
+    DRAIN_TIMEOUT = 30
+
+    def __init__(self, dispatcher, bot, concurrency, queue_size, **data):
+        """
+        Creates instance.
+
+        Args:
+            dispatcher (Dispatcher): Dispatcher.
+            bot (Bot): Bot instance.
+            concurrency (int): Max number of updates processed at once.
+            queue_size (int): Max number of updates waiting for processing.
+        """
+        super().__init__(dispatcher, bot, handle_in_background=True, **data)
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        # Oldest updates of users, size is limited by the number of queued updates
+        self.queue = asyncio.Queue()
+        # User id -> later updates of the user, key exists while the user has queued or processed update
+        self.__user_queues = dict()
+        self.__queued = 0
+        self.__tasks = []
+
+    def register(self, app, /, path, **kwargs):
+        app.on_startup.append(self.__start)
+        super().register(app, path, **kwargs)
+
+    def in_flight(self):
+        """
+        Returns:
+            int: Number of accepted updates not processed yet.
+        """
+        return self.__queued + int(updates_in_progress.value)
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f'{self.__queued} queued updates are dropped on shutdown')
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        await super().close()
+
+    async def _handle_request_background(self, bot, request):
+        update = await request.json(loads=bot.session.json_loads)
+        if self.__queued >= self.queue_size:
+            updates_rejected.inc()
+            return web.Response(status=429, headers={'Retry-After': str(self.RETRY_AFTER)})
+
+        user_id = update_user_id(update)
+        item = bot, update, user_id, time.monotonic()
+        user_queue = self.__user_queues.get(user_id)
+        if user_queue is None:
+            self.__user_queues[user_id] = deque()
+            self.queue.put_nowait(item)
+        else:
+            user_queue.append(item)
+        self.__queued += 1
+        queue_depth.set(self.__queued)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def __start(self, app):
+        self.__tasks = [asyncio.create_task(self.__process()) for _ in range(self.concurrency)]
+
+    async def __process(self):
+        """
+        Processes queued updates one by one.
+        """
+        while True:
+            bot, update, user_id, queued_at = await self.queue.get()
+            self.__queued -= 1
+            queue_depth.set(self.__queued)
+            queue_wait_seconds.observe(time.monotonic() - queued_at)
+            updates_in_progress.inc()
+            try:
+                await self._background_feed_update(bot=bot, update=update)
+            except Exception as e:
+                logger.error(e)
+            finally:
+                updates_in_progress.dec()
+                # Next update of the user is queued before this one is done, so queue join waits for it
+                user_queue = self.__user_queues[user_id]
+                if user_queue:
+                    self.queue.put_nowait(user_queue.popleft())
+                else:
+                    del self.__user_queues[user_id]
+                self.queue.task_done()
+
+
+def update_user_id(update):
+    """
+    Gets id of the user who sent update.
+
+    Args:
+        update (dict): Telegram update.
+
+    Returns:
+        int: User id. Chat id or update id for updates without user.
+    """
+    for name, payload in update.items():
+        if name == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user')
+        if user is not None:
+            return user['id']
+        chat = payload.get('chat')
+        if chat is not None:
+            return chat['id']
+    return update.get('update_id', 0)
@@ -0,0 +1,244 @@
+"""
+Multi-process webhook mode.
+
+Front process accepts webhook requests and forwards each update to one of worker processes by user id hash,
+so updates of one user are always processed by the same worker in the order they came. Each worker runs its own
+dispatcher on local port ``WEBAPP_PORT + 1 + index``. Worker 0 is primary: it runs scheduled jobs, other workers
+only add jobs to the scheduler. The first start of worker 0 also sets webhook and commands.
+
+Front restarts dead workers without repeating the setup, ``/health`` endpoint reports every worker state. The number of workers is changed
+by restarting the bot with new ``WEBHOOK_WORKERS`` value, front drains forwarding queues before stopping workers.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import setup_application
+from loguru import logger
+
+from bot.metrics import metrics_handler
+from bot.update_queue import BoundedRequestHandler, update_user_id
+from configs import scheduler, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, UPDATE_CONCURRENCY, UPDATE_QUEUE_SIZE
+
+
+WORKER_HOST = '127.0.0.1'
+
+
+def worker_port(index):
+    return int(WEBAPP_PORT) + 1 + index
+
+
+def run_worker(index, primary, setup, create_bot):
+    """
+    Runs worker process web application.
+
+    Args:
+        index (int): Worker index.
+        primary (bool): Whether worker is primary.
+        setup (bool): Whether worker sets up the bot on startup.
+        create_bot (Callable[[bool, bool], tuple[Bot, Dispatcher]]): Creates bot and dispatcher.
+    """
+    bot, dp = create_bot(primary=primary, setup=setup)
+    started_at = time.monotonic()
+
+    app = web.Application()
+    handler = BoundedRequestHandler(dp, bot, concurrency=UPDATE_CONCURRENCY, queue_size=UPDATE_QUEUE_SIZE)
+    handler.register(app, path=WEBHOOK_PATH)
+
+    async def health(request):
+        return web.json_response({
+            'worker': index,
+            'pid': os.getpid(),
+            'primary': primary,
+            'uptime': round(time.monotonic() - started_at),
+            'in_flight': handler.in_flight(),
+        })
+
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_handler)
+
+    if primary:
+        # Scheduler doesn't know about jobs added by other workers, so it checks job store regularly
+        async def wake_scheduler():
+            while True:
+                await asyncio.sleep(60)
+                scheduler.wakeup()
+
+        async def start_wakeups(app):
+            app['wakeup_task'] = asyncio.create_task(wake_scheduler())
+
+        async def stop_wakeups(app):
+            app['wakeup_task'].cancel()
+
+        app.on_startup.append(start_wakeups)
+        app.on_cleanup.append(stop_wakeups)
+
+    setup_application(app, dp, bot=bot)
+    logger.info(f'Webhook worker {index} is ready to start on port {worker_port(index)}')
+    web.run_app(app, host=WORKER_HOST, port=worker_port(index), print=None)
+
+
+class WebhookFront:
+    # Seconds between worker processes liveness checks
+    SUPERVISE_INTERVAL = 5
+    # Seconds to wait for worker response
+    FORWARD_TIMEOUT = 10
+
+    def __init__(self, create_bot, workers):
+        """
+        Creates instance.
+
+        Args:
+            create_bot (Callable[[bool, bool], tuple[Bot, Dispatcher]]): Creates bot and dispatcher in worker process.
+                Must be picklable, so it must be a module level function.
+            workers (int): Number of worker processes.
+        """
+        self.create_bot = create_bot
+        self.workers = workers
+
+        self.__context = multiprocessing.get_context('spawn')
+        self.__processes = [None] * workers
+        self.__queues = []
+        self.__tasks = []
+        self.__session = None
+
+    def run(self):
+        """
+        Starts workers and front web application.
+        """
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get('/health', self.health)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        logger.info(f'Webhook front is ready to start with {self.workers} workers')
+        web.run_app(app, host=WEBAPP_HOST, port=int(WEBAPP_PORT))
+
+    async def on_startup(self, app):
+        self.__session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.FORWARD_TIMEOUT))
+        for index in range(self.workers):
+            self.__start_worker(index, setup=index == 0)
+        self.__queues = [asyncio.Queue() for _ in range(self.workers)]
+        self.__tasks = [asyncio.create_task(self.__forward(index)) for index in range(self.workers)]
+        self.__tasks.append(asyncio.create_task(self.__supervise()))
+
+    async def on_shutdown(self, app):
+        # Let forwarders send accepted updates before workers are stopped
+        await asyncio.gather(*[queue.join() for queue in self.__queues])
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        await self.__session.close()
+
+        # Workers stop gracefully on SIGTERM
+        for process in self.__processes:
+            process.terminate()
+        for process in self.__processes:
+            await asyncio.to_thread(process.join)
+        logger.info('Stopped webhook workers')
+
+    async def handle_update(self, request):
+        """
+        Puts update into its worker queue and waits until worker accepts it. Telegram repeats the update,
+        if worker didn't accept it.
+
+        Args:
+            request (web.Request): Webhook request.
+
+        Returns:
+            web.Response: Empty response, worker response if it rejected the update, 503 if worker
+                is not available.
+        """
+        update = await request.json()
+        index = update_user_id(update) % self.workers
+        accepted = asyncio.get_running_loop().create_future()
+        await self.__queues[index].put((update, accepted))
+        status, headers = await accepted
+        return web.Response(status=status, headers=headers)
+
+    async def health(self, request):
+        """
+        Reports state of every worker.
+
+        Args:
+            request (web.Request): Request.
+
+        Returns:
+            web.Response: JSON with workers states, 503 if any worker is not healthy.
+        """
+        states = await asyncio.gather(*[self.__worker_health(index) for index in range(self.workers)])
+        healthy = all(state['healthy'] for state in states)
+        return web.json_response({'healthy': healthy, 'workers': states}, status=200 if healthy else 503)
+
+    async def __worker_health(self, index):
+        """
+        Requests worker health.
+
+        Args:
+            index (int): Worker index.
+
+        Returns:
+            dict: Worker state.
+        """
+        state = {'worker': index, 'queued': self.__queues[index].qsize()}
+        try:
+            async with self.__session.get(f'http://{WORKER_HOST}:{worker_port(index)}/health',
+                                          timeout=aiohttp.ClientTimeout(total=2)) as response:
+                state.update(await response.json())
+                state['healthy'] = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError):
+            state['healthy'] = False
+        return state
+
+    async def __forward(self, index):
+        """
+        Sends worker updates one by one, so updates of one user keep their order.
+
+        Args:
+            index (int): Worker index.
+        """
+        queue = self.__queues[index]
+        url = f'http://{WORKER_HOST}:{worker_port(index)}{WEBHOOK_PATH}'
+        while True:
+            update, accepted = await queue.get()
+            result = 503, None
+            try:
+                async with self.__session.post(url, json=update) as response:
+                    result = response.status, {'Retry-After': response.headers['Retry-After']} \
+                        if 'Retry-After' in response.headers else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f'Webhook worker {index} did not accept update: {e}')
+            finally:
+                # Request is cancelled, if Telegram closed connection
+                if not accepted.done():
+                    accepted.set_result(result)
+                queue.task_done()
+
+    async def __supervise(self):
+        """
+        Restarts dead worker processes.
+        """
+        while True:
+            await asyncio.sleep(self.SUPERVISE_INTERVAL)
+            for index, process in enumerate(self.__processes):
+                if not process.is_alive():
+                    logger.error(f'Webhook worker {index} exited with code {process.exitcode}, restarting')
+                    self.__start_worker(index)
+
+    def __start_worker(self, index, setup=False):
+        """
+        Starts worker process.
+
+        Args:
+            index (int): Worker index.
+            setup (bool): Whether worker sets up the bot. Only the first start of primary worker does it.
+        """
+        process = self.__context.Process(target=run_worker, args=(index, index == 0, setup, self.create_bot),
+                                         name=f'webhook-worker-{index}', daemon=False)
+        process.start()
+        self.__processes[index] = process
+        logger.info(f'Started webhook worker {index}, pid {process.pid}')
@@ -36,6 +36,34 @@ WEBHOOK_PATH = secrets['WEBHOOK_PATH']
 WEBHOOK_URL = f"{secrets['WEBHOOK_HOST']}{WEBHOOK_PATH}"
 WEBAPP_HOST = secrets['WEBAPP_HOST']
 WEBAPP_PORT = secrets['WEBAPP_PORT']
+# Number of webhook worker processes, updates are distributed between them by user
+WEBHOOK_WORKERS = int(secrets.get('WEBHOOK_WORKERS', 1))
+# Max number of updates processed at once and waiting for processing in one process
+UPDATE_CONCURRENCY = int(secrets.get('UPDATE_CONCURRENCY', 10))
+UPDATE_QUEUE_SIZE = int(secrets.get('UPDATE_QUEUE_SIZE', 500))
+# Max number of interactive and heavy (graphs rendering) handlers running at once in one process,
+# heavy handlers are rejected when their lane is full
+LIGHT_LANE_CONCURRENCY = int(secrets.get('LIGHT_LANE_CONCURRENCY', 8))
+HEAVY_LANE_CONCURRENCY = int(secrets.get('HEAVY_LANE_CONCURRENCY', 2))
+
+# Graphs rendering backend: plotly (default) or agg
+GRAPH_BACKEND = secrets.get('GRAPH_BACKEND', 'plotly')
+
+# Max number of user data exports running at once in all bot processes
+EXPORT_WORKERS = int(secrets.get('EXPORT_WORKERS', 2))
+
+# Max number of user data purges running at once in all bot processes
+PURGE_WORKERS = int(secrets.get('PURGE_WORKERS', 1))
+
+# Unfinished bot dialogs are expired after this number of hours
+FSM_TTL_HOURS = int(secrets.get('FSM_TTL_HOURS', 24))
+
+# Max number of users whose updates are processed at once, each one holds a lock connection.
+# Every update processed at once may take one, so the pool can't be smaller than update concurrency
+EVENT_LOCK_POOL_SIZE = int(secrets.get('EVENT_LOCK_POOL_SIZE', UPDATE_CONCURRENCY))
+if EVENT_LOCK_POOL_SIZE < UPDATE_CONCURRENCY:
+    raise ValueError(f'EVENT_LOCK_POOL_SIZE ({EVENT_LOCK_POOL_SIZE}) must not be less than '
+                     f'UPDATE_CONCURRENCY ({UPDATE_CONCURRENCY})')
 
 if DEBUG:
     sync_engine = create_engine(url=f'postgresql://{DB_URL_DEV}')
@@ -49,6 +77,12 @@ else:
     async_engine = create_async_engine(url=f'postgresql+asyncpg://{DB_URL_PROD}')
 logger.info('Created async engine connection with DB')
 
+# Per-user event locks are held during the whole update processing, so they use their own pool
+# and don't take connections from handlers
+lock_engine = create_async_engine(url=async_engine.url, pool_size=EVENT_LOCK_POOL_SIZE, max_overflow=0,
+                                  isolation_level='AUTOCOMMIT')
+logger.info('Created async engine for event locks')
+
 
 async_sess_maker = async_sessionmaker(bind=async_engine)
 logger.info('Created async session maker bind to async session')
@@ -10,8 +10,16 @@ from .shared_schema import ExpenseCategory
 from .shared_schema import ExpenseSubcategory
 from .shared_schema import ExpenseLimitPeriod
 from .user_based_schema import Expense
+from .user_based_schema import ExpenseDaily
 from .user_based_schema import ExpenseLimit
 from .user_based_schema import Income
+from .user_based_schema import UserTotals
+from .user_based_schema import ExportJob
+from .user_based_schema import PurgeJob
+from .user_based_schema import ExportWatermark
+from .user_based_schema import ExportCache
+from .user_based_schema import FsmState
+from .purge import purge_user
 
 from configs import BASE_DIR
 
@@ -77,5 +85,6 @@ async def insert_or_update_static():
 
 __all__ = (
     'BotUser', 'ExpenseCategory', 'ExpenseSubcategory', 'ExpenseLimitPeriod',
-    'Expense', 'ExpenseLimit', 'Income', 'insert_or_update_static'
+    'Expense', 'ExpenseDaily', 'ExpenseLimit', 'Income', 'UserTotals', 'ExportJob', 'PurgeJob',
+    'ExportWatermark', 'ExportCache', 'FsmState', 'insert_or_update_static', 'purge_user'
 )
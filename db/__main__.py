@@ -0,0 +1,111 @@
+"""
+Database maintenance commands.
+
+Usage:
+    python -m db create-indexes
+    python -m db backfill-rollup [--user-id USER_ID]
+    python -m db check-rollup [--user-id USER_ID]
+    python -m db reconcile-totals [--user-id USER_ID]
+"""
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import text
+
+from db import ExpenseDaily, UserTotals
+from db.user_based_schema import UserBasedBase
+from configs import sync_engine
+
+# Indexes replaced by other indexes, they are dropped once the replacement is created
+OBSOLETE_INDEXES = ('user_based.expense_location_geography_idx', )
+
+
+async def create_indexes(user_id=None):
+    """
+    Creates indexes missing in tables that existed before the indexes were added and drops indexes
+    replaced by them. Tables are created with all their indexes, so the command is only needed once
+    after upgrade of existing database.
+
+    Args:
+        user_id (int): Not used, indexes are created for all users.
+    """
+    created = 0
+    with sync_engine.begin() as connection:
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+    for table in UserBasedBase.metadata.sorted_tables:
+        for index in table.indexes:
+            with sync_engine.begin() as connection:
+                if not sync_engine.dialect.has_index(connection, table.name, index.name, schema=table.schema):
+                    index.create(bind=connection)
+                    print(f'Created index {index.name}')
+                    created += 1
+    print(f'{created} indexes created')
+    with sync_engine.begin() as connection:
+        for index_name in OBSOLETE_INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index_name}'))
+    return 0
+
+
+async def backfill_rollup(user_id=None):
+    """
+    Rebuilds expenses daily rollup from raw expenses.
+
+    Args:
+        user_id (int): User's id. If None, rollup is rebuilt for all users.
+    """
+    await ExpenseDaily.rebuild(user_id=user_id)
+    print('Expense daily rollup rebuilt')
+    return 0
+
+
+async def check_rollup(user_id=None):
+    """
+    Compares expenses daily rollup with raw expenses and prints mismatching keys.
+
+    Args:
+        user_id (int): User's id. If None, all users are checked.
+
+    Returns:
+        int: Exit code, 1 if rollup is inconsistent.
+    """
+    mismatches = await ExpenseDaily.check_consistency(user_id=user_id)
+    for mismatch_user_id, day, subcategory in mismatches:
+        print(f'user_id={mismatch_user_id} day={day} subcategory={subcategory}')
+    print(f'{len(mismatches)} mismatching rows found')
+    return 1 if mismatches else 0
+
+
+async def reconcile_totals(user_id=None):
+    """
+    Recalculates user totals from raw expenses and incomes and prints users whose totals drifted.
+
+    Args:
+        user_id (int): User's id. If None, all users are reconciled.
+    """
+    fixed = await UserTotals.reconcile(user_id=user_id)
+    for fixed_user_id in fixed:
+        print(f'user_id={fixed_user_id}')
+    print(f'{len(fixed)} user totals fixed')
+    return 0
+
+
+COMMANDS = {
+    'create-indexes': create_indexes,
+    'backfill-rollup': backfill_rollup,
+    'check-rollup': check_rollup,
+    'reconcile-totals': reconcile_totals,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m db', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--user-id', type=int, default=None, help='Process only one user')
+    args = parser.parse_args()
+    return asyncio.run(COMMANDS[args.command](user_id=args.user_id))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
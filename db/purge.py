@@ -0,0 +1,97 @@
+"""
+User data purge.
+
+User records are deleted table by table in bounded batches, each batch in its own transaction, so locks are
+held only for a short time even for large accounts. The user row is deleted last, when there is nothing left
+to cascade.
+"""
+import asyncio
+import time
+
+from loguru import logger
+from sqlalchemy import select, delete, tuple_
+
+from .shared_schema import BotUser
+from .user_based_schema import (Expense, ExpenseDaily, ExpenseLimit, Income, UserTotals,
+                                ExportJob, ExportWatermark, ExportCache, FsmState)
+from configs import scheduler, async_sess_maker
+
+
+# Tables referencing user, rollups and caches go after the records they are built from
+PURGE_TABLES = (Expense, Income, ExpenseLimit, ExpenseDaily, UserTotals, ExportJob, ExportWatermark, ExportCache)
+
+
+async def delete_in_batches(table, user_id, batch_size):
+    """
+    Deletes user's rows from table in batches by primary key.
+
+    Args:
+        table (type[UserBasedBase]): Table class with user_id column.
+        user_id (int): User's id.
+        batch_size (int): Max rows deleted in one transaction.
+
+    Returns:
+        int: Number of deleted rows.
+    """
+    primary_key = list(table.__table__.primary_key.columns)
+    batch = select(*primary_key).where(user_id == table.user_id).limit(batch_size)
+    statement = delete(table).where(tuple_(*primary_key).in_(batch))
+
+    deleted = 0
+    while True:
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+        deleted += data.rowcount
+        if data.rowcount < batch_size:
+            return deleted
+        # Let other tasks run between batches
+        await asyncio.sleep(0)
+
+
+async def remove_user_jobs(user_id):
+    """
+    Removes user's expense limits update and delete jobs from scheduler. Job store queries are blocking,
+    so they run in a thread.
+
+    Args:
+        user_id (int): User's id.
+
+    Returns:
+        int: Number of removed jobs.
+    """
+    prefixes = (f'update_el_{user_id}_', f'delete_el_{user_id}_')
+    removed = 0
+    for job in await asyncio.to_thread(scheduler.get_jobs, jobstore='default'):
+        if job.id.startswith(prefixes):
+            await asyncio.to_thread(scheduler.remove_job, job.id, jobstore='default')
+            removed += 1
+    return removed
+
+
+async def purge_user(user_id, batch_size=1000):
+    """
+    Deletes all user's data and scheduled jobs.
+
+    Args:
+        user_id (int): User's id.
+        batch_size (int): Max rows deleted in one transaction.
+
+    Returns:
+        dict[str, int | float]: Number of deleted rows by table name, removed scheduler jobs and elapsed seconds.
+    """
+    start = time.perf_counter()
+    report = dict()
+    for table in PURGE_TABLES:
+        report[table.__tablename__] = await delete_in_batches(table, user_id, batch_size)
+    report[FsmState.__tablename__] = await FsmState.delete_by_user_id(user_id)
+    report['scheduled_jobs'] = await remove_user_jobs(user_id)
+
+    async with async_sess_maker() as session:
+        async with session.begin():
+            data = await session.execute(delete(BotUser).where(user_id == BotUser.tg_id))
+    report[BotUser.__tablename__] = data.rowcount
+
+    report['elapsed'] = round(time.perf_counter() - start, 3)
+    logger.info(f'Purged user {user_id}: {report}')
+    return report
@@ -13,15 +13,19 @@ from sqlalchemy import Integer, SmallInteger
 from sqlalchemy import Numeric
 from sqlalchemy import String
 from sqlalchemy import Boolean
+from sqlalchemy import LargeBinary
 from sqlalchemy import DateTime, Date
-from sqlalchemy import select, delete, update
+from sqlalchemy import Index
+from sqlalchemy import event
+from sqlalchemy import select, delete, update, func, cast, case, tuple_, true, text
+from sqlalchemy import DDL
 from sqlalchemy.sql import functions
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from geoalchemy2 import Geometry
+from geoalchemy2 import Geometry, Geography
 from geoalchemy2.shape import from_shape
 
 import pandas as pd
-import geopandas as gpd
 
 from db import BotUser, ExpenseSubcategory, ExpenseCategory, ExpenseLimitPeriod
 from configs import scheduler, sync_engine, async_sess_maker
@@ -36,7 +40,6 @@ class Expense(UserBasedBase):
     Expenses table.
     """
     __tablename__ = 'expense'
-    __table_args__ = {'extend_existing': True}
 
     expense_id = Column(Integer, Sequence(name='expense_id_seq', schema='user_based'), primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='expense_user_fk'), comment='Owner user ID', index=True)
@@ -45,6 +48,15 @@ class Expense(UserBasedBase):
     event_time = Column(DateTime, nullable=False, default=dt.datetime.now, comment='Payment date and time')
     location = Column(Geometry('POINT', srid=4326), nullable=True, comment='Location coordinates')
 
+    __table_args__ = (
+        # Distance filters are scoped to user and use location cast to geography, btree_gist indexes user_id in GiST
+        Index('expense_user_id_location_geography_idx', user_id, cast(location, Geography('POINT', srid=4326)),
+              postgresql_using='gist'),
+        # Incremental exports read user records after the watermark id
+        Index('expense_user_id_expense_id_idx', user_id, expense_id),
+        {'extend_existing': True},
+    )
+
     @classmethod
     async def create(cls, user_id, amount, subcategory_id, event_time, location):
         """
@@ -78,41 +90,347 @@ class Expense(UserBasedBase):
         new_expense = cls.__new__(cls)
         new_expense.__init__(user_id=user_id, amount=amount, subcategory=subcategory_id, event_time=event_time,
                              location=location)
-        # Save expense to db
+        # Save expense to db together with daily rollup
         async with async_sess_maker() as session:
             async with session.begin():
                 session.add(new_expense)
+                await session.execute(ExpenseDaily.add_expense_statement(user_id=user_id, day=event_time.date(),
+                                                                         subcategory_id=subcategory_id,
+                                                                         amount=amount))
+                await session.execute(UserTotals.add_expense_statement(user_id=user_id, amount=amount))
+                await session.execute(ExportCache.invalidate_statement(user_id=user_id))
 
         # Update relevant expense limits
         await ExpenseLimit.update_balance_after_expense(user_id, event_time, subcategory_id, amount)
 
     @classmethod
-    def select_for_export(cls, user_id, chunk_size=1000, user_lang='ru'):
+    async def select_stats(cls, user_id, min_date=None, user_lang='ru'):
+        """
+        Aggregates user expenses in one query with grouping sets: daily totals by category, totals by category
+        and totals by subcategory.
+
+        Args:
+            user_id (int): User's id.
+            min_date (datetime.date): Min event date. If None, all expenses are aggregated.
+            user_lang (str): User language to select titles.
+
+        Returns:
+            tuple[pd.DataFrame, pd.Series, pd.Series]: Daily totals (day, category, amount), totals by category
+                and totals by subcategory sorted in descending order.
+        """
+        day = ExpenseDaily.day
+        category = ExpenseCategory.title_ru if user_lang == 'ru' else ExpenseCategory.title_en
+        subcategory = ExpenseSubcategory.title_ru if user_lang == 'ru' else ExpenseSubcategory.title_en
+
+        # Daily rollup is read instead of raw expenses, so row count doesn't depend on expenses count
+        query = (select(day.label('day'), category.label('category'), subcategory.label('subcategory'),
+                        functions.sum(ExpenseDaily.amount_sum).label('amount'),
+                        func.grouping(day, category, subcategory).label('grouping_set'))
+                 .join_from(ExpenseDaily, ExpenseSubcategory, ExpenseDaily.subcategory == ExpenseSubcategory.id)
+                 .join_from(ExpenseSubcategory, ExpenseCategory, ExpenseSubcategory.category == ExpenseCategory.id)
+                 .where(user_id == ExpenseDaily.user_id)
+                 .group_by(func.grouping_sets(tuple_(day, category), tuple_(category), tuple_(subcategory)))
+                 .order_by(functions.sum(ExpenseDaily.amount_sum).desc()))
+        if min_date is not None:
+            query = query.where(ExpenseDaily.day >= min_date)
+
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        stats = pd.DataFrame(data.all(), columns=['day', 'category', 'subcategory', 'amount', 'grouping_set'])
+        stats['amount'] = stats['amount'].astype(float)
+
+        # Grouping bitmask has 1 for each column not included in grouping set
+        daily = stats.loc[stats.grouping_set == 0b001, ['day', 'category', 'amount']].sort_values('day')
+        categories = stats.loc[stats.grouping_set == 0b101].set_index('category')['amount']
+        subcategories = stats.loc[stats.grouping_set == 0b110].set_index('subcategory')['amount']
+        return daily.reset_index(drop=True), categories, subcategories
+
+    @classmethod
+    async def select_location_clusters(cls, user_id, min_date=None, eps_meters=300):
+        """
+        Clusters user expense locations in PostGIS, so the result size doesn't depend on expenses count.
+
+        Points outside 1st-99th percentiles of longitude or latitude are dropped as outliers. The rest of points
+        are clustered with DBSCAN, each cluster is represented with its centroid weighted by amount.
+
+        Args:
+            user_id (int): User's id.
+            min_date (datetime.date): Min event date. If None, all expenses are clustered.
+            eps_meters (float): Max distance between points of one cluster in meters.
+
+        Returns:
+            pd.DataFrame: Clusters centroids and totals (lon, lat, amount, count).
+        """
+        points = (select(cls.amount, cls.location,
+                         func.ST_X(cls.location).label('x'), func.ST_Y(cls.location).label('y'))
+                  .where(user_id == cls.user_id)
+                  .where(cls.location.is_not(None)))
+        if min_date is not None:
+            points = points.where(cls.event_time >= min_date)
+        points = points.cte('points')
+
+        # Discrete percentiles keep all points of users with less than 100 locations
+        bounds = select(
+            func.percentile_disc(0.01).within_group(points.c.x).label('x_min'),
+            func.percentile_disc(0.99).within_group(points.c.x).label('x_max'),
+            func.percentile_disc(0.01).within_group(points.c.y).label('y_min'),
+            func.percentile_disc(0.99).within_group(points.c.y).label('y_max'),
+            func.percentile_cont(0.5).within_group(points.c.y).label('y_median'),
+        ).cte('bounds')
+
+        # Web mercator stretches distances by 1 / cos(latitude)
+        eps = eps_meters / func.cos(func.radians(bounds.c.y_median))
+        clustered = (select(points.c.amount, points.c.x, points.c.y,
+                            func.ST_ClusterDBSCAN(func.ST_Transform(points.c.location, 3857), eps, 1)
+                            .over().label('cluster'))
+                     .select_from(points.join(bounds, true()))
+                     .where(points.c.x.between(bounds.c.x_min, bounds.c.x_max))
+                     .where(points.c.y.between(bounds.c.y_min, bounds.c.y_max))
+                     .cte('clustered'))
+
+        total = functions.sum(clustered.c.amount)
+        query = (select(
+            func.coalesce(functions.sum(clustered.c.x * clustered.c.amount) / func.nullif(total, 0),
+                          func.avg(clustered.c.x)).label('lon'),
+            func.coalesce(functions.sum(clustered.c.y * clustered.c.amount) / func.nullif(total, 0),
+                          func.avg(clustered.c.y)).label('lat'),
+            total.label('amount'),
+            functions.count().label('count'))
+            .group_by(clustered.c.cluster)
+            .order_by(total.desc()))
+
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        clusters = pd.DataFrame(data.all(), columns=['lon', 'lat', 'amount', 'count'])
+        return clusters.astype({'lon': float, 'lat': float, 'amount': float, 'count': int})
+
+    @classmethod
+    async def select_nearby(cls, user_id, lon, lat, radius_meters=1000, limit=10, after=None):
         """
-        Returns generator of geopandas.GeoDataFrame with chunk_size in one chunk.
+        Aggregates user expenses within radius around the point by subcategory. Results are sorted by total
+        in descending order and paginated with keyset: next page starts after the last row of the previous one.
+
+        Uses composite GiST index on user id and location cast to geography.
+
+        Args:
+            user_id (int): User's id.
+            lon (float): Point longitude.
+            lat (float): Point latitude.
+            radius_meters (float): Search radius in meters.
+            limit (int): Max rows in page.
+            after (tuple[float, int]): Total and subcategory id of the last row of the previous page.
+                If None, the first page is returned.
+
+        Returns:
+            tuple[list[sqlalchemy.Row], bool]: Rows with subcategory_id, title_ru, title_en, amount and count,
+                True if there are more pages.
+        """
+        point = cast(func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326), Geography('POINT', srid=4326))
+        total = functions.sum(cls.amount)
+        query = (select(ExpenseSubcategory.id.label('subcategory_id'), ExpenseSubcategory.title_ru,
+                        ExpenseSubcategory.title_en, total.label('amount'), functions.count().label('count'))
+                 .join_from(cls, ExpenseSubcategory, cls.subcategory == ExpenseSubcategory.id)
+                 .where(user_id == cls.user_id)
+                 .where(func.ST_DWithin(cls.location_geography(), point, radius_meters))
+                 .group_by(ExpenseSubcategory.id, ExpenseSubcategory.title_ru, ExpenseSubcategory.title_en)
+                 .order_by(total.desc(), ExpenseSubcategory.id.desc())
+                 .limit(limit + 1))
+        if after is not None:
+            query = query.having(tuple_(total, ExpenseSubcategory.id) < tuple_(*after))
+
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        rows = data.all()
+        return rows[:limit], len(rows) > limit
+
+    @classmethod
+    def location_geography(cls):
+        """
+        Location cast to geography. The same expression is indexed, so it must be used in distance filters.
+
+        Returns:
+            sqlalchemy.Cast: Location expression.
+        """
+        return cast(cls.location, Geography('POINT', srid=4326))
+
+    @classmethod
+    async def stream_for_export(cls, user_id, chunk_size=1000, user_lang='ru', geojson=False, after_id=None):
+        """
+        Streams user expenses through server-side cursor, so only one chunk is kept in memory.
+
+        Location is returned as plain lon / lat float columns, so no geometry objects are created while reading.
 
         Args:
             user_id (int): User's id.
             chunk_size (int): Max records in one chunk.
             user_lang (str): User language.
+            geojson (bool): Whether to add geojson column with location encoded by PostGIS.
+            after_id (int): If passed, only expenses created after the one with this id are streamed.
+
+        Yields:
+            pd.DataFrame: Chunk of user expenses (id, event_time, amount, subcategory, category, lon, lat
+                and optional geojson).
+        """
+        subcategory = ExpenseSubcategory.title_ru if user_lang == 'ru' else ExpenseSubcategory.title_en
+        category = ExpenseCategory.title_ru if user_lang == 'ru' else ExpenseCategory.title_en
+        columns = ['id', 'event_time', 'amount', 'subcategory', 'category', 'lon', 'lat']
+        query = select(cls.expense_id, cls.event_time, cls.amount, subcategory.label('subcategory'),
+                       category.label('category'),
+                       func.ST_X(cls.location).label('lon'), func.ST_Y(cls.location).label('lat'))
+        if geojson:
+            query = query.add_columns(func.ST_AsGeoJSON(cls.location, 7).label('geojson'))
+            columns.append('geojson')
+        query = query.where(user_id == cls.user_id)
+        if after_id is not None:
+            query = query.where(cls.expense_id > after_id)
+        query = (query
+                 .join_from(cls, ExpenseSubcategory, ExpenseSubcategory.id == cls.subcategory)
+                 .join_from(ExpenseSubcategory, ExpenseCategory, ExpenseSubcategory.category == ExpenseCategory.id)
+                 .order_by(cls.event_time.desc())
+                 .execution_options(yield_per=chunk_size))
+
+        async with async_sess_maker() as session:
+            data = await session.stream(query)
+            async for partition in data.partitions():
+                yield pd.DataFrame(partition, columns=columns).astype({'amount': float, 'lon': float, 'lat': float})
+
+
+class ExpenseDaily(UserBasedBase):
+    """
+    Expenses daily rollup table. Keeps total, count and max amount of user expenses by day and subcategory.
+
+    Rollup is updated in the same transaction as expense is created. Bulk changes of expenses must be followed
+    by ``rebuild`` call. When the table is created, it is filled from existing expenses.
+    """
+    __tablename__ = 'expense_daily'
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='expense_daily_user_fk'), primary_key=True, nullable=False, comment='Owner user ID')
+    day = Column(Date, primary_key=True, nullable=False, comment='Expenses date')
+    subcategory = Column(SmallInteger, ForeignKey(ExpenseSubcategory.id, ondelete='CASCADE', onupdate='CASCADE', name='expense_daily_subcategory_fk'), primary_key=True, nullable=False, comment='Subcategory ID')
+    amount_sum = Column(Numeric, nullable=False, default=0, comment='Expenses total amount')
+    amount_count = Column(Integer, nullable=False, default=0, comment='Expenses count')
+    amount_max = Column(Numeric, nullable=False, default=0, comment='Expenses max amount')
+
+    @classmethod
+    def add_expense_statement(cls, user_id, day, subcategory_id, amount):
+        """
+        Generates upsert statement that adds one expense to the rollup.
+
+        Args:
+            user_id (int): User's id.
+            day (datetime.date): Expense date.
+            subcategory_id (int): Expense subcategory id.
+            amount (float): Expense amount.
 
         Returns:
-            gpd.GeoDataFrame: Generator of user expenses.
-        """
-        if user_lang == 'ru':
-            query = (select(cls.event_time, cls.amount, cls.location, ExpenseSubcategory.title_ru, ExpenseCategory.title_ru)
-                     .where(user_id == cls.user_id)
-                     .join_from(ExpenseSubcategory, cls, ExpenseSubcategory.id == cls.subcategory)
-                     .join_from(ExpenseSubcategory, ExpenseCategory, ExpenseSubcategory.category == ExpenseCategory.id)
-                     .order_by(cls.event_time.desc()))
-        else:
-            query = (select(cls.event_time, cls.amount, cls.location,
-                            ExpenseSubcategory.title_en, ExpenseCategory.title_en)
-                     .where(user_id == cls.user_id)
-                     .join_from(ExpenseSubcategory, cls)
-                     .order_by(cls.event_time.desc()))
+            sqlalchemy.Insert: Statement to execute.
+        """
+        statement = pg_insert(cls).values(user_id=user_id, day=day, subcategory=subcategory_id, amount_sum=amount,
+                                          amount_count=1, amount_max=amount)
+        return statement.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.day, cls.subcategory],
+            set_=dict(amount_sum=cls.amount_sum + statement.excluded.amount_sum,
+                      amount_count=cls.amount_count + 1,
+                      amount_max=func.greatest(cls.amount_max, statement.excluded.amount_max))
+        )
+
+    @classmethod
+    def __raw_query(cls, user_id=None):
+        """
+        Generates query that aggregates raw expenses the same way rollup does.
 
-        return gpd.read_postgis(sql=query, con=sync_engine, chunksize=chunk_size, geom_col='location', crs=4326)
+        Args:
+            user_id (int): User's id. If None, all users' expenses are aggregated.
+
+        Returns:
+            sqlalchemy.Select: Query object.
+        """
+        day = cast(Expense.event_time, Date)
+        query = (select(Expense.user_id.label('user_id'), day.label('day'), Expense.subcategory.label('subcategory'),
+                        functions.sum(Expense.amount).label('amount_sum'),
+                        functions.count(Expense.expense_id).label('amount_count'),
+                        functions.max(Expense.amount).label('amount_max'))
+                 .group_by(Expense.user_id, day, Expense.subcategory))
+        if user_id is not None:
+            query = query.where(user_id == Expense.user_id)
+        return query
+
+    @classmethod
+    def __insert_raw_statement(cls, user_id=None):
+        """
+        Generates statement that inserts raw expenses aggregated into the rollup.
+
+        Args:
+            user_id (int): User's id. If None, all users' expenses are inserted.
+
+        Returns:
+            sqlalchemy.Insert: Statement to execute.
+        """
+        return pg_insert(cls).from_select(
+            ['user_id', 'day', 'subcategory', 'amount_sum', 'amount_count', 'amount_max'],
+            cls.__raw_query(user_id=user_id))
+
+    @classmethod
+    def fill_created(cls, target, connection, **kw):
+        """
+        Fills rollup from existing expenses right after the table is created, so stats of existing users
+        are not empty. Called by ``create_all`` as table ``after_create`` event listener.
+
+        Args:
+            target (sqlalchemy.Table): Created table.
+            connection (sqlalchemy.Connection): Connection the table is created with.
+        """
+        data = connection.execute(cls.__insert_raw_statement())
+        logger.info(f'Filled created expense daily rollup with {data.rowcount} rows')
+
+    @classmethod
+    async def rebuild(cls, user_id=None):
+        """
+        Recalculates rollup from raw expenses in one transaction.
+
+        Args:
+            user_id (int): User's id. If None, rollup is rebuilt for all users.
+        """
+        delete_stm = delete(cls)
+        if user_id is not None:
+            delete_stm = delete_stm.where(user_id == cls.user_id)
+        insert_stm = cls.__insert_raw_statement(user_id=user_id)
+
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(delete_stm)
+                await session.execute(insert_stm)
+        logger.info(f'Rebuilt expense daily rollup for {"all users" if user_id is None else f"user {user_id}"}')
+
+    @classmethod
+    async def check_consistency(cls, user_id=None):
+        """
+        Compares rollup with raw expenses.
+
+        Args:
+            user_id (int): User's id. If None, all users are checked.
+
+        Returns:
+            list[tuple]: Mismatching (user_id, day, subcategory) keys. Empty list if rollup is consistent.
+        """
+        raw = cls.__raw_query(user_id=user_id).subquery('raw')
+        rollup = select(cls)
+        if user_id is not None:
+            rollup = rollup.where(user_id == cls.user_id)
+        rollup = rollup.subquery('rollup')
+
+        query = (select(func.coalesce(raw.c.user_id, rollup.c.user_id),
+                        func.coalesce(raw.c.day, rollup.c.day),
+                        func.coalesce(raw.c.subcategory, rollup.c.subcategory))
+                 .select_from(raw.join(rollup, (raw.c.user_id == rollup.c.user_id) & (raw.c.day == rollup.c.day)
+                                       & (raw.c.subcategory == rollup.c.subcategory), full=True))
+                 .where(raw.c.amount_sum.is_distinct_from(rollup.c.amount_sum)
+                        | raw.c.amount_count.is_distinct_from(rollup.c.amount_count)
+                        | raw.c.amount_max.is_distinct_from(rollup.c.amount_max)))
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return [tuple(row) for row in data.all()]
 
 
 class ExpenseLimit(UserBasedBase):
@@ -379,7 +697,6 @@ class Income(UserBasedBase):
     Incomes table.
     """
     __tablename__ = 'income'
-    __table_args__ = {'extend_existing': True}
 
     id = Column(Integer, Sequence(name='income_id_seq', schema='user_based'), primary_key=True, nullable=False, comment='Income ID')
     user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE'), nullable=False, comment='User ID', index=True)
@@ -387,6 +704,12 @@ class Income(UserBasedBase):
     event_date = Column(Date, nullable=False, default=dt.date.today, comment='Income date')
     passive_status = Column(Boolean, nullable=False, default=False, comment='Income is passive status')
 
+    __table_args__ = (
+        # Incremental exports read user records after the watermark id
+        Index('income_user_id_id_idx', user_id, id),
+        {'extend_existing': True},
+    )
+
     @classmethod
     async def create(cls, user_id, amount, passive, event_date):
         """
@@ -411,29 +734,710 @@ class Income(UserBasedBase):
         income = cls.__new__(cls)
         income.__init__(user_id=user_id, amount=amount, passive_status=passive, event_date=event_date)
 
-        # Save object to DB
+        # Save object to DB together with user totals
         async with async_sess_maker() as session:
             async with session.begin():
                 session.add(income)
+                await session.execute(UserTotals.add_income_statement(user_id=user_id, amount=amount))
+                await session.execute(ExportCache.invalidate_statement(user_id=user_id))
+
+    @classmethod
+    async def stream_for_export(cls, user_id, chunk_size=1000, after_id=None):
+        """
+        Streams user incomes through server-side cursor, so only one chunk is kept in memory.
+
+        Args:
+            user_id (int): User's id.
+            chunk_size (int): Max records in one chunk.
+            after_id (int): If passed, only incomes created after the one with this id are streamed.
+
+        Yields:
+            pd.DataFrame: Chunk of user incomes (id, event_date, amount, passive_status).
+        """
+        query = select(cls.id, cls.event_date, cls.amount, cls.passive_status).where(user_id == cls.user_id)
+        if after_id is not None:
+            query = query.where(cls.id > after_id)
+        query = query.order_by(cls.event_date.desc()).execution_options(yield_per=chunk_size)
+
+        columns = ['id', 'event_date', 'amount', 'passive_status']
+        async with async_sess_maker() as session:
+            data = await session.stream(query)
+            async for partition in data.partitions():
+                yield pd.DataFrame(partition, columns=columns).astype({'amount': float})
+
+
+class UserTotals(UserBasedBase):
+    """
+    User running totals table. Keeps expenses and incomes count and sum, so profile stats don't need
+    to aggregate all user records.
+
+    Totals are updated in the same transaction as expense or income is created. Drift can be fixed
+    with ``reconcile`` call. Ledger version is incremented on every change, so it identifies the state
+    of user records. When the table is created, it is filled from existing expenses and incomes.
+    """
+    __tablename__ = 'user_totals'
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='user_totals_user_fk'), primary_key=True, nullable=False, comment='User ID')
+    expense_count = Column(Integer, nullable=False, default=0, comment='Expenses count')
+    expense_sum = Column(Numeric, nullable=False, default=0, comment='Expenses total amount')
+    income_count = Column(Integer, nullable=False, default=0, comment='Incomes count')
+    income_sum = Column(Numeric, nullable=False, default=0, comment='Incomes total amount')
+    ledger_version = Column(Integer, nullable=False, default=0, comment='Incremented on every records change')
+
+    @classmethod
+    def __add_statement(cls, user_id, count_column, sum_column, amount):
+        """
+        Generates upsert statement that adds one record to user totals.
+
+        Args:
+            user_id (int): User's id.
+            count_column (str): Name of count column to increment.
+            sum_column (str): Name of sum column to increase.
+            amount (float): Record amount.
+
+        Returns:
+            sqlalchemy.Insert: Statement to execute.
+        """
+        statement = pg_insert(cls).values(**{'user_id': user_id, count_column: 1, sum_column: amount,
+                                             'ledger_version': 1})
+        return statement.on_conflict_do_update(
+            index_elements=[cls.user_id],
+            set_={count_column: getattr(cls, count_column) + 1,
+                  sum_column: getattr(cls, sum_column) + getattr(statement.excluded, sum_column),
+                  'ledger_version': cls.ledger_version + 1}
+        )
+
+    @classmethod
+    def add_expense_statement(cls, user_id, amount):
+        """
+        Generates upsert statement that adds one expense to user totals.
+
+        Args:
+            user_id (int): User's id.
+            amount (float): Expense amount.
+
+        Returns:
+            sqlalchemy.Insert: Statement to execute.
+        """
+        return cls.__add_statement(user_id, 'expense_count', 'expense_sum', amount)
+
+    @classmethod
+    def add_income_statement(cls, user_id, amount):
+        """
+        Generates upsert statement that adds one income to user totals.
+
+        Args:
+            user_id (int): User's id.
+            amount (float): Income amount.
+
+        Returns:
+            sqlalchemy.Insert: Statement to execute.
+        """
+        return cls.__add_statement(user_id, 'income_count', 'income_sum', amount)
+
+    @classmethod
+    async def select_profile(cls, user_id):
+        """
+        Selects user registration date and totals in one query.
+
+        Args:
+            user_id (int): User's id.
+
+        Returns:
+            sqlalchemy.Row | None: Row with registration_date, expense_count, expense_sum, income_count
+                and income_sum, None if user does not exist.
+        """
+        query = (select(BotUser.registration_date,
+                        func.coalesce(cls.expense_count, 0).label('expense_count'),
+                        func.coalesce(cls.expense_sum, 0).label('expense_sum'),
+                        func.coalesce(cls.income_count, 0).label('income_count'),
+                        func.coalesce(cls.income_sum, 0).label('income_sum'))
+                 .outerjoin_from(BotUser, cls, BotUser.tg_id == cls.user_id)
+                 .where(user_id == BotUser.tg_id))
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return data.one_or_none()
+
+    @classmethod
+    async def select_ledger_version(cls, user_id):
+        """
+        Selects user's ledger version.
+
+        Args:
+            user_id (int): User's id.
+
+        Returns:
+            int: Ledger version, 0 if user has no records.
+        """
+        query = select(cls.ledger_version).where(user_id == cls.user_id)
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return data.scalar_one_or_none() or 0
+
+    @classmethod
+    def __insert_raw_statement(cls, user_id=None):
+        """
+        Generates statement that inserts totals calculated from raw expenses and incomes.
+
+        Args:
+            user_id (int): User's id. If None, totals of all users are inserted.
+
+        Returns:
+            sqlalchemy.Insert: Statement to execute.
+        """
+        expenses = (select(Expense.user_id.label('user_id'),
+                           functions.count(Expense.expense_id).label('count'),
+                           functions.sum(Expense.amount).label('sum'))
+                    .group_by(Expense.user_id)
+                    .subquery('expenses'))
+        incomes = (select(Income.user_id.label('user_id'),
+                          functions.count(Income.id).label('count'),
+                          functions.sum(Income.amount).label('sum'))
+                   .group_by(Income.user_id)
+                   .subquery('incomes'))
+        raw_query = (select(BotUser.tg_id,
+                            func.coalesce(expenses.c.count, 0), func.coalesce(expenses.c.sum, 0),
+                            func.coalesce(incomes.c.count, 0), func.coalesce(incomes.c.sum, 0))
+                     .outerjoin_from(BotUser, expenses, BotUser.tg_id == expenses.c.user_id)
+                     .outerjoin_from(BotUser, incomes, BotUser.tg_id == incomes.c.user_id))
+        if user_id is not None:
+            raw_query = raw_query.where(user_id == BotUser.tg_id)
+        return pg_insert(cls).from_select(
+            ['user_id', 'expense_count', 'expense_sum', 'income_count', 'income_sum'], raw_query)
+
+    @classmethod
+    def fill_created(cls, target, connection, **kw):
+        """
+        Fills totals from existing expenses and incomes right after the table is created, so profile stats
+        of existing users are not empty. Called by ``create_all`` as table ``after_create`` event listener.
+
+        Args:
+            target (sqlalchemy.Table): Created table.
+            connection (sqlalchemy.Connection): Connection the table is created with.
+        """
+        data = connection.execute(cls.__insert_raw_statement())
+        logger.info(f'Filled created user totals with {data.rowcount} rows')
+
+    @classmethod
+    async def reconcile(cls, user_id=None):
+        """
+        Recalculates totals from raw expenses and incomes and fixes rows that drifted.
+
+        Args:
+            user_id (int): User's id. If None, all users are reconciled.
+
+        Returns:
+            list[int]: Ids of users whose totals were fixed.
+        """
+        statement = cls.__insert_raw_statement(user_id=user_id)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.user_id],
+            set_=dict(expense_count=statement.excluded.expense_count, expense_sum=statement.excluded.expense_sum,
+                      income_count=statement.excluded.income_count, income_sum=statement.excluded.income_sum,
+                      ledger_version=cls.ledger_version + 1),
+            where=(cls.expense_count.is_distinct_from(statement.excluded.expense_count)
+                   | cls.expense_sum.is_distinct_from(statement.excluded.expense_sum)
+                   | cls.income_count.is_distinct_from(statement.excluded.income_count)
+                   | cls.income_sum.is_distinct_from(statement.excluded.income_sum))
+        ).returning(cls.user_id)
+
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+                fixed = list(data.scalars().all())
+        logger.info(f'Reconciled user totals, {len(fixed)} rows fixed')
+        return fixed
+
+
+class BackgroundJob(UserBasedBase):
+    """
+    Base of jobs tables processed by background workers, so jobs survive bot restarts. Job is claimed by one worker,
+    which reports it alive with heartbeats. Jobs of crashed or stopped workers are claimed again by any process.
+    """
+    __abstract__ = True
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    MAX_ATTEMPTS = 3
+    # Running jobs without heartbeat for longer are considered left by a dead or stopped worker: they don't count
+    # toward running limit and are claimed again or failed if all attempts are used
+    HEARTBEAT_TIMEOUT = dt.timedelta(minutes=5)
+    # Key of transaction advisory lock serializing claims, two-key form doesn't clash with user id locks
+    CLAIM_LOCK_KEY = None
+
+    chat_id = Column(Integer, nullable=False, comment='Chat ID to send result to')
+    status_message_id = Column(Integer, nullable=False, comment='Message ID to show progress in')
+    user_lang = Column(String(3), nullable=False, default='en', comment='User language')
+    status = Column(String(10), nullable=False, default=PENDING, comment='Job status')
+    attempts = Column(SmallInteger, nullable=False, default=0, comment='Number of started attempts')
+    created_at = Column(DateTime, nullable=False, default=dt.datetime.now, comment='Job creation time')
+    started_at = Column(DateTime, nullable=True, comment='Last attempt start time')
+    heartbeat_at = Column(DateTime, nullable=True, comment='Last time the worker running the job reported it alive')
+    finished_at = Column(DateTime, nullable=True, comment='Job finish time')
+
+    @classmethod
+    async def claim(cls, max_running):
+        """
+        Marks the oldest pending or stale running job as running, if less than max_running jobs are running
+        in all bot processes. Running job is stale if its worker hasn't sent heartbeat for HEARTBEAT_TIMEOUT,
+        so jobs of crashed or stopped workers are restarted by any process. Claims are serialized with advisory
+        lock, so the limit is not exceeded by concurrent claims.
+
+        Args:
+            max_running (int): Max number of jobs running at once.
+
+        Returns:
+            sqlalchemy.Row | None: Claimed job columns, None if there are no jobs to claim or limit is reached.
+        """
+        now = dt.datetime.now()
+        alive = cls.heartbeat_at > now - cls.HEARTBEAT_TIMEOUT
+        running = (select(func.count())
+                   .select_from(cls)
+                   .where(cls.status == cls.RUNNING)
+                   .where(alive))
+        claimable = (select(cls.id)
+                     .where((cls.status == cls.PENDING)
+                            | ((cls.status == cls.RUNNING) & ~alive & (cls.attempts < cls.MAX_ATTEMPTS)))
+                     .order_by(cls.id)
+                     .limit(1)
+                     .with_for_update(skip_locked=True)
+                     .scalar_subquery())
+        statement = (update(cls)
+                     .where(cls.id == claimable)
+                     .values(status=cls.RUNNING, attempts=cls.attempts + 1, started_at=now, heartbeat_at=now)
+                     .returning(*cls.__table__.columns)
+                     .execution_options(synchronize_session=False))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(select(func.pg_advisory_xact_lock(cls.CLAIM_LOCK_KEY, 0)))
+                if await session.scalar(running) >= max_running:
+                    return None
+                data = await session.execute(statement)
+                return data.one_or_none()
+
+    @classmethod
+    async def heartbeat(cls, job_id, attempt):
+        """
+        Reports running job alive, so it is not claimed again.
+
+        Args:
+            job_id (int): Job id.
+            attempt (int): Attempt number the job was claimed with.
+
+        Returns:
+            bool: False if the attempt is no longer running, e.g. job was claimed again after heartbeat timeout.
+        """
+        statement = (update(cls)
+                     .where(job_id == cls.id)
+                     .where(attempt == cls.attempts)
+                     .where(cls.status == cls.RUNNING)
+                     .values(heartbeat_at=dt.datetime.now()))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+                return data.rowcount > 0
 
     @classmethod
-    def select_by_user_id(cls, user_id, chunk_size=1000):
+    async def finish(cls, job_id, attempt, success):
         """
-        Returns generator of user incomes. Each chunk contains chunk_size records max.
+        Marks job as done or failed. Nothing is changed if the job was claimed again by another worker.
 
-        Cause of pandas limitations, requires synchronous engine to run.
+        Args:
+            job_id (int): Job id.
+            attempt (int): Attempt number the job was claimed with.
+            success (bool): Whether job succeeded.
+        """
+        statement = (update(cls)
+                     .where(job_id == cls.id)
+                     .where(attempt == cls.attempts)
+                     .where(cls.status == cls.RUNNING)
+                     .values(status=cls.DONE if success else cls.FAILED, finished_at=dt.datetime.now()))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(statement)
+
+    @classmethod
+    async def fail_stale(cls):
+        """
+        Fails stale running jobs that already used all attempts, so they don't block new jobs of their users.
+
+        Returns:
+            list[sqlalchemy.Row]: Failed jobs columns.
+        """
+        statement = (update(cls)
+                     .where(cls.status == cls.RUNNING)
+                     .where(cls.heartbeat_at <= dt.datetime.now() - cls.HEARTBEAT_TIMEOUT)
+                     .where(cls.attempts >= cls.MAX_ATTEMPTS)
+                     .values(status=cls.FAILED, finished_at=dt.datetime.now())
+                     .returning(*cls.__table__.columns))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+                jobs = list(data.all())
+        if len(jobs) > 0:
+            logger.info(f'Failed {len(jobs)} stale jobs in {cls.__tablename__}')
+        return jobs
+
+
+class ExportJob(BackgroundJob):
+    """
+    User data export jobs table.
+    """
+    __tablename__ = 'export_job'
+    __table_args__ = (
+        # User can have only one pending or running export
+        Index('export_job_active_user_idx', 'user_id', unique=True,
+              postgresql_where=text("status IN ('pending', 'running')")),
+        {'extend_existing': True},
+    )
+
+    CLAIM_LOCK_KEY = 37
+
+    id = Column(Integer, Sequence(name='export_job_id_seq', schema='user_based'), primary_key=True, nullable=False, comment='Job ID')
+    user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='export_job_user_fk'), nullable=False, comment='User ID')
+    export_format = Column(String(16), nullable=True, comment='Export format, default formats if null')
+    incremental = Column(Boolean, nullable=False, default=False, comment='Export only records created since last export')
+
+    @classmethod
+    async def create(cls, user_id, chat_id, status_message_id, user_lang, export_format=None, incremental=False):
+        """
+        Saves new pending export job.
 
         Args:
             user_id (int): User's id.
-            chunk_size (int): Max chunk size.
+            chat_id (int): Chat ID to send export to.
+            status_message_id (int): Message ID to show progress in.
+            user_lang (str): User language.
+            export_format (str): Export format name. If None, default formats are used.
+            incremental (bool): Whether to export only records created since last successful export.
 
         Returns:
-            Generator[gpd.GeoDataFrame]: Generator of user incomes.
+            int | None: Job id, None if user already has pending or running export.
         """
-        query = (select(cls.event_date, cls.amount, cls.passive_status)
+        statement = (pg_insert(cls)
+                     .values(user_id=user_id, chat_id=chat_id, status_message_id=status_message_id,
+                             user_lang=user_lang, export_format=export_format, incremental=incremental,
+                             status=cls.PENDING, attempts=0, created_at=dt.datetime.now())
+                     .on_conflict_do_nothing()
+                     .returning(cls.id))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+                return data.scalar_one_or_none()
+
+
+class PurgeJob(BackgroundJob):
+    """
+    User data purge jobs table. User id has no foreign key, so the job outlives the user row it deletes.
+    """
+    __tablename__ = 'purge_job'
+    __table_args__ = (
+        # User can have only one pending or running purge
+        Index('purge_job_active_user_idx', 'user_id', unique=True,
+              postgresql_where=text("status IN ('pending', 'running')")),
+        {'extend_existing': True},
+    )
+
+    CLAIM_LOCK_KEY = 40
+
+    id = Column(Integer, Sequence(name='purge_job_id_seq', schema='user_based'), primary_key=True, nullable=False, comment='Job ID')
+    user_id = Column(Integer, nullable=False, comment='User ID')
+
+    @classmethod
+    async def create(cls, user_id, chat_id, status_message_id, user_lang):
+        """
+        Saves new pending purge job.
+
+        Args:
+            user_id (int): User's id.
+            chat_id (int): Chat ID to send result to.
+            status_message_id (int): Message ID to show result in.
+            user_lang (str): User language.
+
+        Returns:
+            int | None: Job id, None if user already has pending or running purge.
+        """
+        statement = (pg_insert(cls)
+                     .values(user_id=user_id, chat_id=chat_id, status_message_id=status_message_id,
+                             user_lang=user_lang, status=cls.PENDING, attempts=0, created_at=dt.datetime.now())
+                     .on_conflict_do_nothing()
+                     .returning(cls.id))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+                return data.scalar_one_or_none()
+
+
+class ExportWatermark(UserBasedBase):
+    """
+    Last exported record ids for incremental exports, one row for each user and export type.
+    """
+    __tablename__ = 'export_watermark'
+    __table_args__ = {'extend_existing': True}
+
+    EXPENSES = 'expenses'
+    INCOMES = 'incomes'
+
+    user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='export_watermark_user_fk'), primary_key=True, nullable=False, comment='User ID')
+    export_type = Column(String(10), primary_key=True, nullable=False, comment='Exported records type')
+    last_id = Column(Integer, nullable=False, comment='Last exported record ID')
+    updated_at = Column(DateTime, nullable=False, default=dt.datetime.now, comment='Last successful export time')
+
+    @classmethod
+    async def select_by_user_id(cls, user_id):
+        """
+        Gets user's watermarks.
+
+        Args:
+            user_id (int): User's id.
+
+        Returns:
+            dict[str, int]: Last exported record id by export type. Types never exported are missing.
+        """
+        statement = select(cls.export_type, cls.last_id).where(user_id == cls.user_id)
+        async with async_sess_maker() as session:
+            data = await session.execute(statement)
+            return dict(data.all())
+
+    @classmethod
+    async def advance(cls, user_id, last_ids):
+        """
+        Moves user's watermarks forward after successful export. Watermarks never move back.
+
+        Args:
+            user_id (int): User's id.
+            last_ids (dict[str, int]): Last exported record id by export type.
+        """
+        if len(last_ids) == 0:
+            return
+        now = dt.datetime.now()
+        statement = pg_insert(cls).values([dict(user_id=user_id, export_type=export_type, last_id=last_id,
+                                                updated_at=now)
+                                           for export_type, last_id in last_ids.items()])
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.export_type],
+            set_=dict(last_id=func.greatest(cls.last_id, statement.excluded.last_id),
+                      updated_at=statement.excluded.updated_at)
+        )
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(statement)
+
+
+class ExportCache(UserBasedBase):
+    """
+    Telegram file ids of finished exports. Cached export is sent again by file ids while user's ledger version
+    is the same. Entries are deleted on any write to user's expenses or incomes.
+    """
+    __tablename__ = 'export_cache'
+    __table_args__ = {'extend_existing': True}
+
+    # Key for exports with default formats
+    DEFAULT_FORMAT = 'default'
+
+    user_id = Column(Integer, ForeignKey(BotUser.tg_id, ondelete='CASCADE', onupdate='CASCADE', name='export_cache_user_fk'), primary_key=True, nullable=False, comment='User ID')
+    export_format = Column(String(16), primary_key=True, nullable=False, comment='Export format')
+    user_lang = Column(String(3), primary_key=True, nullable=False, comment='Export language')
+    ledger_version = Column(Integer, nullable=False, comment='User ledger version at export start')
+    file_ids = Column(ARRAY(String), nullable=False, comment='Telegram file ids of export archives')
+    created_at = Column(DateTime, nullable=False, default=dt.datetime.now, comment='Export time')
+
+    @classmethod
+    async def select_file_ids(cls, user_id, export_format, user_lang):
+        """
+        Selects cached export file ids, if user's records haven't changed since export.
+
+        Args:
+            user_id (int): User's id.
+            export_format (str | None): Export format name, None for default formats.
+            user_lang (str): Export language.
+
+        Returns:
+            list[str] | None: File ids, None if there is no valid cached export.
+        """
+        query = (select(cls.file_ids)
+                 .join_from(cls, UserTotals, UserTotals.user_id == cls.user_id)
                  .where(user_id == cls.user_id)
-                 .order_by(cls.event_date.desc()))
-        return pd.read_sql(sql=query, con=sync_engine, chunksize=chunk_size)
+                 .where(cls.export_format == (export_format or cls.DEFAULT_FORMAT))
+                 .where(user_lang == cls.user_lang)
+                 .where(cls.ledger_version == UserTotals.ledger_version))
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return data.scalar_one_or_none()
+
+    @classmethod
+    async def save(cls, user_id, export_format, user_lang, ledger_version, file_ids):
+        """
+        Saves finished export file ids.
+
+        Args:
+            user_id (int): User's id.
+            export_format (str | None): Export format name, None for default formats.
+            user_lang (str): Export language.
+            ledger_version (int): User's ledger version read before export started.
+            file_ids (list[str]): Telegram file ids of export archives.
+        """
+        statement = pg_insert(cls).values(user_id=user_id, export_format=export_format or cls.DEFAULT_FORMAT,
+                                          user_lang=user_lang, ledger_version=ledger_version, file_ids=file_ids,
+                                          created_at=dt.datetime.now())
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.export_format, cls.user_lang],
+            set_=dict(ledger_version=statement.excluded.ledger_version, file_ids=statement.excluded.file_ids,
+                      created_at=statement.excluded.created_at)
+        )
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(statement)
+
+    @classmethod
+    def invalidate_statement(cls, user_id):
+        """
+        Generates statement that deletes user's cached exports.
+
+        Args:
+            user_id (int): User's id.
+
+        Returns:
+            sqlalchemy.Delete: Statement to execute.
+        """
+        return delete(cls).where(user_id == cls.user_id)
+
+
+class FsmState(UserBasedBase):
+    """
+    Bot FSM states table. State and pickled data of one storage key are kept in one row. Rows not updated
+    for longer than TTL are treated as empty and deleted by cleanup job. User id of the key is kept in its own
+    column, so user's rows are deleted by index.
+    """
+    __tablename__ = 'fsm_state'
+    __table_args__ = {'extend_existing': True}
+
+    key = Column(String(255), primary_key=True, nullable=False, comment='Storage key')
+    user_id = Column(Integer, nullable=False, index=True, comment='User ID of storage key')
+    state = Column(String(255), nullable=True, comment='Current state')
+    data = Column(LargeBinary, nullable=True, comment='Pickled state data, null if empty')
+    updated_at = Column(DateTime, nullable=False, default=dt.datetime.now, index=True, comment='Last write time')
+
+    @classmethod
+    async def select_record(cls, key, ttl):
+        """
+        Selects state and data of storage key.
+
+        Args:
+            key (str): Storage key.
+            ttl (datetime.timedelta): Max age of the row.
+
+        Returns:
+            sqlalchemy.Row | None: Row with state and data, None if there is no fresh row.
+        """
+        query = (select(cls.state, cls.data)
+                 .where(key == cls.key)
+                 .where(cls.updated_at >= dt.datetime.now() - ttl))
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return data.one_or_none()
+
+    @classmethod
+    async def select_state(cls, key, ttl):
+        """
+        Selects state of storage key without data.
+
+        Args:
+            key (str): Storage key.
+            ttl (datetime.timedelta): Max age of the row.
+
+        Returns:
+            str | None: State, None if there is no fresh row.
+        """
+        query = (select(cls.state)
+                 .where(key == cls.key)
+                 .where(cls.updated_at >= dt.datetime.now() - ttl))
+        async with async_sess_maker() as session:
+            data = await session.execute(query)
+        return data.scalar_one_or_none()
+
+    @classmethod
+    async def upsert(cls, key, user_id, ttl, **values):
+        """
+        Writes state and / or data of storage key. Column not written is reset, if the row is expired.
+        Row left with neither state nor data is deleted.
+
+        Args:
+            key (str): Storage key.
+            user_id (int): User's id of storage key.
+            ttl (datetime.timedelta): Max age of the row.
+            **values: New state and / or data.
+        """
+        now = dt.datetime.now()
+        set_ = dict(values, updated_at=now)
+        for column in (cls.state, cls.data):
+            if column.name not in values:
+                set_[column.name] = case((cls.updated_at < now - ttl, None), else_=column)
+        statement = pg_insert(cls).values(key=key, user_id=user_id, **values, updated_at=now)
+        statement = statement.on_conflict_do_update(index_elements=[cls.key], set_=set_)
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(statement)
+                if any(value is None for value in values.values()):
+                    await session.execute(delete(cls)
+                                          .where(key == cls.key)
+                                          .where(cls.state.is_(None))
+                                          .where(cls.data.is_(None)))
+
+    @classmethod
+    async def delete_by_key(cls, key):
+        """
+        Deletes storage key row.
+
+        Args:
+            key (str): Storage key.
+        """
+        async with async_sess_maker() as session:
+            async with session.begin():
+                await session.execute(delete(cls).where(key == cls.key))
+
+    @classmethod
+    async def delete_by_user_id(cls, user_id):
+        """
+        Deletes all user's rows.
+
+        Args:
+            user_id (int): User's id.
+
+        Returns:
+            int: Number of deleted rows.
+        """
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(delete(cls).where(user_id == cls.user_id))
+        return data.rowcount
+
+    @classmethod
+    async def delete_expired(cls, ttl_seconds):
+        """
+        Deletes rows of abandoned flows.
+
+        Args:
+            ttl_seconds (int): Max age of the row in seconds.
+        """
+        statement = delete(cls).where(cls.updated_at < dt.datetime.now() - dt.timedelta(seconds=ttl_seconds))
+        async with async_sess_maker() as session:
+            async with session.begin():
+                data = await session.execute(statement)
+        logger.info(f'Deleted {data.rowcount} expired FSM states')
+
+
 
+# Composite GiST index on expenses needs btree_gist for user id column
+event.listen(Expense.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+# Rollup and totals are filled from raw records when they are created, so raw records tables are created first
+ExpenseDaily.__table__.add_is_dependent_on(Expense.__table__)
+UserTotals.__table__.add_is_dependent_on(Expense.__table__)
+UserTotals.__table__.add_is_dependent_on(Income.__table__)
+event.listen(ExpenseDaily.__table__, 'after_create', ExpenseDaily.fill_created)
+event.listen(UserTotals.__table__, 'after_create', UserTotals.fill_created)
 
 UserBasedBase.metadata.create_all(bind=sync_engine, checkfirst=True)
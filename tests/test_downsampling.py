@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from bot.internal.downsampling import lttb
+
+
+@pytest.mark.parametrize('threshold', [2, 10, 11])
+def test_short_series_is_kept(threshold):
+    x = np.arange(10)
+
+    np.testing.assert_array_equal(lttb(x, x ** 2, threshold), np.arange(10))
+
+
+def test_selects_threshold_points_with_ends():
+    rng = np.random.default_rng(0)
+    x = np.arange(1000)
+    y = rng.normal(size=1000)
+
+    indices = lttb(x, y, 50)
+
+    assert indices.shape == (50, )
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_keeps_peaks():
+    x = np.arange(500)
+    y = np.zeros(500)
+    y[137] = 100
+    y[402] = -50
+
+    indices = lttb(x, y, 20)
+
+    assert 137 in indices
+    assert 402 in indices
+
+
+def test_accepts_datetime_as_numbers():
+    dates = np.arange('2024-01-01', '2024-12-31', dtype='datetime64[D]')
+    y = np.sin(np.arange(dates.shape[0]))
+
+    indices = lttb(dates.astype('datetime64[s]').astype(np.int64), y, 30)
+
+    assert indices.shape == (30, )
@@ -0,0 +1,116 @@
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bot.internal.export import CsvWriter, GeoJsonWriter, ExportArchive, parse_export_args
+
+
+def expenses(rows, start=0):
+    """
+    Expenses chunk, the last expense has no location.
+    """
+    located = max(rows - 1, 0)
+    return pd.DataFrame({
+        'i': range(start + 1, start + rows + 1),
+        'amount': [10.5] * rows,
+        'category': ['Еда'] * rows,
+        'lon': [37.6173] * located + [np.nan] * (rows - located),
+        'lat': [55.7558] * located + [np.nan] * (rows - located),
+    })
+
+
+def test_geojson_is_written_by_chunks(tmp_path):
+    path = tmp_path / 'expenses.geojson'
+    writer = GeoJsonWriter(str(path))
+    writer.write(expenses(3))
+    writer.write(expenses(0))
+    writer.write(expenses(2, start=3))
+    writer.close()
+
+    collection = json.loads(path.read_text(encoding='utf-8'))
+
+    assert collection['type'] == 'FeatureCollection'
+    features = collection['features']
+    assert [feature['properties']['i'] for feature in features] == [1, 2, 3, 4, 5]
+    assert features[0]['properties']['category'] == 'Еда'
+    assert features[0]['geometry'] == {'type': 'Point', 'coordinates': [37.6173, 55.7558]}
+    assert features[2]['geometry'] is None
+    assert 'lon' not in features[0]['properties']
+
+
+def test_geojson_uses_encoded_geometries(tmp_path):
+    path = tmp_path / 'expenses.geojson'
+    data = expenses(2).assign(geojson=['{"type":"Point","coordinates":[1,2]}', None])
+    writer = GeoJsonWriter(str(path))
+    writer.write(data)
+    writer.close()
+
+    features = json.loads(path.read_text(encoding='utf-8'))['features']
+
+    assert features[0]['geometry'] == {'type': 'Point', 'coordinates': [1, 2]}
+    assert features[1]['geometry'] is None
+
+
+def test_empty_geojson_is_valid(tmp_path):
+    path = tmp_path / 'expenses.geojson'
+    writer = GeoJsonWriter(str(path))
+    writer.close()
+
+    assert json.loads(path.read_text(encoding='utf-8')) == {'type': 'FeatureCollection', 'features': []}
+
+
+def test_archive_is_split_into_parts(tmp_path):
+    archive = ExportArchive(user_id=1, temp_folder=str(tmp_path), max_part_size=1000)
+    for chunk in range(5):
+        archive.write('expenses', expenses(20, start=chunk * 20), CsvWriter)
+        archive.write('expenses', expenses(20, start=chunk * 20), GeoJsonWriter)
+    paths = archive.close()
+
+    assert len(paths) > 1
+    rows = []
+    for path in paths:
+        with zipfile.ZipFile(path) as part:
+            assert sorted(part.namelist()) == ['expenses.csv', 'expenses.geojson']
+            # Every part is a complete file, not a piece of one
+            features = json.loads(part.read('expenses.geojson'))['features']
+            with part.open('expenses.csv') as member:
+                csv_rows = pd.read_csv(member)['i'].tolist()
+            assert [feature['properties']['i'] for feature in features] == csv_rows
+            rows.extend(csv_rows)
+    assert rows == list(range(1, 101))
+
+    archive.cleanup()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_archive_fits_one_part(tmp_path):
+    archive = ExportArchive(user_id=1, temp_folder=str(tmp_path))
+    archive.write('expenses', expenses(20), CsvWriter)
+    archive.write('incomes', expenses(5), CsvWriter)
+    paths = archive.close()
+
+    assert len(paths) == 1
+    with zipfile.ZipFile(paths[0]) as part:
+        assert sorted(part.namelist()) == ['expenses.csv', 'incomes.csv']
+    archive.cleanup()
+
+
+@pytest.mark.parametrize('args, expected', [
+    (None, (None, False)),
+    ('', (None, False)),
+    ('new', (None, True)),
+    ('GeoJSON', ('geojson', False)),
+    ('new parquet', ('parquet', True)),
+    ('csv  NEW', ('csv', True)),
+])
+def test_parse_export_args(args, expected):
+    assert parse_export_args(args) == expected
+
+
+@pytest.mark.parametrize('args', ['xlsx', 'csv parquet', 'new csv geojson'])
+def test_parse_export_args_rejects_formats(args):
+    with pytest.raises(ValueError):
+        parse_export_args(args)
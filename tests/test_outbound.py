@@ -0,0 +1,127 @@
+import pytest
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendMessage
+
+from bot import outbound
+from bot.outbound import EditCoalescingMiddleware, EditCoalescingRequestMiddleware, TokenBucket
+
+
+class StubSession(BaseSession):
+    """
+    Session recording requests instead of sending them to Telegram.
+    """
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+        self.middleware(EditCoalescingRequestMiddleware())
+
+    async def make_request(self, bot, method, timeout=None):
+        self.sent.append(method)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def bot():
+    return Bot(token='42:TEST', session=StubSession())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Monotonic clock moved by test instead of real time.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(outbound.time, 'monotonic', lambda: now[0])
+    return now
+
+
+async def remove_markup(event, data):
+    await data['bot'].edit_message_reply_markup(chat_id=1, message_id=2, reply_markup=None)
+
+
+@pytest.mark.asyncio
+async def test_removal_is_sent_after_handler(bot):
+    await EditCoalescingMiddleware()(remove_markup, object(), {'bot': bot})
+
+    assert [type(method) for method in bot.session.sent] == [EditMessageReplyMarkup]
+
+
+@pytest.mark.asyncio
+async def test_removal_is_sent_when_handler_fails(bot):
+    async def handler(event, data):
+        await remove_markup(event, data)
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        await EditCoalescingMiddleware()(handler, object(), {'bot': bot})
+
+    assert [type(method) for method in bot.session.sent] == [EditMessageReplyMarkup]
+
+
+@pytest.mark.asyncio
+async def test_removal_is_dropped_by_text_edit(bot):
+    async def handler(event, data):
+        await remove_markup(event, data)
+        await data['bot'].edit_message_text(chat_id=1, message_id=2, text='Done')
+
+    await EditCoalescingMiddleware()(handler, object(), {'bot': bot})
+
+    assert [type(method) for method in bot.session.sent] == [EditMessageText]
+
+
+@pytest.mark.asyncio
+async def test_removal_is_sent_before_other_chat_request(bot):
+    async def handler(event, data):
+        await remove_markup(event, data)
+        await data['bot'].send_message(chat_id=1, text='Next')
+
+    await EditCoalescingMiddleware()(handler, object(), {'bot': bot})
+
+    assert [type(method) for method in bot.session.sent] == [EditMessageReplyMarkup, SendMessage]
+
+
+def test_bucket_allows_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(1)
+
+
+def test_bucket_reservations_are_spaced_by_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=1)
+
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0, 0.5, 1, 1.5])
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=10, capacity=5)
+    for _ in range(5):
+        bucket.reserve()
+    assert not bucket.idle()
+
+    clock[0] += 0.2
+    assert bucket.delay() == 0
+    assert bucket.tokens == pytest.approx(2)
+
+    clock[0] += 1
+    assert bucket.idle()
+    assert bucket.tokens == 5
+
+
+def test_bucket_pause_delays_tokens(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    bucket.pause(10)
+    bucket.pause(5)
+
+    assert bucket.delay() == pytest.approx(10)
+    assert bucket.reserve() == pytest.approx(10)
+
+    clock[0] += 10
+    assert bucket.delay() == 0
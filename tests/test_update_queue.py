@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiogram import Bot
+
+from bot.update_queue import BoundedRequestHandler, update_user_id
+
+
+def message(update_id, user_id, chat_id=None):
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'from': {'id': user_id},
+                        'chat': {'id': user_id if chat_id is None else chat_id}}}
+
+
+class StubRequest:
+    """
+    Webhook request with update payload.
+    """
+    def __init__(self, update):
+        self.update = update
+
+    async def json(self, loads=None):
+        return self.update
+
+
+class RecordingHandler(BoundedRequestHandler):
+    """
+    Handler recording processed updates instead of feeding them to dispatcher. Update processing
+    finishes when test releases it.
+    """
+    def __init__(self, bot, **kwargs):
+        super().__init__(dispatcher=None, bot=bot, **kwargs)
+        self.started = []
+        self.finished = []
+        self.releases = dict()
+
+    async def _background_feed_update(self, bot, update):
+        update_id = update['update_id']
+        self.started.append(update_id)
+        release = self.releases.setdefault(update_id, asyncio.Event())
+        await release.wait()
+        self.finished.append(update_id)
+
+    def release(self, update_id):
+        self.releases.setdefault(update_id, asyncio.Event()).set()
+
+
+@pytest.mark.parametrize('update, expected', [
+    (message(1, user_id=7, chat_id=-100), 7),
+    ({'update_id': 2, 'callback_query': {'id': 'q', 'from': {'id': 8}}}, 8),
+    ({'update_id': 3, 'my_chat_member': {'chat': {'id': -100}, 'from': {'id': 9}}}, 9),
+    ({'update_id': 4, 'poll_answer': {'poll_id': 'p', 'user': {'id': 10}}}, 10),
+    ({'update_id': 5, 'channel_post': {'message_id': 1, 'chat': {'id': -200}}}, -200),
+    ({'update_id': 6, 'poll': {'id': 'p'}}, 6),
+])
+def test_update_user_id(update, expected):
+    assert update_user_id(update) == expected
+
+
+async def start(handler):
+    app = web.Application()
+    handler.register(app, path='/webhook')
+    app.freeze()
+    await app.startup()
+    return app
+
+
+async def send(handler, bot, update):
+    return await handler._handle_request_background(bot, StubRequest(update))
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_user_updates_are_processed_one_by_one_in_order():
+    bot = Bot(token='42:TEST')
+    handler = RecordingHandler(bot, concurrency=3, queue_size=10)
+    await start(handler)
+
+    for update_id in (1, 2, 3):
+        await send(handler, bot, message(update_id, user_id=7))
+    await settle()
+    assert handler.started == [1]
+
+    handler.release(1)
+    await settle()
+    assert handler.started == [1, 2]
+
+    handler.release(2)
+    handler.release(3)
+    await asyncio.wait_for(handler.queue.join(), timeout=1)
+    assert handler.finished == [1, 2, 3]
+    await handler.close()
+
+
+@pytest.mark.asyncio
+async def test_other_users_are_not_blocked_by_busy_user():
+    bot = Bot(token='42:TEST')
+    handler = RecordingHandler(bot, concurrency=2, queue_size=10)
+    await start(handler)
+
+    for update_id in (1, 2, 3):
+        await send(handler, bot, message(update_id, user_id=7))
+    await send(handler, bot, message(4, user_id=8))
+    await settle()
+
+    # The second task takes the other user's update instead of waiting for the busy user
+    assert handler.started == [1, 4]
+    assert handler.in_flight() == 4
+
+    for update_id in (1, 2, 3, 4):
+        handler.release(update_id)
+    await asyncio.wait_for(handler.queue.join(), timeout=1)
+    assert sorted(handler.finished) == [1, 2, 3, 4]
+    assert handler.in_flight() == 0
+    await handler.close()
+
+
+@pytest.mark.asyncio
+async def test_update_is_rejected_when_queue_is_full():
+    bot = Bot(token='42:TEST')
+    handler = RecordingHandler(bot, concurrency=1, queue_size=2)
+
+    responses = [await send(handler, bot, message(update_id, user_id=update_id)) for update_id in (1, 2, 3)]
+
+    assert [response.status for response in responses] == [200, 200, 429]
+    assert responses[2].headers['Retry-After'] == str(BoundedRequestHandler.RETRY_AFTER)
+    await bot.session.close()